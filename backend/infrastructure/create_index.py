@@ -1,8 +1,10 @@
-from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy import NotFoundError, OpenSearch, RequestsHttpConnection
 from requests_aws4auth import AWS4Auth
+import argparse
 import boto3
 import json
 import time
+from datetime import datetime
 
 # Load config
 with open('config.json', 'r') as f:
@@ -78,6 +80,7 @@ index_mapping = {
             "city_region": {"type": "keyword"},
             "map_coordinates_latitude": {"type": "float"},
             "map_coordinates_longitude": {"type": "float"},
+            "location": {"type": "geo_point"},
             "for_sale": {"type": "boolean"},
             "for_rent": {"type": "boolean"},
             "completion_status": {"type": "keyword"},
@@ -96,11 +99,33 @@ index_mapping = {
             "building_floor_count": {"type": "integer"},
             "listing_floor_number": {"type": "integer"},
             "combined_text": {"type": "text"},
-            "date_scraped": {"type": "date"}
+            # Prompt summary built at ingestion - stored, not searched
+            "summary": {"type": "text", "index": False},
+            "date_scraped": {"type": "date"},
+            # Near-duplicate listings collapsed into this one at ingestion -
+            # returned with the document, never searched
+            "alternate_listings": {"type": "object", "enabled": False}
         }
     }
 }
 
+# Applied while a new generation is bulk loaded, then reverted by reindex.py
+LOAD_SETTINGS = {
+    "refresh_interval": "-1",
+    "number_of_replicas": 0
+}
+
+SEARCH_SETTINGS = {
+    "refresh_interval": "1s",
+    "number_of_replicas": 1
+}
+
+# Partitioned layouts (INDEX_PARTITIONING on both Lambdas) - one index per
+# listing type, optionally per property type. Types outside this list are
+# created on first write from the index template.
+LISTING_PARTITIONS = ['sale', 'rent']
+PROPERTY_TYPE_PARTITIONS = ['apartment', 'villa', 'penthouse', 'townhouse', 'other']
+
 def test_connection(max_retries=3):
     """Test connection with retries"""
     for attempt in range(max_retries):
@@ -120,27 +145,109 @@ def test_connection(max_retries=3):
                 print(f"✗ Connection failed after {max_retries} attempts: {e}")
                 return False
 
+def generation_name():
+    """Versioned physical index name - INDEX_NAME itself is an alias"""
+    return f"{INDEX_NAME}-v{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+
+def list_generations():
+    indices = client.cat.indices(index=f"{INDEX_NAME}-v*", format='json')
+    return sorted(entry['index'] for entry in indices)
+
+def alias_targets():
+    try:
+        return sorted(client.indices.get_alias(name=INDEX_NAME).keys())
+    except NotFoundError:
+        return []
+
+def create_generation(load_optimized=False):
+    """Create a new versioned index, optionally with bulk-load settings"""
+    name = generation_name()
+    body = json.loads(json.dumps(index_mapping))
+    
+    if load_optimized:
+        body['settings']['index'].update(LOAD_SETTINGS)
+    
+    try:
+        client.indices.create(index=name, body=body)
+    except Exception as e:
+        if not load_optimized:
+            raise
+        # OpenSearch Serverless manages refresh and replicas itself
+        print(f"  Load settings rejected ({e}), creating with search settings")
+        client.indices.create(index=name, body=index_mapping)
+    
+    print(f"✓ Created index '{name}'")
+    return name
+
+def add_new_fields(index_name):
+    """Add fields introduced since the index was created (e.g. location)"""
+    existing = client.indices.get_mapping(index=index_name)
+    known = set()
+    for mapping in existing.values():
+        known.update(mapping['mappings'].get('properties', {}))
+    
+    missing = {
+        name: field for name, field in index_mapping['mappings']['properties'].items()
+        if name not in known
+    }
+    if not missing:
+        return
+    
+    client.indices.put_mapping(index=index_name, body={"properties": missing})
+    print(f"✓ Added fields to '{index_name}': {', '.join(sorted(missing))}")
+    print("  Existing documents get them on their next sync or reindex")
+
+def partition_names(partitioning):
+    names = []
+    for listing in LISTING_PARTITIONS:
+        if partitioning == 'listing_type':
+            names.extend(f"{INDEX_NAME}-{listing}-{slug}" for slug in PROPERTY_TYPE_PARTITIONS)
+        else:
+            names.append(f"{INDEX_NAME}-{listing}")
+    return names
+
+def create_partitions(partitioning):
+    """Create the sale/rent (and per-type) indexes for a partitioned layout"""
+    try:
+        client.indices.put_index_template(name=f"{INDEX_NAME}-partitions", body={
+            "index_patterns": [f"{INDEX_NAME}-{listing}*" for listing in LISTING_PARTITIONS],
+            "template": index_mapping
+        })
+        print(f"✓ Index template '{INDEX_NAME}-partitions' covers new property types")
+    except Exception as e:
+        print(f"  Index template not created ({e}) - unlisted property types need their index created first")
+    
+    for name in partition_names(partitioning):
+        if client.indices.exists(index=name):
+            print(f"  '{name}' already exists")
+            add_new_fields(name)
+            continue
+        client.indices.create(index=name, body=index_mapping)
+        print(f"✓ Created partition '{name}'")
+
 def create_index():
     try:
-        if client.indices.exists(index=INDEX_NAME):
-            print(f"\nIndex '{INDEX_NAME}' already exists.")
-            response = input("Delete and recreate? (yes/no): ")
-            if response.lower() == 'yes':
-                client.indices.delete(index=INDEX_NAME)
-                print(f"✓ Deleted existing index")
+        targets = alias_targets()
+        if targets:
+            print(f"\nAlias '{INDEX_NAME}' already points to {', '.join(targets)}.")
+            add_new_fields(INDEX_NAME)
+            print("Use reindex.py to build and swap in a new generation.")
+            return
         
-        print(f"\nCreating index '{INDEX_NAME}'...")
-        response = client.indices.create(
-            index=INDEX_NAME,
-            body=index_mapping
-        )
+        if client.indices.exists(index=INDEX_NAME):
+            print(f"\nIndex '{INDEX_NAME}' exists as a plain index (pre-alias layout).")
+            add_new_fields(INDEX_NAME)
+            print("Use reindex.py to rebuild it as a versioned generation behind an alias.")
+            return
         
-        print(f"✓ Index '{INDEX_NAME}' created successfully!")
-        print(f"  Response: {response}")
+        print(f"\nCreating first generation for '{INDEX_NAME}'...")
+        name = create_generation()
+        client.indices.put_alias(index=name, name=INDEX_NAME)
+        print(f"✓ Alias '{INDEX_NAME}' -> '{name}'")
         
         # Verify
-        index_info = client.indices.get(index=INDEX_NAME)
-        field_count = len(index_info[INDEX_NAME]['mappings']['properties'])
+        index_info = client.indices.get(index=name)
+        field_count = len(index_info[name]['mappings']['properties'])
         print(f"✓ Verified: {field_count} fields mapped")
         
     except Exception as e:
@@ -149,10 +256,18 @@ def create_index():
         traceback.print_exc()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create the listings index')
+    parser.add_argument('--partitioning', default='none', choices=['none', 'listing', 'listing_type'],
+                        help='must match INDEX_PARTITIONING on the Lambdas')
+    args = parser.parse_args()
+    
     print("=== Creating OpenSearch Index ===\n")
     
     if test_connection():
-        create_index()
+        if args.partitioning == 'none':
+            create_index()
+        else:
+            create_partitions(args.partitioning)
     else:
         print("\n⚠️  Could not connect to OpenSearch.")
         print("The collection was just created and might need a few more minutes.")
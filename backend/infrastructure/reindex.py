@@ -0,0 +1,228 @@
+"""
+Blue/green rebuild of the listings index.
+
+INDEX_NAME is an alias over versioned generations (property-listings-vYYYYmmddHHMMSS).
+A rebuild creates a new generation with bulk-load settings, ingests the
+source file into it, restores search settings, validates document counts
+and then swaps the alias in one atomic _aliases call. Queries keep hitting
+the old generation until the swap, and old generations are garbage
+collected afterwards.
+
+    python reindex.py --source s3://bucket/listings.csv
+    python reindex.py --source s3://bucket/listings.csv --mode fanout --keep 3
+    python reindex.py --list
+    python reindex.py --gc-only --keep 2
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import boto3
+
+from create_index import (
+    INDEX_NAME, OPENSEARCH_ENDPOINT, REGION, SEARCH_SETTINGS,
+    alias_targets, client, create_generation, list_generations, test_connection
+)
+
+LAMBDA_DIR = Path(__file__).parent.parent / 'lamda'
+COUNT_SETTLE_SECONDS = 120
+
+s3_client = boto3.client('s3')
+
+def parse_s3_uri(uri):
+    if not uri.startswith('s3://'):
+        raise ValueError(f"Expected s3://bucket/key, got {uri}")
+    bucket, _, key = uri[5:].partition('/')
+    return bucket, key
+
+def document_count(index_name):
+    return client.count(index=index_name)['count']
+
+def load_generation(index_name, source, mode):
+    """Run the ingestion handler in-process against the new generation"""
+    bucket, key = parse_s3_uri(source)
+    
+    os.environ['INDEX_NAME'] = index_name
+    os.environ.setdefault('OPENSEARCH_ENDPOINT', OPENSEARCH_ENDPOINT)
+    os.environ.setdefault('REGION', REGION)
+    if mode == 'fanout':
+        # No Lambda context here - shards run on a local process pool
+        os.environ.setdefault('SHARD_DISPATCH', 'local')
+    
+    sys.path.insert(0, str(LAMBDA_DIR))
+    import ingestion_lambda
+    ingestion_lambda.INDEX_NAME = index_name
+    
+    event = {
+        'mode': mode,
+        'Records': [{'s3': {'bucket': {'name': bucket}, 'object': {'key': key}}}]
+    }
+    response = ingestion_lambda.lambda_handler(event, None)
+    result = json.loads(response['body'])
+    
+    if response['statusCode'] != 200:
+        raise RuntimeError(f"Ingestion failed: {result}")
+    
+    print(f"✓ Loaded {result.get('processed')} documents ({result.get('failed')} failed)")
+    return result
+
+def restore_search_settings(index_name):
+    try:
+        client.indices.put_settings(index=index_name, body={"index": SEARCH_SETTINGS})
+        print("✓ Restored search settings")
+    except Exception as e:
+        # OpenSearch Serverless manages refresh and replicas itself
+        print(f"  Search settings not applied: {e}")
+    
+    try:
+        client.indices.refresh(index=index_name)
+    except Exception as e:
+        print(f"  Refresh not available: {e}")
+
+def validate_generation(index_name, expected, previous_count, min_ratio):
+    """Wait for the new generation's count to settle and compare it"""
+    deadline = time.time() + COUNT_SETTLE_SECONDS
+    count = document_count(index_name)
+    
+    while count < expected and time.time() < deadline:
+        print(f"  {count}/{expected} documents visible, waiting...")
+        time.sleep(10)
+        count = document_count(index_name)
+    
+    print(f"  New generation: {count} documents (loaded {expected}, current {previous_count})")
+    
+    if count < expected:
+        raise RuntimeError(f"Only {count} of {expected} loaded documents are searchable")
+    
+    if previous_count and count < previous_count * min_ratio:
+        raise RuntimeError(
+            f"New generation has {count} documents, below {min_ratio:.0%} of the current {previous_count}"
+        )
+    
+    sample = client.search(index=index_name, body={"size": 1, "_source": ["listing_id"]})
+    if count and not sample['hits']['hits']:
+        raise RuntimeError("New generation returned no hits for a match_all query")
+    
+    print("✓ Validation passed")
+    return count
+
+def swap_alias(index_name):
+    """Point INDEX_NAME at index_name in a single atomic request"""
+    targets = alias_targets()
+    actions = [{"remove": {"index": target, "alias": INDEX_NAME}} for target in targets]
+    
+    if not targets and client.indices.exists(index=INDEX_NAME):
+        # First migration from the plain index - remove_index drops it in the
+        # same request that gives its name to the alias
+        actions.append({"remove_index": {"index": INDEX_NAME}})
+    
+    actions.append({"add": {"index": index_name, "alias": INDEX_NAME}})
+    try:
+        client.indices.update_aliases(body={"actions": actions})
+    except Exception:
+        # The request is atomic, but a timed-out response may still have
+        # applied - only a swap that didn't happen is a failure
+        if alias_targets() != [index_name]:
+            raise
+    print(f"✓ Alias '{INDEX_NAME}' -> '{index_name}' (was {', '.join(targets) or 'unset'})")
+
+def reset_sync_manifest(state_bucket, index_name):
+    """Hand the new generation's sync manifest to the alias, or drop the stale one"""
+    prefix = os.environ.get('STATE_PREFIX', 'ingestion-state/')
+    alias_key = f"{prefix}{INDEX_NAME}/manifest.json"
+    generation_key = f"{prefix}{index_name}/manifest.json"
+    
+    try:
+        s3_client.copy_object(
+            Bucket=state_bucket,
+            Key=alias_key,
+            CopySource={'Bucket': state_bucket, 'Key': generation_key}
+        )
+        print(f"✓ Sync manifest carried over from {generation_key}")
+    except Exception as e:
+        if 'NoSuchKey' not in str(e) and 'Not Found' not in str(e):
+            raise
+        # Document ids in the old manifest belong to the previous generation
+        s3_client.delete_object(Bucket=state_bucket, Key=alias_key)
+        print("✓ Stale sync manifest removed (next sync run re-keys by listing_id)")
+
+def collect_garbage(keep):
+    current = set(alias_targets())
+    generations = list_generations()
+    # Newest first - names sort by their timestamp suffix
+    retained = set(sorted(generations, reverse=True)[:keep]) | current
+    
+    for name in generations:
+        if name in retained:
+            continue
+        client.indices.delete(index=name)
+        print(f"✓ Deleted old generation '{name}'")
+    
+    print(f"  Retained: {', '.join(sorted(retained)) or 'none'}")
+
+def print_status():
+    targets = alias_targets()
+    print(f"Alias '{INDEX_NAME}' -> {', '.join(targets) or 'unset'}")
+    for name in list_generations():
+        marker = '*' if name in targets else ' '
+        print(f" {marker} {name}: {document_count(name)} documents")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Blue/green rebuild of the listings index')
+    parser.add_argument('--source', help='s3://bucket/key of the full listings export')
+    parser.add_argument('--mode', default='full', choices=['full', 'sync', 'fanout'])
+    parser.add_argument('--keep', type=int, default=2, help='generations to retain after the swap')
+    parser.add_argument('--min-ratio', type=float, default=0.95,
+                        help='minimum new/current document ratio before swapping')
+    parser.add_argument('--state-bucket', help='ingestion state bucket (default: source bucket)')
+    parser.add_argument('--keep-failed', action='store_true', help='keep a generation that failed validation')
+    parser.add_argument('--list', action='store_true', help='show generations and exit')
+    parser.add_argument('--gc-only', action='store_true', help='only delete old generations')
+    args = parser.parse_args()
+    
+    print("=== Blue/Green Reindex ===\n")
+    
+    if not test_connection():
+        sys.exit(1)
+    
+    if args.list:
+        print_status()
+        sys.exit(0)
+    
+    if args.gc_only:
+        collect_garbage(args.keep)
+        sys.exit(0)
+    
+    if not args.source:
+        parser.error('--source is required for a rebuild')
+    
+    if os.environ.get('INDEX_PARTITIONING', 'none') != 'none':
+        # Partitions are separate physical indexes, not generations behind one alias
+        parser.error('blue/green rebuilds only support INDEX_PARTITIONING=none')
+    
+    current = alias_targets() or ([INDEX_NAME] if client.indices.exists(index=INDEX_NAME) else [])
+    previous_count = sum(document_count(name) for name in current)
+    print(f"Current: {', '.join(current) or 'none'} ({previous_count} documents)\n")
+    
+    new_index = create_generation(load_optimized=True)
+    
+    try:
+        result = load_generation(new_index, args.source, args.mode)
+        restore_search_settings(new_index)
+        validate_generation(new_index, result.get('processed', 0), previous_count, args.min_ratio)
+        swap_alias(new_index)
+    except Exception as e:
+        print(f"\n✗ Rebuild failed: {e}")
+        if not args.keep_failed:
+            client.indices.delete(index=new_index)
+            print(f"  Deleted '{new_index}' - '{INDEX_NAME}' is unchanged")
+        sys.exit(1)
+    
+    # Only once the alias serves the new generation
+    reset_sync_manifest(args.state_bucket or parse_s3_uri(args.source)[0], new_index)
+    collect_garbage(args.keep)
+    
+    print("\n=== Reindex Complete! ===")
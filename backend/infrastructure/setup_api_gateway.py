@@ -20,7 +20,10 @@ print("Step 1: Creating REST API...")
 api_response = apigateway.create_rest_api(
     name=API_NAME,
     description='REST API for Property RAG Chatbot',
-    endpointConfiguration={'types': ['REGIONAL']}
+    endpointConfiguration={'types': ['REGIONAL']},
+    # Lets the Lambda return gzipped (base64) bodies; request bodies then
+    # arrive base64-encoded and the handler decodes them
+    binaryMediaTypes=['*/*']
 )
 
 api_id = api_response['id']
@@ -30,85 +33,107 @@ print(f"✓ API created: {api_id}")
 resources = apigateway.get_resources(restApiId=api_id)
 root_id = resources['items'][0]['id']
 
-# Create /chat resource
-print("\nStep 2: Creating /chat resource...")
-chat_resource = apigateway.create_resource(
-    restApiId=api_id,
-    parentId=root_id,
-    pathPart='chat'
-)
-chat_resource_id = chat_resource['id']
-print(f"✓ /chat resource created: {chat_resource_id}")
-
-# Create POST method
-print("\nStep 3: Creating POST method...")
-apigateway.put_method(
-    restApiId=api_id,
-    resourceId=chat_resource_id,
-    httpMethod='POST',
-    authorizationType='NONE'
-)
-print("✓ POST method created")
+lambda_arn = f"arn:aws:lambda:{REGION}:{account_id}:function:{LAMBDA_FUNCTION_NAME}"
+lambda_uri = f"arn:aws:apigateway:{REGION}:lambda:path/2015-03-31/functions/{lambda_arn}/invocations"
 
-# Create OPTIONS method for CORS
-print("\nStep 4: Creating OPTIONS method (CORS)...")
-apigateway.put_method(
-    restApiId=api_id,
-    resourceId=chat_resource_id,
-    httpMethod='OPTIONS',
-    authorizationType='NONE'
-)
+def create_lambda_resource(path_part, http_method='POST'):
+    """Resource proxied to the query Lambda, with a CORS preflight"""
+    resource = apigateway.create_resource(
+        restApiId=api_id,
+        parentId=root_id,
+        pathPart=path_part
+    )
+    resource_id = resource['id']
+    print(f"✓ /{path_part} resource created: {resource_id}")
+    
+    apigateway.put_method(
+        restApiId=api_id,
+        resourceId=resource_id,
+        httpMethod=http_method,
+        authorizationType='NONE'
+    )
+    print(f"✓ {http_method} method created")
+    
+    # OPTIONS method for CORS
+    apigateway.put_method(
+        restApiId=api_id,
+        resourceId=resource_id,
+        httpMethod='OPTIONS',
+        authorizationType='NONE'
+    )
+    
+    apigateway.put_method_response(
+        restApiId=api_id,
+        resourceId=resource_id,
+        httpMethod='OPTIONS',
+        statusCode='200',
+        responseParameters={
+            'method.response.header.Access-Control-Allow-Headers': True,
+            'method.response.header.Access-Control-Allow-Methods': True,
+            'method.response.header.Access-Control-Allow-Origin': True
+        }
+    )
+    
+    apigateway.put_integration(
+        restApiId=api_id,
+        resourceId=resource_id,
+        httpMethod='OPTIONS',
+        type='MOCK',
+        requestTemplates={'application/json': '{"statusCode": 200}'},
+        # With binaryMediaTypes '*/*' the preflight body would otherwise stay
+        # binary and never match the JSON mapping template
+        contentHandling='CONVERT_TO_TEXT'
+    )
+    
+    apigateway.put_integration_response(
+        restApiId=api_id,
+        resourceId=resource_id,
+        httpMethod='OPTIONS',
+        statusCode='200',
+        contentHandling='CONVERT_TO_TEXT',
+        responseParameters={
+            'method.response.header.Access-Control-Allow-Headers': "'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'",
+            'method.response.header.Access-Control-Allow-Methods': f"'{http_method},OPTIONS'",
+            'method.response.header.Access-Control-Allow-Origin': "'*'"
+        }
+    )
+    print("✓ CORS configured")
+    
+    # Lambda integration - the handler routes on the resource path. Proxy
+    # integrations always call Lambda with POST, whatever the client method.
+    apigateway.put_integration(
+        restApiId=api_id,
+        resourceId=resource_id,
+        httpMethod=http_method,
+        type='AWS_PROXY',
+        integrationHttpMethod='POST',
+        uri=lambda_uri
+    )
+    print("✓ Lambda integration configured")
+    return resource_id
 
-apigateway.put_method_response(
-    restApiId=api_id,
-    resourceId=chat_resource_id,
-    httpMethod='OPTIONS',
-    statusCode='200',
-    responseParameters={
-        'method.response.header.Access-Control-Allow-Headers': True,
-        'method.response.header.Access-Control-Allow-Methods': True,
-        'method.response.header.Access-Control-Allow-Origin': True
-    }
-)
+# Create /chat resource
+print("\nStep 2: Creating /chat resource...")
+chat_resource_id = create_lambda_resource('chat')
 
-apigateway.put_integration(
-    restApiId=api_id,
-    resourceId=chat_resource_id,
-    httpMethod='OPTIONS',
-    type='MOCK',
-    requestTemplates={'application/json': '{"statusCode": 200}'}
-)
+# Create /facets resource (cached aggregations for filter UIs)
+print("\nStep 3: Creating /facets resource...")
+facets_resource_id = create_lambda_resource('facets')
 
-apigateway.put_integration_response(
-    restApiId=api_id,
-    resourceId=chat_resource_id,
-    httpMethod='OPTIONS',
-    statusCode='200',
-    responseParameters={
-        'method.response.header.Access-Control-Allow-Headers': "'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'",
-        'method.response.header.Access-Control-Allow-Methods': "'POST,OPTIONS'",
-        'method.response.header.Access-Control-Allow-Origin': "'*'"
-    }
-)
-print("✓ CORS configured")
+# Create /typeahead resource (GET, so browsers skip the preflight)
+print("\nStep 4: Creating /typeahead resource...")
+typeahead_resource_id = create_lambda_resource('typeahead', 'GET')
 
-# Set up Lambda integration for POST
-print("\nStep 5: Setting up Lambda integration...")
-lambda_arn = f"arn:aws:lambda:{REGION}:{account_id}:function:{LAMBDA_FUNCTION_NAME}"
-lambda_uri = f"arn:aws:apigateway:{REGION}:lambda:path/2015-03-31/functions/{lambda_arn}/invocations"
+# Create /batch resource (many queries per call for offline jobs)
+print("\nStep 5: Creating /batch resource...")
+batch_resource_id = create_lambda_resource('batch')
 
-apigateway.put_integration(
-    restApiId=api_id,
-    resourceId=chat_resource_id,
-    httpMethod='POST',
-    type='AWS_PROXY',
-    integrationHttpMethod='POST',
-    uri=lambda_uri
-)
-print("✓ Lambda integration configured")
+# Create /narrative resource (LLM prose for cards-only /chat responses)
+print("\nStep 6: Creating /narrative resource...")
+narrative_resource_id = create_lambda_resource('narrative')
 
 # Grant API Gateway permission to invoke Lambda
-print("\nStep 6: Granting API Gateway permissions...")
+print("\nStep 7: Granting API Gateway permissions...")
 source_arn = f"arn:aws:execute-api:{REGION}:{account_id}:{api_id}/*/*"
 
 try:
@@ -124,7 +149,7 @@ except lambda_client.exceptions.ResourceConflictException:
     print("✓ Permissions already exist")
 
 # Deploy API
-print("\nStep 7: Deploying API to production...")
+print("\nStep 8: Deploying API to production...")
 deployment = apigateway.create_deployment(
     restApiId=api_id,
     stageName='prod'
@@ -139,6 +164,10 @@ print("API Gateway Setup Complete!")
 print("="*60)
 print(f"\nAPI ID: {api_id}")
 print(f"Endpoint: {api_endpoint}")
+print(f"Facets:   {api_endpoint.rsplit('/', 1)[0]}/facets")
+print(f"Typeahead: {api_endpoint.rsplit('/', 1)[0]}/typeahead?q=")
+print(f"Batch:    {api_endpoint.rsplit('/', 1)[0]}/batch")
+print(f"Narrative: {api_endpoint.rsplit('/', 1)[0]}/narrative")
 
 # Update config.json
 config['api_endpoint'] = api_endpoint
@@ -0,0 +1,533 @@
+"""
+Export the listings index to a snapshot and restore it without Bedrock.
+
+A snapshot is a directory holding:
+
+    embeddings.npy     float16 (count, dimension) array, memory-mappable
+    metadata.parquet   every other _source field, one row per embedding row
+    manifest.json      count, dimension, fields, checksums, source mapping
+
+Export scans the index under one point in time with sliced search_after
+pages running in parallel. Import creates a new generation with bulk-load
+settings, loads the snapshot, validates it and swaps the alias exactly
+like reindex.py. It then writes the sync manifest, so the next sync run
+is incremental. No embedding is recomputed, so a restore costs bulk
+requests only. Partitioned layouts have no generations - documents go back
+into their partition indexes, which must be empty (--clear-partitions
+deletes and recreates them first).
+
+    python snapshot_index.py export --output ./snapshot --slices 4
+    python snapshot_index.py export --output ./snapshot --upload s3://bucket/snapshots/2026-01-31/
+    python snapshot_index.py verify --snapshot ./snapshot
+    python snapshot_index.py import --snapshot s3://bucket/snapshots/2026-01-31/ --state-bucket my-bucket
+
+embeddings.npy loads directly into ../scripts/tune_hnsw.py --vectors.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import boto3
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from create_index import INDEX_NAME, alias_targets, client, create_generation, create_partitions, test_connection
+from reindex import (
+    collect_garbage, document_count, parse_s3_uri, restore_search_settings, swap_alias, validate_generation
+)
+
+EMBEDDINGS_FILE = 'embeddings.npy'
+METADATA_FILE = 'metadata.parquet'
+MANIFEST_FILE = 'manifest.json'
+FORMAT_VERSION = 1
+PIT_KEEP_ALIVE = '10m'
+IMPORT_BATCH_SIZE = 250
+
+# Mapping type -> column type; anything else (objects, nested) is stored as JSON text
+ARROW_TYPES = {
+    'keyword': pa.string(),
+    'text': pa.string(),
+    'date': pa.string(),
+    'long': pa.int64(),
+    'integer': pa.int64(),
+    'short': pa.int64(),
+    'float': pa.float64(),
+    'double': pa.float64(),
+    'boolean': pa.bool_(),
+    'geo_point': pa.struct([('lat', pa.float64()), ('lon', pa.float64())]),
+}
+
+s3_client = boto3.client('s3')
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def live_mapping(index):
+    """Field mappings across every index behind `index`"""
+    properties = {}
+    for mapping in client.indices.get_mapping(index=index).values():
+        properties.update(mapping['mappings'].get('properties', {}))
+    return properties
+
+def metadata_schema(properties):
+    """Column schema for the non-embedding fields, plus the names kept as JSON text"""
+    # _fields lists the keys each _source actually had, so a restored doc
+    # hashes exactly like the ingested one
+    fields = [pa.field('_index', pa.string()), pa.field('_fields', pa.list_(pa.string()))]
+    json_fields = []
+    for name in sorted(properties):
+        if name == 'embedding':
+            continue
+        arrow_type = ARROW_TYPES.get(properties[name].get('type'))
+        if arrow_type is None:
+            json_fields.append(name)
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields), json_fields
+
+def coerce(value, arrow_type):
+    """Best-effort cast for _source values that don't match their mapping"""
+    if value is None:
+        return None
+    try:
+        if pa.types.is_integer(arrow_type):
+            return int(float(value))
+        if pa.types.is_floating(arrow_type):
+            return float(value)
+        if pa.types.is_boolean(arrow_type):
+            return str(value).lower() == 'true' if isinstance(value, str) else bool(value)
+        if pa.types.is_struct(arrow_type):
+            return {'lat': float(value['lat']), 'lon': float(value['lon'])}
+        return value if isinstance(value, str) else json.dumps(value)
+    except (TypeError, ValueError, KeyError):
+        return None
+
+class SnapshotWriter:
+    """Appends pages of hits to the embedding array and the metadata file"""
+    def __init__(self, directory, total, dimension, schema, json_fields):
+        self.schema = schema
+        self.json_fields = json_fields
+        self.total = total
+        self.dimension = dimension
+        self.rows = 0
+        self.skipped = 0
+        self.max_error = 0.0
+        self.lock = threading.Lock()
+        
+        self.embeddings = np.lib.format.open_memmap(
+            Path(directory) / EMBEDDINGS_FILE, mode='w+', dtype=np.float16, shape=(total, dimension)
+        )
+        self.metadata = pq.ParquetWriter(Path(directory) / METADATA_FILE, schema, compression='zstd')
+    
+    def table(self, rows):
+        try:
+            return pa.Table.from_pylist(rows, schema=self.schema)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            rows = [
+                dict(
+                    {field.name: coerce(row.get(field.name), field.type) for field in self.schema},
+                    _index=row['_index'], _fields=row['_fields']
+                )
+                for row in rows
+            ]
+            return pa.Table.from_pylist(rows, schema=self.schema)
+    
+    def write(self, hits):
+        vectors = []
+        rows = []
+        for hit in hits:
+            source = hit['_source']
+            embedding = source.pop('embedding', None)
+            if not embedding or len(embedding) != self.dimension:
+                self.skipped += 1
+                continue
+            for name in self.json_fields:
+                if source.get(name) is not None:
+                    source[name] = json.dumps(source[name])
+            vectors.append(embedding)
+            rows.append(dict(source, _index=hit['_index'], _fields=sorted(source)))
+        
+        if not rows:
+            return
+        
+        vectors = np.asarray(vectors, dtype=np.float32)
+        compact = vectors.astype(np.float16)
+        error = float(np.max(np.abs(compact.astype(np.float32) - vectors)))
+        table = self.table(rows)
+        
+        # Rows land in both files in the same order under one lock
+        with self.lock:
+            start = self.rows
+            if start + len(rows) > self.total:
+                raise RuntimeError(f"Index grew past {self.total} documents during the export - run it again")
+            self.embeddings[start:start + len(rows)] = compact
+            self.metadata.write_table(table)
+            self.rows += len(rows)
+            self.max_error = max(self.max_error, error)
+    
+    def close(self):
+        self.embeddings.flush()
+        self.metadata.close()
+
+def open_pit(index):
+    try:
+        response = client.transport.perform_request(
+            'POST', f"/{index}/_search/point_in_time", params={'keep_alive': PIT_KEEP_ALIVE}
+        )
+        return response['pit_id']
+    except Exception as e:
+        # OpenSearch Serverless collections have no point in time - fall back
+        # to plain search_after pages over the live index
+        print(f"  Point in time not available ({e}) - exporting without a consistent snapshot")
+        return None
+
+def close_pit(pit_id):
+    try:
+        client.transport.perform_request('DELETE', '/_search/point_in_time', body={'pit_id': [pit_id]})
+    except Exception as e:
+        print(f"  Could not close point in time: {e}")
+
+def export_slice(index, pit_id, slice_id, slices, page_size, writer):
+    exported = 0
+    search_after = None
+    while True:
+        # listing_id repeats, so a page boundary inside a run of equal ids
+        # would skip or repeat documents - break ties on a unique key
+        tiebreaker = "_shard_doc" if pit_id else "_id"
+        body = {"size": page_size, "sort": [{"listing_id": "asc"}, {tiebreaker: "asc"}]}
+        if pit_id:
+            body["pit"] = {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+            if slices > 1:
+                body["slice"] = {"id": slice_id, "max": slices}
+        if search_after:
+            body["search_after"] = search_after
+        
+        # A point in time search names no index - the PIT carries it
+        response = client.search(body=body) if pit_id else client.search(index=index, body=body)
+        hits = response['hits']['hits']
+        if not hits:
+            return exported
+        
+        writer.write(hits)
+        exported += len(hits)
+        # Both sort values - listing_id and the tiebreaker
+        search_after = hits[-1]['sort']
+
+def export_snapshot(index, output, slices, page_size):
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    started = time.time()
+    
+    properties = live_mapping(index)
+    dimension = properties['embedding']['dimension']
+    schema, json_fields = metadata_schema(properties)
+    
+    pit_id = open_pit(index)
+    if pit_id:
+        total = client.search(body={
+            "size": 0, "track_total_hits": True, "pit": {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+        })['hits']['total']['value']
+    else:
+        total = document_count(index)
+        slices = 1
+    print(f"Exporting {total} documents from '{index}' in {slices} slice(s)")
+    
+    writer = SnapshotWriter(output, total, dimension, schema, json_fields)
+    try:
+        with ThreadPoolExecutor(max_workers=slices) as pool:
+            counts = list(pool.map(
+                lambda slice_id: export_slice(index, pit_id, slice_id, slices, page_size, writer),
+                range(slices)
+            ))
+    finally:
+        writer.close()
+        if pit_id:
+            close_pit(pit_id)
+    
+    if writer.rows < total:
+        # Trim the unused tail (documents without an embedding, or deletes
+        # during a non-PIT export)
+        trimmed = np.load(output / EMBEDDINGS_FILE, mmap_mode='r')[:writer.rows].copy()
+        np.save(output / EMBEDDINGS_FILE, trimmed)
+    
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'index': index,
+        'physical_indices': sorted(client.indices.get_mapping(index=index)),
+        'exported_at': datetime.utcnow().isoformat(),
+        'consistent': bool(pit_id),
+        'count': writer.rows,
+        'skipped_without_embedding': writer.skipped,
+        'dimension': dimension,
+        'dtype': 'float16',
+        'max_abs_error': writer.max_error,
+        'json_fields': json_fields,
+        'mapping': properties,
+        'files': {
+            name: {'bytes': (output / name).stat().st_size, 'sha256': file_sha256(output / name)}
+            for name in (EMBEDDINGS_FILE, METADATA_FILE)
+        }
+    }
+    with open(output / MANIFEST_FILE, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    
+    size_mb = sum(entry['bytes'] for entry in manifest['files'].values()) / (1024 * 1024)
+    print(f"✓ Exported {writer.rows} documents ({sum(counts)} hits read, {writer.skipped} without embedding) "
+          f"to {output} - {size_mb:.1f} MB in {time.time() - started:.0f}s")
+    print(f"  float16 max abs error: {writer.max_error:.2e}")
+    return manifest
+
+def upload_snapshot(directory, uri):
+    bucket, prefix = parse_s3_uri(uri)
+    prefix = prefix.rstrip('/') + '/' if prefix else ''
+    for name in (EMBEDDINGS_FILE, METADATA_FILE, MANIFEST_FILE):
+        s3_client.upload_file(str(Path(directory) / name), bucket, prefix + name)
+    print(f"✓ Uploaded snapshot to s3://{bucket}/{prefix}")
+
+def fetch_snapshot(source):
+    """Local directory for a snapshot, downloading it first when it lives in S3"""
+    if not source.startswith('s3://'):
+        return Path(source)
+    
+    bucket, prefix = parse_s3_uri(source)
+    prefix = prefix.rstrip('/') + '/' if prefix else ''
+    directory = Path(tempfile.mkdtemp(prefix='snapshot-'))
+    for name in (EMBEDDINGS_FILE, METADATA_FILE, MANIFEST_FILE):
+        s3_client.download_file(bucket, prefix + name, str(directory / name))
+    print(f"✓ Downloaded snapshot to {directory}")
+    return directory
+
+def verify_snapshot(directory):
+    """Check checksums, row alignment and embedding norms; returns the manifest"""
+    directory = Path(directory)
+    with open(directory / MANIFEST_FILE) as f:
+        manifest = json.load(f)
+    
+    for name, expected in manifest['files'].items():
+        if file_sha256(directory / name) != expected['sha256']:
+            raise RuntimeError(f"{name} does not match its checksum in the manifest")
+    
+    embeddings = np.load(directory / EMBEDDINGS_FILE, mmap_mode='r')
+    rows = pq.ParquetFile(directory / METADATA_FILE).metadata.num_rows
+    if embeddings.shape != (manifest['count'], manifest['dimension']) or rows != manifest['count']:
+        raise RuntimeError(
+            f"Snapshot holds {embeddings.shape} embeddings and {rows} metadata rows, "
+            f"manifest says {manifest['count']} x {manifest['dimension']}"
+        )
+    
+    # Titan embeddings are normalized - a bad write shows up as a norm far from 1
+    sample = np.asarray(embeddings[:: max(1, len(embeddings) // 1000)], dtype=np.float32)
+    norms = np.linalg.norm(sample, axis=1) if len(sample) else np.array([1.0])
+    print(f"✓ Snapshot verified: {manifest['count']} documents, dimension {manifest['dimension']}, "
+          f"sample norms {norms.min():.3f}-{norms.max():.3f}")
+    return manifest
+
+def snapshot_docs(directory, manifest):
+    """(doc, embedding row) pairs in file order"""
+    embeddings = np.load(Path(directory) / EMBEDDINGS_FILE, mmap_mode='r')
+    json_fields = set(manifest['json_fields'])
+    row = 0
+    
+    for batch in pq.ParquetFile(Path(directory) / METADATA_FILE).iter_batches(batch_size=IMPORT_BATCH_SIZE):
+        vectors = np.asarray(embeddings[row:row + batch.num_rows], dtype=np.float32)
+        for record, vector in zip(batch.to_pylist(), vectors):
+            present = record.pop('_fields')
+            record = {name: record[name] for name in ['_index'] + present if name in record}
+            for name in json_fields:
+                if record.get(name) is not None:
+                    record[name] = json.loads(record[name])
+            yield record, vector
+        row += batch.num_rows
+
+def content_hash(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+def load_batch(batch):
+    """Bulk one batch; returns (listing_id, sync manifest entry) for each stored doc"""
+    actions = []
+    for index_name, doc, _ in batch:
+        actions.append({"index": {"_index": index_name}})
+        actions.append(doc)
+    
+    response = client.bulk(body=actions, request_timeout=300)
+    entries = []
+    for (index_name, doc, doc_hash), item in zip(batch, response['items']):
+        item = item['index']
+        if item.get('error'):
+            continue
+        entries.append((doc.get('listing_id'), {
+            'doc_id': item['_id'],
+            'index': item.get('_index', index_name),
+            'doc_hash': doc_hash,
+            'text_hash': content_hash(doc.get('combined_text') or '')
+        }))
+    return entries
+
+def import_snapshot(directory, manifest, index_for, workers):
+    """Bulk-load every snapshot document; returns the sync manifest entries"""
+    entries = {}
+    pending = deque()
+    batch = []
+    batches = 0
+    started = time.time()
+    
+    def collect(future):
+        entries.update(future.result())
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for record, vector in snapshot_docs(directory, manifest):
+            index_name = index_for(record.pop('_index'))
+            # Same hash the ingestion Lambda records - taken before the embedding is added
+            doc_hash = content_hash(json.dumps(record, sort_keys=True, default=str))
+            record['embedding'] = vector.tolist()
+            batch.append((index_name, record, doc_hash))
+            
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                pending.append(pool.submit(load_batch, batch))
+                batch = []
+                batches += 1
+                # Bounded in-flight batches keep memory flat
+                if len(pending) >= workers * 2:
+                    collect(pending.popleft())
+                if batches % 40 == 0:
+                    print(f"  {len(entries)}/{manifest['count']} documents loaded")
+        
+        if batch:
+            pending.append(pool.submit(load_batch, batch))
+        while pending:
+            collect(pending.popleft())
+    
+    failed = manifest['count'] - len(entries)
+    print(f"✓ Loaded {len(entries)} documents ({failed} rejected) in {time.time() - started:.0f}s")
+    return entries
+
+def write_sync_manifest(state_bucket, entries):
+    prefix = os.environ.get('STATE_PREFIX', 'ingestion-state/')
+    key = f"{prefix}{INDEX_NAME}/manifest.json"
+    s3_client.put_object(Bucket=state_bucket, Key=key, Body=json.dumps(entries), ContentType='application/json')
+    print(f"✓ Sync manifest written to s3://{state_bucket}/{key} ({len(entries)} listings)")
+
+def spot_check(index, directory, samples=5):
+    """Search with a few snapshot vectors - each should find its own listing first"""
+    embeddings = np.load(Path(directory) / EMBEDDINGS_FILE, mmap_mode='r')
+    table = pq.read_table(Path(directory) / METADATA_FILE, columns=['listing_id'])
+    rows = np.random.default_rng(0).choice(len(embeddings), size=min(samples, len(embeddings)), replace=False)
+    
+    found = 0
+    for row in rows:
+        response = client.search(index=index, body={
+            "size": 1,
+            "_source": ["listing_id"],
+            "query": {"knn": {"embedding": {"vector": embeddings[row].astype(np.float32).tolist(), "k": 1}}}
+        })
+        hits = response['hits']['hits']
+        found += bool(hits) and hits[0]['_source'].get('listing_id') == table.column('listing_id')[int(row)].as_py()
+    
+    print(f"  Spot check: {found}/{len(rows)} snapshot vectors found their own listing")
+    return found == len(rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export or restore a listings index snapshot')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    export_parser = commands.add_parser('export', help='write the index to a snapshot directory')
+    export_parser.add_argument('--index', default=INDEX_NAME, help='index, alias or pattern to export')
+    export_parser.add_argument('--output', required=True, help='snapshot directory')
+    export_parser.add_argument('--slices', type=int, default=4, help='parallel PIT slices')
+    export_parser.add_argument('--page-size', type=int, default=500)
+    export_parser.add_argument('--upload', help='s3://bucket/prefix/ to copy the snapshot to')
+    
+    verify_parser = commands.add_parser('verify', help='check a snapshot against its manifest')
+    verify_parser.add_argument('--snapshot', required=True, help='snapshot directory or s3://bucket/prefix/')
+    
+    import_parser = commands.add_parser('import', help='load a snapshot into a new generation')
+    import_parser.add_argument('--snapshot', required=True, help='snapshot directory or s3://bucket/prefix/')
+    import_parser.add_argument('--workers', type=int, default=4, help='concurrent bulk requests')
+    import_parser.add_argument('--keep', type=int, default=2, help='generations to retain after the swap')
+    import_parser.add_argument('--min-ratio', type=float, default=0.95,
+                               help='minimum new/current document ratio before swapping')
+    import_parser.add_argument('--state-bucket', default=os.environ.get('STATE_BUCKET') or os.environ.get('SOURCE_BUCKET'),
+                               help='ingestion state bucket for the sync manifest')
+    import_parser.add_argument('--keep-failed', action='store_true', help='keep a generation that failed validation')
+    import_parser.add_argument('--clear-partitions', action='store_true',
+                               help='partitioned layouts: replace partitions that already hold documents')
+    args = parser.parse_args()
+    
+    print(f"=== Index Snapshot: {args.command} ===\n")
+    
+    if args.command == 'verify':
+        verify_snapshot(fetch_snapshot(args.snapshot))
+        sys.exit(0)
+    
+    if not test_connection():
+        sys.exit(1)
+    
+    if args.command == 'export':
+        export_snapshot(args.index, args.output, args.slices, args.page_size)
+        verify_snapshot(args.output)
+        if args.upload:
+            upload_snapshot(args.output, args.upload)
+        sys.exit(0)
+    
+    directory = fetch_snapshot(args.snapshot)
+    manifest = verify_snapshot(directory)
+    partitioning = os.environ.get('INDEX_PARTITIONING', 'none')
+    
+    if partitioning != 'none':
+        # Partitions are fixed index names - documents go back where they came
+        # from, so anything already there would be duplicated
+        occupied = [
+            name for name in manifest['physical_indices']
+            if client.indices.exists(index=name) and document_count(name)
+        ]
+        if occupied and not args.clear_partitions:
+            print(f"✗ Partitions already hold documents: {', '.join(occupied)}")
+            print("  Rerun with --clear-partitions to replace them")
+            sys.exit(1)
+        for name in occupied:
+            client.indices.delete(index=name)
+            print(f"✓ Cleared '{name}'")
+        create_partitions(partitioning)
+        entries = import_snapshot(directory, manifest, lambda source: source, args.workers)
+        for name in sorted({entry['index'] for entry in entries.values()}):
+            restore_search_settings(name)
+    else:
+        current = alias_targets() or ([INDEX_NAME] if client.indices.exists(index=INDEX_NAME) else [])
+        previous_count = sum(document_count(name) for name in current)
+        new_index = create_generation(load_optimized=True)
+        
+        try:
+            entries = import_snapshot(directory, manifest, lambda source: new_index, args.workers)
+            restore_search_settings(new_index)
+            validate_generation(new_index, len(entries), previous_count, args.min_ratio)
+            spot_check(new_index, directory)
+        except Exception as e:
+            print(f"\n✗ Import failed: {e}")
+            if not args.keep_failed:
+                client.indices.delete(index=new_index)
+                print(f"  Deleted '{new_index}' - '{INDEX_NAME}' is unchanged")
+            sys.exit(1)
+        
+        swap_alias(new_index)
+        collect_garbage(args.keep)
+    
+    if args.state_bucket:
+        write_sync_manifest(args.state_bucket, entries)
+    else:
+        print("  No --state-bucket - the next sync run re-keys listings by listing_id")
+    
+    print("\n=== Import Complete! ===")
@@ -1,20 +1,174 @@
 import json
 import boto3
+import codecs
 import csv
-import io
+import hashlib
+import heapq
+import itertools
+import os
+import queue
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from botocore.config import Config
 from opensearchpy import OpenSearch, RequestsHttpConnection
 from requests_aws4auth import AWS4Auth
 from datetime import datetime
 
-s3_client = boto3.client('s3')
-bedrock_runtime = boto3.client('bedrock-runtime')
+# Parquet input is optional - pyarrow ships as a Lambda layer when needed
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
 
-import os
 OPENSEARCH_ENDPOINT = os.environ.get('OPENSEARCH_ENDPOINT')
 INDEX_NAME = os.environ.get('INDEX_NAME', 'property-listings')
 REGION = os.environ.get('REGION', 'us-east-1')
 EMBEDDING_MODEL = 'amazon.titan-embed-text-v2:0'
 
+# Embedding stage tuning - size EMBEDDING_TPS to the account's Bedrock quota
+EMBEDDING_CONCURRENCY = int(os.environ.get('EMBEDDING_CONCURRENCY', '16'))
+EMBEDDING_TPS = float(os.environ.get('EMBEDDING_TPS', '50'))
+EMBEDDING_MAX_RETRIES = int(os.environ.get('EMBEDDING_MAX_RETRIES', '6'))
+INDEX_QUEUE_SIZE = int(os.environ.get('INDEX_QUEUE_SIZE', '500'))
+BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', '100'))
+
+# Streaming reads - S3 body is decoded in chunks instead of loaded whole
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', str(1024 * 1024)))
+
+# photo_url_list can exceed the csv module's default 128KB field limit
+csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+# Incremental sync - 'full' re-embeds every row, 'sync' only new/changed rows
+INGESTION_MODE = os.environ.get('INGESTION_MODE', 'full')
+STATE_BUCKET = os.environ.get('STATE_BUCKET')
+STATE_PREFIX = os.environ.get('STATE_PREFIX', 'ingestion-state/')
+SYNC_DELETE_MISSING = os.environ.get('SYNC_DELETE_MISSING', 'true').lower() == 'true'
+
+# Batch backfill - 'bedrock' submits a model invocation job, 'local' runs the
+# same input/output contract in-process for offline runs. The join back to
+# the parsed docs holds one BATCH_RECORDS_PER_FILE part in memory at a time
+BATCH_JOB_BACKEND = os.environ.get('BATCH_JOB_BACKEND', 'bedrock')
+BATCH_ROLE_ARN = os.environ.get('BATCH_ROLE_ARN')
+BATCH_RECORDS_PER_FILE = int(os.environ.get('BATCH_RECORDS_PER_FILE', '50000'))
+BATCH_MIN_RECORDS = 100
+
+# Fan-out - the coordinator splits large objects into row-aligned byte ranges
+# and dispatches them to worker invocations ('lambda') or a process pool ('local')
+SHARD_SIZE_BYTES = int(os.environ.get('SHARD_SIZE_BYTES', str(64 * 1024 * 1024)))
+SHARD_DISPATCH = os.environ.get('SHARD_DISPATCH', 'lambda')
+SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', str(os.cpu_count() or 2)))
+SHARD_CHECKPOINT_ROWS = int(os.environ.get('SHARD_CHECKPOINT_ROWS', '500'))
+SHARD_TIME_MARGIN_MS = int(os.environ.get('SHARD_TIME_MARGIN_MS', '90000'))
+
+# Parquet sources are read in row-group batches of this many rows
+PARQUET_BATCH_ROWS = int(os.environ.get('PARQUET_BATCH_ROWS', '2000'))
+
+# Index layout - 'none' keeps one index, 'listing' splits sale/rent into
+# INDEX_NAME-sale and INDEX_NAME-rent, 'listing_type' also splits by property type
+INDEX_PARTITIONING = os.environ.get('INDEX_PARTITIONING', 'none')
+
+# Community/area centroids for proximity search, rebuilt from the index after
+# each load and read by the query Lambda (LOCATIONS_URI)
+LOCATIONS_KEY = os.environ.get('LOCATIONS_KEY', f"{STATE_PREFIX}locations.json")
+LOCATION_FIELDS = ['community_name', 'area_name_en']
+LOCATION_TABLE_SIZE = 5000
+
+# Place names for the query Lambda's typeahead (TYPEAHEAD_URI), with listing counts
+TYPEAHEAD_KEY = os.environ.get('TYPEAHEAD_KEY', f"{STATE_PREFIX}typeahead.json")
+TYPEAHEAD_FIELDS = ['community_name', 'building_name', 'area_name_en', 'development_name']
+TYPEAHEAD_TERMS_SIZE = 10000
+
+# Query function to invoke after each load so it recomputes the suggestion
+# chip answers against the new data (its /prewarm route). That function
+# skips the prewarm unless its COALESCE_BACKEND is 'dynamodb'
+PREWARM_FUNCTION = os.environ.get('PREWARM_FUNCTION')
+
+# Near-duplicate collapse - the same unit listed by several agencies is
+# indexed once, with the other listings kept in alternate_listings. Off by
+# default: it reads the source twice, holds ~300 bytes per row in memory and
+# spills ~1KB per row to /tmp until the load ends, and makes up to
+# 2 * DEDUP_MAX_CHECKS extra embedding calls. Feeds over DEDUP_MAX_ROWS rows
+# are loaded without it
+DEDUPLICATE = os.environ.get('DEDUPLICATE', 'false').lower() == 'true'
+DEDUP_MAX_ROWS = int(os.environ.get('DEDUP_MAX_ROWS', '250000'))
+DEDUP_BINS = 64
+DEDUP_BAND_ROWS = 4
+DEDUP_MIN_SHINGLES = 8
+DEDUP_JACCARD = float(os.environ.get('DEDUP_JACCARD', '0.8'))
+DEDUP_JACCARD_MIN = float(os.environ.get('DEDUP_JACCARD_MIN', '0.5'))
+DEDUP_COSINE = float(os.environ.get('DEDUP_COSINE', '0.95'))
+DEDUP_AREA_TOLERANCE = 0.03
+DEDUP_PRICE_TOLERANCE = 0.02
+DEDUP_MAX_BUCKET = 50
+# Embedding checks per run - each one can cost two Bedrock calls
+DEDUP_MAX_CHECKS = int(os.environ.get('DEDUP_MAX_CHECKS', '2000'))
+# Looser pairs kept for those checks, most similar first
+DEDUP_MAX_PENDING = 4 * DEDUP_MAX_CHECKS
+DEDUP_HASH_MASK = 0xFFFFFFFF
+ALTERNATE_FIELDS = ['listing_id', 'listing_url', 'asking_price', 'list_agent_full_name', 'date_listed']
+
+# Listing summaries - a fixed-format line per listing built at ingestion and
+# read by the query Lambda's prompt instead of the raw fields
+SUMMARY_MAX_FEATURES = int(os.environ.get('SUMMARY_MAX_FEATURES', '8'))
+# Features looked for in description and amenities_text, in summary order -
+# (label, substrings one of which any match contains, pattern). The substring
+# check gates the regex, so most patterns never run on a given description
+SUMMARY_FEATURES = [
+    ('Private pool', ('private',), r'private (?:swimming )?pool'),
+    ('{} view', ('view',), r'(?:sea|marina|burj khalifa|burj|creek|golf course|golf|lake|canal|park|garden|pool|skyline|city|water|community) views?'),
+    ('Beach access', ('beach',), r'(?:private )?beach access|private beach'),
+    ('Furnished', ('furnished',), r'fully[- ]furnished'),
+    ('Semi-furnished', ('furnished',), r'semi[- ]furnished'),
+    ('Unfurnished', ('unfurnished',), r'unfurnished'),
+    ("Maid's room", ('maid',), r"maid'?s? room"),
+    ('Study', ('study',), r'study room|(?:with|plus|\+) ?(?:a )?study'),
+    ('Duplex', ('duplex',), r'duplex'),
+    ('Penthouse', ('penthouse',), r'penthouse'),
+    ('Corner unit', ('corner',), r'corner unit'),
+    ('High floor', ('floor',), r'high(?:er)? floor'),
+    ('Low floor', ('floor',), r'low(?:er)? floor'),
+    ('Upgraded', ('upgraded', 'renovated'), r'upgraded|renovated'),
+    ('Vacant', ('vacant',), r'vacant'),
+    ('Tenanted', ('tenanted', 'rented'), r'tenanted|rented'),
+    ('Chiller free', ('chiller',), r'chiller free'),
+    ('Balcony', ('balcon', 'terrace'), r'balcon(?:y|ies)|terraces?'),
+    ('Garden', ('garden',), r'gardens?(?! views?)'),
+    # Not the pool of a private pool or a pool view
+    ('Pool', ('pool',), r'(?<!private )(?<!swimming )(?:swimming )?pools?(?! views?)'),
+    ('Gym', ('gym', 'fitness'), r'gym(?:nasium)?|fitness (?:centre|center|facilities)'),
+    ('Parking', ('parking',), r'(?:covered |basement |allocated |dedicated )?parking'),
+    ('Kids play area', ('play area',), r"kids'? play area|children'?s play area"),
+    ('Concierge', ('concierge',), r'concierge'),
+    ('24h security', ('security',), r'24[- ]?(?:hour|hr|/7)s? security|security (?:guards?|services?)'),
+    ('Central A/C', ('central',), r'central(?:ly)? a/?c|centrally air[- ]conditioned|central air[- ]conditioning'),
+    ('Built-in wardrobes', ('wardrobe',), r'built[- ]in wardrobes?'),
+    ('Near metro', ('metro',), r'metro'),
+    ('Payment plan', ('payment plan',), r'payment plan'),
+]
+SUMMARY_LOOKBACK = 20
+SUMMARY_PATTERNS = [
+    (label, keywords, re.compile(rf'\b(?:{pattern})\b')) for label, keywords, pattern in SUMMARY_FEATURES
+]
+# amenities_text comes as a Python-style list repr ("['Balcony' 'Gym']") or JSON
+AMENITY_ITEM = re.compile(r"'([^']+)'|\"([^\"]+)\"")
+
+s3_client = boto3.client('s3')
+bedrock_client = boto3.client('bedrock')
+lambda_client = boto3.client('lambda')
+bedrock_runtime = boto3.client(
+    'bedrock-runtime',
+    config=Config(max_pool_connections=EMBEDDING_CONCURRENCY)
+)
+
 def get_opensearch_client():
     credentials = boto3.Session().get_credentials()
     awsauth = AWS4Auth(
@@ -34,27 +188,106 @@ def get_opensearch_client():
         timeout=300
     )
 
-def get_embedding(text):
-    try:
-        text = text[:6000]
-        
-        payload = {
-            "inputText": text,
-            "dimensions": 1024,
-            "normalize": True
-        }
-        
-        response = bedrock_runtime.invoke_model(
-            modelId=EMBEDDING_MODEL,
-            body=json.dumps(payload)
-        )
+class TokenBucket:
+    """Thread-safe token bucket used to keep Bedrock calls under the TPS quota"""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                
+                wait_time = (1 - self.tokens) / self.rate
+            
+            time.sleep(wait_time)
+
+class PipelineStats:
+    """Thread-safe throughput counters for the ingestion pipeline"""
+    def __init__(self):
+        self.counts = {}
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+    
+    def get(self, name):
+        with self.lock:
+            return self.counts.get(name, 0)
+    
+    def summary(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            result = dict(self.counts)
         
-        response_body = json.loads(response['body'].read())
-        return response_body['embedding']
+        result['elapsed_seconds'] = round(elapsed, 2)
+        result['embeddings_per_second'] = round(result.get('embedded', 0) / elapsed, 2) if elapsed else 0
+        result['indexed_per_second'] = round(result.get('indexed', 0) / elapsed, 2) if elapsed else 0
+        if result.get('dedup_listings'):
+            result['collapse_ratio'] = round(result.get('dedup_collapsed', 0) / result['dedup_listings'], 4)
+        return result
+
+def is_throttling_error(error):
+    message = str(error)
+    return any(code in message for code in [
+        'ThrottlingException',
+        'TooManyRequestsException',
+        'ServiceUnavailableException',
+        'ModelNotReadyException'
+    ])
+
+def embedding_model_input(text):
+    return {
+        "inputText": text[:6000],
+        "dimensions": 1024,
+        "normalize": True
+    }
+
+def invoke_embedding(text):
+    response = bedrock_runtime.invoke_model(
+        modelId=EMBEDDING_MODEL,
+        body=json.dumps(embedding_model_input(text))
+    )
+    
+    response_body = json.loads(response['body'].read())
+    return response_body['embedding']
+
+def get_embedding(text, limiter=None, stats=None):
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        if limiter:
+            limiter.acquire()
         
-    except Exception as e:
-        print(f"Embedding error: {e}")
-        return None
+        try:
+            embedding = invoke_embedding(text)
+            if stats:
+                stats.increment('embedding_calls')
+            return embedding
+            
+        except Exception as e:
+            if stats:
+                stats.increment('embedding_calls')
+            
+            if is_throttling_error(e) and attempt < EMBEDDING_MAX_RETRIES:
+                if stats:
+                    stats.increment('throttled')
+                # Exponential backoff with full jitter
+                time.sleep(random.uniform(0, min(20, 0.5 * (2 ** attempt))))
+                continue
+            
+            print(f"Embedding error: {e}")
+            return None
 
 def create_combined_text(row):
     parts = []
@@ -83,6 +316,108 @@ def create_combined_text(row):
     
     return ' | '.join(parts)
 
+def amenity_items(value):
+    value = (value or '').strip()
+    items = [single or double for single, double in AMENITY_ITEM.findall(value)]
+    if not items and value and value not in ('[]', 'None'):
+        items = value.split(',')
+    return [item.strip() for item in items if item.strip()]
+
+def feature_match(keywords, pattern, text):
+    # Every match contains a keyword no more than SUMMARY_LOOKBACK characters
+    # in, so the search starts just before the first one
+    starts = [start for start in map(text.find, keywords) if start >= 0]
+    if starts:
+        return pattern.search(text, max(0, min(starts) - SUMMARY_LOOKBACK))
+    return None
+
+def listing_features(description, amenities):
+    """Labels of the SUMMARY_FEATURES found in the text, in SUMMARY_FEATURES order.
+    
+    Amenity list entries that match no feature are kept verbatim after them.
+    """
+    description = (description or '').lower()
+    items = [item.lower() for item in amenities]
+    unmatched = set(range(len(items)))
+    
+    features = []
+    for label, keywords, pattern in SUMMARY_PATTERNS:
+        match = feature_match(keywords, pattern, description)
+        for i, item in enumerate(items):
+            item_match = feature_match(keywords, pattern, item)
+            if item_match:
+                unmatched.discard(i)
+                match = match or item_match
+        if match:
+            # "{} view" takes the matched place name
+            features.append(label.format(match.group().rsplit(' ', 1)[0].title()) if '{}' in label else label)
+    
+    features.extend(amenities[i] for i in sorted(unmatched) if amenities[i] not in features)
+    return features
+
+def listing_summary(doc, amenities_text=''):
+    """Compact, deterministic one-line summary of a parsed doc for LLM prompts"""
+    parts = []
+    if doc.get('property_name'):
+        parts.append(doc['property_name'].strip())
+    
+    bedrooms = doc.get('number_of_bedrooms')
+    layout = 'Studio' if bedrooms == 0 else (f"{bedrooms}BR" if bedrooms else '')
+    kind = ' '.join(filter(None, [layout, doc.get('property_type')]))
+    if kind:
+        parts.append(kind)
+    
+    location = ', '.join(filter(None, [doc.get('community_name'), doc.get('city_name')]))
+    if location:
+        parts.append(location)
+    
+    if doc.get('total_area_sqm'):
+        parts.append(f"{doc['total_area_sqm']:.0f} sqm")
+    if doc.get('asking_price'):
+        parts.append(f"{doc.get('asking_price_currency') or 'AED'} {doc['asking_price']:,}")
+    
+    status = ' & '.join(label for flag, label in (('for_sale', 'For sale'), ('for_rent', 'For rent')) if doc.get(flag))
+    if status:
+        parts.append(status)
+    
+    features = listing_features(doc.get('description'), amenity_items(amenities_text))
+    if doc.get('furnished_yn') and not {'Furnished', 'Semi-furnished'} & set(features):
+        features.insert(0, 'Furnished')
+    if features:
+        parts.append(f"Features: {', '.join(features[:SUMMARY_MAX_FEATURES])}")
+    
+    return ' | '.join(parts)
+
+# Source columns read by parse_csv_row and create_combined_text - everything
+# else in the ~75 column export is dropped as soon as a row is read
+SOURCE_COLUMNS = [
+    'listing_id', 'property_name', 'city_name', 'property_type',
+    'asking_price', 'asking_price_currency', 'Number of Bedrooms',
+    'bathrooms_total', 'total_area_sqm', 'community_name', 'area_name_en',
+    'description', 'for_sale', 'for_rent', 'listing_url',
+    'list_agent_full_name', 'map_coordinates_latitude', 'map_coordinates_longitude',
+    'furnished_yn', 'building_name', 'development_name', 'date_listed', 'amenities_text'
+]
+
+def geo_point(lat, lon):
+    """geo_point value for the location field, or None when coordinates are unusable"""
+    if lat is None or lon is None:
+        return None
+    # 0,0 is a placeholder, not a listing location
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180) or (lat == 0 and lon == 0):
+        return None
+    return {'lat': lat, 'lon': lon}
+
+def listing_date(value):
+    """date_listed as YYYY-MM-DD - the feed writes DD/MM/YYYY, other exports ISO"""
+    value = (value or '').strip()
+    for fmt in ('%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value[:10], fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
 def parse_csv_row(row):
     def safe_convert(value, converter, default=None):
         try:
@@ -92,6 +427,9 @@ def parse_csv_row(row):
             pass
         return default
     
+    latitude = safe_convert(row.get('map_coordinates_latitude'), float)
+    longitude = safe_convert(row.get('map_coordinates_longitude'), float)
+    
     return {
         'listing_id': row.get('listing_id', ''),
         'property_name': row.get('property_name', ''),
@@ -104,71 +442,1506 @@ def parse_csv_row(row):
         'total_area_sqm': safe_convert(row.get('total_area_sqm'), float),
         'community_name': row.get('community_name', ''),
         'area_name_en': row.get('area_name_en', ''),
+        'building_name': row.get('building_name', ''),
+        'development_name': row.get('development_name', ''),
         'description': row.get('description', ''),
         'for_sale': row.get('for_sale', '').lower() == 'true',
         'for_rent': row.get('for_rent', '').lower() == 'true',
+        'furnished_yn': row.get('furnished_yn', '').lower() == 'true',
         'listing_url': row.get('listing_url', ''),
         'list_agent_full_name': row.get('list_agent_full_name', ''),
+        'date_listed': listing_date(row.get('date_listed')),
+        'map_coordinates_latitude': latitude,
+        'map_coordinates_longitude': longitude,
+        'location': geo_point(latitude, longitude),
     }
 
-def lambda_handler(event, context):
+def iter_parsed_docs(rows, stats):
+    for row in rows:
+        stats.increment('rows')
+        try:
+            doc = parse_csv_row(row)
+            
+            if not doc.get('listing_id'):
+                stats.increment('skipped')
+                continue
+            
+            doc['combined_text'] = create_combined_text(row)
+            doc['summary'] = listing_summary(doc, row.get('amenities_text'))
+            yield doc
+        except Exception as e:
+            print(f"Error processing row: {e}")
+            stats.increment('failed')
+
+def source_format(key):
+    name = key.lower()
+    if name.endswith(('.parquet', '.pq')):
+        return 'parquet'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if name.endswith('.json'):
+        return 'json'
+    return 'csv'
+
+def project_rows(reader, fieldnames):
+    """Turn csv.reader lists into dicts holding only SOURCE_COLUMNS"""
+    columns = [name for name in SOURCE_COLUMNS if name in fieldnames]
+    positions = [fieldnames.index(name) for name in columns]
+    width = max(positions) + 1 if positions else 0
+    
+    for values in reader:
+        if not values:
+            continue
+        if len(values) < width:
+            values = values + [''] * (width - len(values))
+        yield {name: values[i] for name, i in zip(columns, positions)}
+
+def iter_csv_rows(lines, fieldnames=None):
+    """Yield projected CSV rows one at a time from an iterator of lines"""
+    # newline-split lines keep their terminators, so quoted multi-line
+    # descriptions are reassembled by the csv module as usual
+    reader = csv.reader(lines)
+    if fieldnames is None:
+        fieldnames = next(reader, [])
+    yield from project_rows(reader, fieldnames)
+
+def json_to_text(value):
+    # parse_csv_row works on CSV strings
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+def json_row(record):
+    return {name: json_to_text(record[name]) for name in SOURCE_COLUMNS if name in record}
+
+# Whitespace and the commas between array elements
+JSON_SEPARATORS = re.compile(r'[\s,]*')
+
+def iter_jsonl_rows(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        yield json_row(json.loads(line))
+
+def iter_json_rows(pieces):
+    """Records of a .json export - a JSON array, or JSON lines under a .json name.
+    
+    Decoded from text chunks one record at a time, so a minified array on a
+    single line is never held whole.
+    """
+    pieces = iter(pieces)
+    decoder = json.JSONDecoder()
+    pending, pos = '', 0
+    array = None
+    
+    while True:
+        pos = JSON_SEPARATORS.match(pending, pos).end()
+        if array is None and pos < len(pending):
+            array = pending[pos] == '['
+            pos += array
+            continue
+        if array and pending.startswith(']', pos):
+            return
+        
+        try:
+            record, pos = decoder.raw_decode(pending, pos)
+        except ValueError:
+            # Most often a record split across chunks - read on and retry
+            piece = next(pieces, None)
+            if piece is None:
+                if array or pos < len(pending):
+                    raise ValueError(f"Malformed or truncated JSON near: {pending[pos:pos + 80]!r}")
+                return
+            pending, pos = pending[pos:] + piece, 0
+            continue
+        yield json_row(record)
+
+def open_parquet_file(bucket, key):
+    if pq is None:
+        raise ValueError("Parquet input requires pyarrow - add it to the deployment package")
+    
+    # Ranged reads, so only the projected column chunks are fetched
+    s3 = pafs.S3FileSystem(region=REGION)
+    return pq.ParquetFile(s3.open_input_file(f"{bucket}/{key}"))
+
+def parquet_decoded(column):
+    if pa.types.is_dictionary(column.type):
+        return column.dictionary_decode()
+    return column
+
+def parquet_text(column):
+    return pc.fill_null(pc.cast(parquet_decoded(column), pa.string()), '').to_pylist()
+
+def parquet_list_text(column):
+    """amenities_text may be a list column rather than its string repr"""
+    column = parquet_decoded(column)
+    if pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+        return pc.fill_null(pc.binary_join(column, ','), '').to_pylist()
+    return parquet_text(column)
+
+def parquet_number(column, target):
+    """Vectorized safe_convert - values that don't parse become null"""
+    column = parquet_decoded(column)
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        column = pc.utf8_trim_whitespace(column)
+        pattern = r'^[+-]?\d+$' if target == pa.int64() else r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$'
+        valid = pc.fill_null(pc.match_substring_regex(column, pattern), False)
+        column = pc.if_else(valid, column, pa.scalar(None, column.type))
+    return pc.cast(column, target, safe=False).to_pylist()
+
+def parquet_flag(column):
+    column = parquet_decoded(column)
+    if not pa.types.is_boolean(column.type):
+        column = pc.equal(pc.utf8_lower(pc.cast(column, pa.string())), 'true')
+    return pc.fill_null(column, False).to_pylist()
+
+def iter_parquet_docs(parquet_file, stats):
+    """Parquet equivalent of iter_parsed_docs with column-at-a-time conversion"""
+    available = set(parquet_file.schema_arrow.names)
+    columns = [name for name in SOURCE_COLUMNS if name in available]
+    
+    for batch in parquet_file.iter_batches(batch_size=PARQUET_BATCH_ROWS, columns=columns):
+        size = batch.num_rows
+        stats.increment('rows', size)
+        arrays = dict(zip(batch.schema.names, batch.columns))
+        
+        def text(name):
+            return parquet_text(arrays[name]) if name in arrays else [''] * size
+        
+        def number(name, target):
+            return parquet_number(arrays[name], target) if name in arrays else [None] * size
+        
+        def flag(name):
+            return parquet_flag(arrays[name]) if name in arrays else [False] * size
+        
+        values = {
+            'listing_id': text('listing_id'),
+            'property_name': text('property_name'),
+            'city_name': text('city_name'),
+            'property_type': text('property_type'),
+            'asking_price': number('asking_price', pa.int64()),
+            'asking_price_currency': text('asking_price_currency'),
+            'number_of_bedrooms': number('Number of Bedrooms', pa.int64()),
+            'bathrooms_total': number('bathrooms_total', pa.int64()),
+            'total_area_sqm': number('total_area_sqm', pa.float64()),
+            'community_name': text('community_name'),
+            'area_name_en': text('area_name_en'),
+            'building_name': text('building_name'),
+            'development_name': text('development_name'),
+            'description': text('description'),
+            'for_sale': flag('for_sale'),
+            'for_rent': flag('for_rent'),
+            'furnished_yn': flag('furnished_yn'),
+            'listing_url': text('listing_url'),
+            'list_agent_full_name': text('list_agent_full_name'),
+            'date_listed': text('date_listed'),
+            'map_coordinates_latitude': number('map_coordinates_latitude', pa.float64()),
+            'map_coordinates_longitude': number('map_coordinates_longitude', pa.float64()),
+        }
+        # create_combined_text formats the raw source values
+        price_text = text('asking_price')
+        bedrooms_text = text('Number of Bedrooms')
+        amenities_text = parquet_list_text(arrays['amenities_text']) if 'amenities_text' in arrays else [''] * size
+        
+        for i in range(size):
+            doc = {name: column[i] for name, column in values.items()}
+            
+            if not doc['listing_id']:
+                stats.increment('skipped')
+                continue
+            
+            doc['location'] = geo_point(doc['map_coordinates_latitude'], doc['map_coordinates_longitude'])
+            doc['date_listed'] = listing_date(doc['date_listed'])
+            row = dict(doc, asking_price=price_text[i])
+            row['Number of Bedrooms'] = bedrooms_text[i]
+            doc['combined_text'] = create_combined_text(row)
+            doc['summary'] = listing_summary(doc, amenities_text[i])
+            yield doc
+
+def iter_source_docs(bucket, key, stats):
+    """Parsed docs from a CSV, JSON, JSONL or Parquet object, streamed"""
+    fmt = source_format(key)
+    
+    if fmt == 'parquet':
+        yield from iter_parquet_docs(open_parquet_file(bucket, key), stats)
+        return
+    
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    body = response['Body']
+    print(f"Streaming {response.get('ContentLength', 'unknown')} bytes of {fmt}")
+    
     try:
-        bucket = event['Records'][0]['s3']['bucket']['name']
-        key = event['Records'][0]['s3']['object']['key']
+        if fmt == 'json':
+            rows = iter_json_rows(iter_text_chunks(body))
+        elif fmt == 'jsonl':
+            rows = iter_jsonl_rows(iter_text_lines(body))
+        else:
+            rows = iter_csv_rows(iter_text_lines(body))
+        yield from iter_parsed_docs(rows, stats)
+    finally:
+        body.close()
+
+def content_hash(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+# Agency boilerplate that differs between copies of the same listing - links,
+# emails, and (as bare numbers) phone and reference numbers
+DESCRIPTION_NOISE = re.compile(r'@|://|^www\.')
+DESCRIPTION_WORD = re.compile(r'[a-z]+[a-z0-9]*')
+# Word hashes are cached and combined per shingle; the table is reset when it
+# grows past this many words
+WORD_HASH_LIMIT = 200000
+HASH_MASK = (1 << 64) - 1
+# Borrowed MinHash values are offset by their distance so they never equal a real one
+DENSIFY_OFFSET = 1 << 64
+
+word_hashes = {}
+
+def word_hash(word):
+    value = word_hashes.get(word)
+    if value is None:
+        if len(word_hashes) >= WORD_HASH_LIMIT:
+            word_hashes.clear()
+        # Stable across runs, so sync runs keep picking the same clusters
+        value = int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+        word_hashes[word] = value
+    return value
+
+def shingle_hashes(text):
+    """Hashes of the three-word shingles of a description with boilerplate removed"""
+    text = (text or '').lower()
+    if '@' in text or '://' in text or 'www.' in text:
+        text = ' '.join(token for token in text.split() if not DESCRIPTION_NOISE.search(token))
+    hashes = [word_hashes.get(word) or word_hash(word) for word in DESCRIPTION_WORD.findall(text)]
+    return {
+        (a * 0x9E3779B97F4A7C15 + b * 0xC2B2AE3D27D4EB4F + c) & HASH_MASK
+        for a, b, c in zip(hashes, hashes[1:], hashes[2:])
+    }
+
+def minhash_signature(shingles):
+    """One-permutation MinHash over DEDUP_BINS bins, or None for short descriptions.
+    
+    Each shingle hash lands in one bin (its low bits) and the bin keeps its
+    minimum, so a signature costs one sort instead of one pass per
+    permutation. Empty bins borrow the next non-empty bin (rotation
+    densification).
+    """
+    if len(shingles) < DEDUP_MIN_SHINGLES:
+        return None
+    
+    # Descending order, so the last write to each bin is its minimum
+    minimums = {value % DEDUP_BINS: value for value in sorted(shingles, reverse=True)}
+    if len(minimums) == DEDUP_BINS:
+        return tuple(minimums[slot] for slot in range(DEDUP_BINS))
+    
+    # Walk the bins backwards twice round so every empty bin has seen its
+    # next non-empty neighbour
+    signature = [0] * DEDUP_BINS
+    nearest = distance = 0
+    for step in range(2 * DEDUP_BINS - 1, -1, -1):
+        slot = step % DEDUP_BINS
+        if slot in minimums:
+            nearest, distance = minimums[slot], 0
+        else:
+            distance += 1
+        if step < DEDUP_BINS:
+            signature[slot] = nearest + distance * DENSIFY_OFFSET
+    return tuple(signature)
+
+def within(a, b, tolerance):
+    return a is None or b is None or abs(a - b) <= tolerance * max(abs(a), abs(b))
+
+def cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = (sum(x * x for x in a) * sum(y * y for y in b)) ** 0.5
+    return dot / norm if norm else 0.0
+
+def short_hash(value):
+    """Stable 32-bit hash, never 0 (0 marks a missing key)"""
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=4).digest(), 'little') or 1
+
+class Deduplicator:
+    """Clusters near-duplicate listings across a whole feed.
+    
+    Candidates share an LSH band of their description signatures or a
+    building/bedrooms/area key. Buckets are capped at DEDUP_MAX_BUCKET so
+    boilerplate descriptions can't make the pass quadratic. A candidate
+    pair collapses when its listing details agree and its descriptions are
+    near-identical; looser pairs are settled by embedding cosine.
+    
+    Per row only flat arrays are kept in memory - 16-bit signature values,
+    32-bit band and unit hashes and the listing details. Texts and
+    alternate entries are spilled to a temp file and read back only for
+    the rows that need an embedding or end up in a cluster.
+    """
+    BANDS = DEDUP_BINS // DEDUP_BAND_ROWS
+    
+    def __init__(self, cache=None, tps=None):
+        self.cache = cache
+        self.limiter = TokenBucket(tps or EMBEDDING_TPS)
+        self.seen = set()
+        self.count = 0
+        self.overflow = False
+        self.signatures = array('H')
+        self.signed = array('B')
+        self.bands = [array('I') for _ in range(self.BANDS)]
+        self.units = array('I')
+        self.rent = array('B')
+        self.buildings = array('I')
+        self.bedrooms = array('h')
+        self.areas = array('d')
+        self.prices = array('d')
+        self.filled = array('H')
+        self.lengths = array('I')
+        self.offsets = array('Q')
+        self.spill = tempfile.TemporaryFile()
+        self.parent = array('l')
+        self.pending = []
+        self.text_matches = 0
+        self.evicted = 0
+        self.capped = 0
+        self.alternates = {}
+        self.dropped = set()
+    
+    def find(self, row):
+        while self.parent[row] != row:
+            self.parent[row] = self.parent[self.parent[row]]
+            row = self.parent[row]
+        return row
+    
+    def union(self, a, b):
+        self.parent[self.find(a)] = self.find(b)
+    
+    def record(self, row):
+        """(listing_id, combined_text, alternate entry) from the spill file"""
+        self.spill.seek(self.offsets[row])
+        return json.loads(self.spill.readline())
+    
+    def compare(self, a, b):
+        if self.rent[a] != self.rent[b] or not within(self.areas[a] or None, self.areas[b] or None, DEDUP_AREA_TOLERANCE):
+            return
+        bedrooms_a, bedrooms_b = self.bedrooms[a], self.bedrooms[b]
+        if bedrooms_a >= 0 and bedrooms_b >= 0 and bedrooms_a != bedrooms_b:
+            return
+        building_a, building_b = self.buildings[a], self.buildings[b]
+        if building_a and building_b and building_a != building_b:
+            return
         
-        print(f"Processing: s3://{bucket}/{key}")
+        similarity = None
+        if self.signed[a] and self.signed[b]:
+            start_a, start_b = a * DEDUP_BINS, b * DEDUP_BINS
+            similarity = sum(
+                x == y for x, y in zip(
+                    self.signatures[start_a:start_a + DEDUP_BINS], self.signatures[start_b:start_b + DEDUP_BINS]
+                )
+            ) / DEDUP_BINS
         
-        response = s3_client.get_object(Bucket=bucket, Key=key)
-        csv_content = response['Body'].read().decode('utf-8')
+        if similarity is not None and similarity >= DEDUP_JACCARD:
+            self.text_matches += 1
+            self.union(a, b)
+            return
         
-        csv_reader = csv.DictReader(io.StringIO(csv_content))
-        rows = list(csv_reader)
+        # Same unit key with different copy, or copy that is only partly shared
+        price_a, price_b = self.prices[a], self.prices[b]
+        same_unit = (
+            building_a and building_a == building_b and bedrooms_a >= 0
+            and self.areas[a] and self.areas[b] and price_a and price_b
+            and within(price_a, price_b, DEDUP_PRICE_TOLERANCE)
+        )
+        if same_unit or (similarity is not None and similarity >= DEDUP_JACCARD_MIN):
+            entry = (similarity or 0.0, a, b)
+            if len(self.pending) < DEDUP_MAX_PENDING:
+                heapq.heappush(self.pending, entry)
+            else:
+                heapq.heappushpop(self.pending, entry)
+                self.evicted += 1
+    
+    def add(self, doc):
+        if self.overflow:
+            return
         
-        print(f"Found {len(rows)} rows")
+        listing_id = doc['listing_id']
+        id_hash = int.from_bytes(hashlib.blake2b(listing_id.encode('utf-8'), digest_size=8).digest(), 'little')
+        if id_hash in self.seen:
+            return
+        if self.count >= DEDUP_MAX_ROWS:
+            print(f"Dedup: feed has more than {DEDUP_MAX_ROWS} rows - loading without near-duplicate collapse")
+            self.overflow = True
+            return
+        self.seen.add(id_hash)
+        row = self.count
+        self.count += 1
         
-        os_client = get_opensearch_client()
+        signature = minhash_signature(shingle_hashes(doc.get('description')))
+        self.signed.append(1 if signature else 0)
+        # hash() folds in the densify offset, which the low bits alone would lose
+        self.signatures.extend(hash(value) & 0xFFFF for value in signature or (0,) * DEDUP_BINS)
+        for band, start in zip(self.bands, range(0, DEDUP_BINS, DEDUP_BAND_ROWS)):
+            band.append((hash((start,) + signature[start:start + DEDUP_BAND_ROWS]) & DEDUP_HASH_MASK or 1) if signature else 0)
+        
+        for_rent = bool(doc.get('for_rent') and not doc.get('for_sale'))
+        building = re.sub(r'\s+', ' ', str(doc.get('building_name') or '').strip().lower())
+        building_hash = short_hash(building) if building else 0
+        bedrooms = doc.get('number_of_bedrooms')
+        area = doc.get('total_area_sqm')
+        has_unit = building and bedrooms is not None and area
+        self.units.append(short_hash((for_rent, building, bedrooms, round(area))) if has_unit else 0)
+        self.rent.append(for_rent)
+        self.buildings.append(building_hash)
+        self.bedrooms.append(bedrooms if bedrooms is not None and 0 <= bedrooms < 32768 else -1)
+        self.areas.append(area or 0.0)
+        self.prices.append(doc.get('asking_price') or 0.0)
+        self.filled.append(min(65535, sum(1 for value in doc.values() if value not in (None, '', False))))
+        self.lengths.append(len(doc.get('description') or ''))
+        self.parent.append(row)
+        
+        self.offsets.append(self.spill.tell())
+        entry = {name: doc.get(name) for name in ALTERNATE_FIELDS}
+        self.spill.write(json.dumps([listing_id, doc['combined_text'], entry], default=str).encode('utf-8') + b'\n')
+    
+    def candidates(self):
+        """Compare the rows of every band and unit bucket, first DEDUP_MAX_BUCKET rows each"""
+        for keys in self.bands + [self.units]:
+            order = sorted(range(self.count), key=keys.__getitem__)
+            for key, group in itertools.groupby(order, key=keys.__getitem__):
+                if not key:
+                    continue
+                members = list(itertools.islice(group, DEDUP_MAX_BUCKET + 1))
+                if len(members) > DEDUP_MAX_BUCKET:
+                    self.capped += 1
+                    members = members[:DEDUP_MAX_BUCKET]
+                for i, a in enumerate(members):
+                    for b in members[i + 1:]:
+                        if self.find(a) != self.find(b):
+                            self.compare(a, b)
+    
+    def embedding(self, text, stats):
+        text_hash = content_hash(text)
+        embedding = self.cache.get(text_hash) if self.cache else None
+        if embedding is None:
+            embedding = get_embedding(text, self.limiter, stats)
+            # Cached, so a sync run doesn't pay for the canonical listing again
+            if embedding and self.cache:
+                self.cache.put(text_hash, embedding)
+        return embedding
+    
+    def finish(self, stats):
+        """Settle the looser pairs, pick each cluster's canonical listing and record stats"""
+        if self.overflow:
+            stats.increment('dedup_skipped_rows', self.count)
+            self.spill.close()
+            return
+        
+        self.candidates()
+        
+        # Closest copy first, so the budget goes to the likeliest duplicates
+        self.pending.sort(reverse=True)
+        pairs = list(dict.fromkeys((a, b) for _, a, b in self.pending if self.find(a) != self.find(b)))
+        skipped = max(0, len(pairs) - DEDUP_MAX_CHECKS) + self.evicted
+        pairs = pairs[:DEDUP_MAX_CHECKS]
+        rows = sorted({row for pair in pairs for row in pair})
+        texts = {row: self.record(row)[1] for row in rows}
+        
+        with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as pool:
+            embeddings = dict(zip(rows, pool.map(lambda row: self.embedding(texts[row], stats), rows)))
+        
+        embedding_matches = 0
+        for a, b in pairs:
+            if embeddings[a] and embeddings[b] and cosine(embeddings[a], embeddings[b]) >= DEDUP_COSINE:
+                embedding_matches += 1
+                self.union(a, b)
+        
+        clusters = {}
+        for row in range(self.count):
+            root = self.find(row)
+            if root != row:
+                clusters.setdefault(root, [root]).append(row)
+        
+        cluster_count = len(clusters)
+        for members in clusters.values():
+            records = {row: self.record(row) for row in members}
+            # Most complete listing wins, then the longest description
+            members.sort(key=lambda row: (-self.filled[row], -self.lengths[row], records[row][0]))
+            canonical, rest = members[0], members[1:]
+            self.alternates[records[canonical][0]] = [records[row][2] for row in rest]
+            self.dropped.update(records[row][0] for row in rest)
+        self.spill.close()
+        
+        stats.increment('dedup_listings', self.count)
+        stats.increment('dedup_clusters', cluster_count)
+        stats.increment('dedup_collapsed', len(self.dropped))
+        stats.increment('dedup_text_matches', self.text_matches)
+        stats.increment('dedup_embedding_checks', len(pairs))
+        stats.increment('dedup_embedding_matches', embedding_matches)
+        stats.increment('dedup_checks_skipped', skipped)
+        stats.increment('dedup_capped_buckets', self.capped)
+        
+        print(f"Dedup: {self.count} listings -> {self.count - len(self.dropped)} "
+              f"({cluster_count} clusters, {len(pairs)} embedding checks, {self.capped} capped buckets)")
+
+def deduplicated_docs(bucket, key, stats, cache=None):
+    """Source docs with near-duplicates collapsed into one canonical listing.
+    
+    The source is read twice - the first pass keeps only signatures and
+    listing details, the second streams docs into the pipeline as usual.
+    """
+    dedup = Deduplicator(cache)
+    for doc in iter_source_docs(bucket, key, PipelineStats()):
+        dedup.add(doc)
+    dedup.finish(stats)
+    
+    for doc in iter_source_docs(bucket, key, stats):
+        listing_id = doc['listing_id']
+        if listing_id in dedup.dropped:
+            continue
+        if listing_id in dedup.alternates:
+            doc['alternate_listings'] = dedup.alternates[listing_id]
+        yield doc
+
+def source_docs(bucket, key, stats, cache=None):
+    if DEDUPLICATE:
+        return deduplicated_docs(bucket, key, stats, cache)
+    return iter_source_docs(bucket, key, stats)
+
+def partition_slug(value):
+    return re.sub(r'[^a-z0-9]+', '-', str(value or '').lower()).strip('-') or 'other'
+
+def partition_index(doc):
+    """Physical index a document is written to under INDEX_PARTITIONING"""
+    if INDEX_PARTITIONING == 'none':
+        return INDEX_NAME
+    
+    # Listings flagged both ways (or neither) live in the sale partition
+    listing = 'rent' if doc.get('for_rent') and not doc.get('for_sale') else 'sale'
+    name = f"{INDEX_NAME}-{listing}"
+    
+    if INDEX_PARTITIONING == 'listing_type':
+        name += f"-{partition_slug(doc.get('property_type'))}"
+    return name
+
+def all_partitions():
+    """Index expression covering every partition"""
+    if INDEX_PARTITIONING == 'none':
+        return INDEX_NAME
+    return f"{INDEX_NAME}-sale*,{INDEX_NAME}-rent*"
+
+class EmbeddingCache:
+    """Persistent text hash -> embedding cache stored as float32 blobs in S3"""
+    def __init__(self, bucket, prefix):
+        self.bucket = bucket
+        self.prefix = f"{prefix}embedding-cache/{EMBEDDING_MODEL}/"
+        self.known = set()
+        self.lock = threading.Lock()
+        
+        # One listing up front so lookups for new text never cost a GET
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                self.known.add(obj['Key'][len(self.prefix):])
+        
+        print(f"Embedding cache: {len(self.known)} entries")
+    
+    def get(self, text_hash):
+        with self.lock:
+            if text_hash not in self.known:
+                return None
+        
+        try:
+            response = s3_client.get_object(Bucket=self.bucket, Key=self.prefix + text_hash)
+            vector = array('f')
+            vector.frombytes(response['Body'].read())
+            return vector.tolist()
+        except Exception as e:
+            print(f"Embedding cache read error: {e}")
+            return None
+    
+    def put(self, text_hash, embedding):
+        try:
+            s3_client.put_object(
+                Bucket=self.bucket,
+                Key=self.prefix + text_hash,
+                Body=array('f', embedding).tobytes()
+            )
+            with self.lock:
+                self.known.add(text_hash)
+        except Exception as e:
+            print(f"Embedding cache write error: {e}")
+
+class SyncState:
+    """Per-listing content hashes and OpenSearch document ids for incremental sync"""
+    def __init__(self, bucket, prefix):
+        self.bucket = bucket
+        self.key = f"{prefix}{INDEX_NAME}/manifest.json"
+        self.cache = EmbeddingCache(bucket, prefix)
+        self.seen = set()
+        self.pending = {}
+        self.lock = threading.Lock()
+        
+        try:
+            response = s3_client.get_object(Bucket=bucket, Key=self.key)
+            self.entries = json.loads(response['Body'].read())
+        except Exception as e:
+            if 'NoSuchKey' not in str(e):
+                raise
+            self.entries = {}
+        
+        print(f"Sync manifest: {len(self.entries)} listings")
+    
+    def needs_index(self, doc, stats):
+        """Record hashes for doc and return True when it must be (re)indexed"""
+        listing_id = doc['listing_id']
+        
+        if listing_id in self.seen:
+            stats.increment('duplicate_ids')
+            return False
+        self.seen.add(listing_id)
+        
+        doc_hash = content_hash(json.dumps(doc, sort_keys=True, default=str))
+        text_hash = content_hash(doc['combined_text'])
+        
+        with self.lock:
+            entry = self.entries.get(listing_id)
+            if entry and entry.get('doc_hash') == doc_hash:
+                stats.increment('unchanged')
+                return False
+            
+            self.pending[listing_id] = {'doc_hash': doc_hash, 'text_hash': text_hash}
+        
+        stats.increment('changed' if entry else 'new')
+        return True
+    
+    def text_hash(self, listing_id):
+        with self.lock:
+            return self.pending[listing_id]['text_hash']
+    
+    def stale_doc_ids(self, os_client, docs):
+        """(index, document id) pairs currently holding older versions of these listings"""
+        doc_ids = []
+        unknown = []
         
-        processed = 0
-        failed = 0
+        with self.lock:
+            for doc in docs:
+                entry = self.entries.get(doc['listing_id'])
+                if entry:
+                    # Manifests written before partitioning have no index
+                    doc_ids.append((entry.get('index', INDEX_NAME), entry['doc_id']))
+                else:
+                    unknown.append(doc['listing_id'])
         
-        for row in rows:
+        # Listings indexed before the manifest existed (or by a run that
+        # died before saving it) are found by listing_id
+        if unknown:
             try:
-                doc = parse_csv_row(row)
-                
-                if not doc.get('listing_id'):
+                response = os_client.search(
+                    index=all_partitions(),
+                    body={
+                        "size": min(10000, len(unknown) * 10),
+                        "_source": False,
+                        "query": {"terms": {"listing_id": unknown}}
+                    }
+                )
+                doc_ids.extend((hit['_index'], hit['_id']) for hit in response['hits']['hits'])
+            except Exception as e:
+                print(f"Stale document lookup error: {e}")
+        
+        return doc_ids
+    
+    def record(self, listing_id, doc_id, index_name):
+        with self.lock:
+            hashes = self.pending.pop(listing_id)
+            self.entries[listing_id] = {'doc_id': doc_id, 'index': index_name, **hashes}
+    
+    def forget(self, listing_id):
+        with self.lock:
+            self.pending.pop(listing_id, None)
+            self.entries.pop(listing_id, None)
+    
+    def remove_missing(self, os_client, stats):
+        """Delete listings that were in the previous feed but not this one"""
+        with self.lock:
+            missing = [listing_id for listing_id in self.entries if listing_id not in self.seen]
+        
+        for i in range(0, len(missing), BULK_BATCH_SIZE):
+            batch = missing[i:i + BULK_BATCH_SIZE]
+            actions = [
+                {"delete": {
+                    "_index": self.entries[listing_id].get('index', INDEX_NAME),
+                    "_id": self.entries[listing_id]['doc_id']
+                }}
+                for listing_id in batch
+            ]
+            
+            try:
+                os_client.bulk(body=actions)
+            except Exception as e:
+                print(f"Bulk delete error: {e}")
+                continue
+            
+            for listing_id in batch:
+                self.forget(listing_id)
+            stats.increment('deleted', len(batch))
+    
+    def save(self):
+        with self.lock:
+            body = json.dumps(self.entries)
+        
+        s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Body=body,
+            ContentType='application/json'
+        )
+        print(f"Saved sync manifest to s3://{self.bucket}/{self.key}")
+
+def bulk_index(os_client, docs, stats, sync=None):
+    actions = []
+    
+    # Old versions are removed in the same request as the new ones are written
+    if sync:
+        for index_name, doc_id in sync.stale_doc_ids(os_client, docs):
+            actions.append({"delete": {"_index": index_name, "_id": doc_id}})
+        stats.increment('stale_removed', len(actions))
+    
+    for doc in docs:
+        # No _id for OpenSearch Serverless vector collections
+        actions.append({"index": {"_index": partition_index(doc)}})
+        actions.append(doc)
+    
+    try:
+        response = os_client.bulk(body=actions)
+    except Exception as e:
+        print(f"Bulk index error: {e}")
+        stats.increment('failed', len(docs))
+        if sync:
+            for doc in docs:
+                sync.forget(doc['listing_id'])
+        return
+    
+    index_items = [item['index'] for item in response.get('items', []) if 'index' in item]
+    errors = 0
+    
+    for doc, item in zip(docs, index_items):
+        if item.get('error'):
+            if not errors:
+                print(f"Bulk index error for {doc['listing_id']}: {item['error']}")
+            errors += 1
+            if sync:
+                sync.forget(doc['listing_id'])
+        elif sync:
+            sync.record(doc['listing_id'], item['_id'], item.get('_index', partition_index(doc)))
+    
+    if errors:
+        print(f"Bulk index: {errors} of {len(docs)} documents rejected")
+    
+    stats.increment('indexed', len(docs) - errors)
+    stats.increment('failed', errors)
+    stats.increment('bulk_requests')
+
+def index_worker(os_client, index_queue, stats, sync=None):
+    batch = []
+    while True:
+        doc = index_queue.get()
+        if doc is None:
+            break
+        
+        batch.append(doc)
+        if len(batch) >= BULK_BATCH_SIZE:
+            bulk_index(os_client, batch, stats, sync)
+            batch = []
+            print(f"Indexed {stats.get('indexed')} documents...")
+    
+    if batch:
+        bulk_index(os_client, batch, stats, sync)
+
+def start_indexer(os_client, index_queue, stats, sync=None):
+    indexer = threading.Thread(target=index_worker, args=(os_client, index_queue, stats, sync))
+    indexer.start()
+    return indexer
+
+def embed_worker(doc, limiter, stats, index_queue, in_flight, sync=None):
+    try:
+        embedding = None
+        if sync:
+            text_hash = sync.text_hash(doc['listing_id'])
+            embedding = sync.cache.get(text_hash)
+            if embedding:
+                stats.increment('embedding_cache_hits')
+        
+        if not embedding:
+            embedding = get_embedding(doc['combined_text'], limiter, stats)
+            if embedding and sync:
+                sync.cache.put(text_hash, embedding)
+        
+        if embedding:
+            doc['embedding'] = embedding
+            stats.increment('embedded')
+            # Blocks when the indexer falls behind
+            index_queue.put(doc)
+        else:
+            stats.increment('failed')
+            if sync:
+                sync.forget(doc['listing_id'])
+    except Exception as e:
+        print(f"Error embedding row {doc.get('listing_id')}: {e}")
+        stats.increment('failed')
+    finally:
+        in_flight.release()
+
+def run_ingestion_pipeline(docs, os_client, sync=None, stats=None, tps=None):
+    """Embed parsed docs concurrently under the TPS limit and bulk index them"""
+    stats = stats or PipelineStats()
+    limiter = TokenBucket(tps or EMBEDDING_TPS)
+    index_queue = queue.Queue(maxsize=INDEX_QUEUE_SIZE)
+    # Caps rows parsed but not yet embedded so the reader can't run ahead
+    in_flight = threading.BoundedSemaphore(EMBEDDING_CONCURRENCY * 2)
+    
+    indexer = start_indexer(os_client, index_queue, stats, sync)
+    
+    try:
+        with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as pool:
+            for doc in docs:
+                if sync and not sync.needs_index(doc, stats):
                     continue
                 
-                combined_text = create_combined_text(row)
-                doc['combined_text'] = combined_text
-                
-                embedding = get_embedding(combined_text)
-                if embedding:
-                    doc['embedding'] = embedding
-                    
-                    # FIXED: Removed id parameter for OpenSearch Serverless
-                    os_client.index(
-                        index=INDEX_NAME,
-                        body=doc
-                    )
-                    processed += 1
-                    
-                    if processed % 5 == 0:
-                        print(f"Processed {processed} documents...")
-                else:
-                    failed += 1
+                in_flight.acquire()
+                pool.submit(embed_worker, doc, limiter, stats, index_queue, in_flight, sync)
+    finally:
+        index_queue.put(None)
+        indexer.join()
+    
+    return stats
+
+def iter_text_chunks(body, chunk_size=STREAM_CHUNK_SIZE):
+    """Decode a byte stream incrementally, chunk by chunk"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    for chunk in body.iter_chunks(chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+def iter_text_lines(body, chunk_size=STREAM_CHUNK_SIZE):
+    """Decode a byte stream incrementally and yield newline-terminated lines"""
+    pending = ''
+    
+    for text in iter_text_chunks(body, chunk_size):
+        pending += text
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    
+    if pending:
+        yield pending
+
+def upload_temp_file(temp_file, bucket, key):
+    temp_file.close()
+    s3_client.upload_file(temp_file.name, bucket, key)
+    os.unlink(temp_file.name)
+
+def write_batch_input(docs, bucket, job_prefix):
+    """Write batch model input JSONL parts plus the parsed docs they join back to.
+    
+    Each input part has a docs part of the same name, so the join only ever
+    holds one part's docs in memory.
+    """
+    docs_file = None
+    input_file = None
+    part = 0
+    part_records = 0
+    records = 0
+    
+    try:
+        for doc in docs:
+            if input_file and part_records >= BATCH_RECORDS_PER_FILE:
+                upload_temp_file(input_file, bucket, f"{job_prefix}input/part-{part:05d}.jsonl")
+                upload_temp_file(docs_file, bucket, f"{job_prefix}docs/part-{part:05d}.jsonl")
+                input_file = docs_file = None
+                part += 1
+            
+            if input_file is None:
+                input_file = tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False)
+                docs_file = tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False)
+                part_records = 0
+            
+            # Batch inference wants 11 character alphanumeric record ids
+            record_id = f"{records:011d}"
+            input_file.write(json.dumps({
+                "recordId": record_id,
+                "modelInput": embedding_model_input(doc['combined_text'])
+            }) + '\n')
+            docs_file.write(json.dumps({"record_id": record_id, "doc": doc}) + '\n')
+            
+            part_records += 1
+            records += 1
+        
+        if input_file:
+            upload_temp_file(input_file, bucket, f"{job_prefix}input/part-{part:05d}.jsonl")
+            upload_temp_file(docs_file, bucket, f"{job_prefix}docs/part-{part:05d}.jsonl")
+            input_file = docs_file = None
+    finally:
+        for temp_file in [input_file, docs_file]:
+            if temp_file and os.path.exists(temp_file.name):
+                temp_file.close()
+                os.unlink(temp_file.name)
+    
+    return records
+
+def run_local_batch_job(bucket, job_prefix):
+    """Offline stand-in for a Bedrock batch job with the same S3 layout"""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{job_prefix}input/"):
+        for obj in page.get('Contents', []):
+            name = obj['Key'].rsplit('/', 1)[-1]
+            body = s3_client.get_object(Bucket=bucket, Key=obj['Key'])['Body']
+            
+            with tempfile.NamedTemporaryFile('w', suffix='.jsonl.out', delete=False) as out:
+                for line in iter_text_lines(body):
+                    if not line.strip():
+                        continue
                     
-            except Exception as e:
-                print(f"Error processing row: {e}")
-                failed += 1
+                    record = json.loads(line)
+                    try:
+                        record['modelOutput'] = {"embedding": invoke_embedding(record['modelInput']['inputText'])}
+                    except Exception as e:
+                        record['error'] = {"errorMessage": str(e)}
+                    out.write(json.dumps(record) + '\n')
+            
+            s3_client.upload_file(out.name, bucket, f"{job_prefix}output/local/{name}.out")
+            os.unlink(out.name)
+
+def submit_batch_ingestion(bucket, key, state_bucket):
+    """Write batch input for a CSV and start the embedding job"""
+    stats = PipelineStats()
+    job_name = f"property-embeddings-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}"
+    job_prefix = f"{STATE_PREFIX}batch-jobs/{job_name}/"
+    
+    records = write_batch_input(source_docs(bucket, key, stats), state_bucket, job_prefix)
+    
+    backend = BATCH_JOB_BACKEND
+    if backend == 'bedrock' and records < BATCH_MIN_RECORDS:
+        print(f"Only {records} records, below the batch inference minimum - running locally")
+        backend = 'local'
+    
+    job = {
+        'job_name': job_name,
+        'backend': backend,
+        'records': records,
+        'source': f"s3://{bucket}/{key}",
+        'index': INDEX_NAME
+    }
+    
+    if backend == 'bedrock':
+        response = bedrock_client.create_model_invocation_job(
+            jobName=job_name,
+            roleArn=BATCH_ROLE_ARN,
+            modelId=EMBEDDING_MODEL,
+            inputDataConfig={
+                's3InputDataConfig': {
+                    's3Uri': f"s3://{state_bucket}/{job_prefix}input/",
+                    's3InputFormat': 'JSONL'
+                }
+            },
+            outputDataConfig={
+                's3OutputDataConfig': {'s3Uri': f"s3://{state_bucket}/{job_prefix}output/"}
+            }
+        )
+        job['job_arn'] = response['jobArn']
+        print(f"Submitted batch job {job['job_arn']} for {records} records")
+    else:
+        run_local_batch_job(state_bucket, job_prefix)
+    
+    s3_client.put_object(
+        Bucket=state_bucket,
+        Key=f"{job_prefix}job.json",
+        Body=json.dumps(job, indent=2),
+        ContentType='application/json'
+    )
+    
+    if backend == 'local':
+        return complete_batch_ingestion(state_bucket, job_prefix)
+    
+    return {
+        'statusCode': 202,
+        'body': json.dumps({
+            'job_name': job_name,
+            'job_arn': job['job_arn'],
+            'job_prefix': job_prefix,
+            'records': records,
+            'stats': stats.summary()
+        })
+    }
+
+def list_keys(bucket, prefix, suffix):
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith(suffix):
+                yield obj['Key']
+
+def iter_batch_output(bucket, key):
+    """(record_id, embedding) per record of one output part - embedding is None when it failed"""
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    for line in iter_text_lines(body):
+        if not line.strip():
+            continue
+        
+        record = json.loads(line)
+        embedding = (record.get('modelOutput') or {}).get('embedding')
+        if not embedding:
+            print(f"Batch record {record.get('recordId')} failed: {record.get('error')}")
+        yield record.get('recordId'), embedding
+
+def complete_batch_ingestion(bucket, job_prefix):
+    """Join batch job embeddings back to their docs and bulk index them"""
+    job = json.loads(s3_client.get_object(Bucket=bucket, Key=f"{job_prefix}job.json")['Body'].read())
+    
+    if job.get('job_arn'):
+        status = bedrock_client.get_model_invocation_job(jobIdentifier=job['job_arn'])['status']
+        if status != 'Completed':
+            print(f"Batch job {job['job_name']} is {status}")
+            return {
+                'statusCode': 409 if status in ['Failed', 'Stopped', 'Expired'] else 202,
+                'body': json.dumps({'job_name': job['job_name'], 'status': status})
+            }
+    
+    # Output parts keep their input part's name ("part-00000.jsonl.out"),
+    # whatever folder the job writes them under
+    outputs = {
+        key.rsplit('/', 1)[-1][:-len('.out')]: key
+        for key in list_keys(bucket, f"{job_prefix}output/", '.jsonl.out')
+    }
+    
+    stats = PipelineStats()
+    os_client = get_opensearch_client()
+    index_queue = queue.Queue(maxsize=INDEX_QUEUE_SIZE)
+    indexer = start_indexer(os_client, index_queue, stats)
+    
+    try:
+        for docs_key in list_keys(bucket, f"{job_prefix}docs/", '.jsonl'):
+            # Docs are far smaller than their embeddings, so they are the side
+            # held in memory - one part at a time
+            docs = {}
+            body = s3_client.get_object(Bucket=bucket, Key=docs_key)['Body']
+            for line in iter_text_lines(body):
+                if line.strip():
+                    docs[json.loads(line)['record_id']] = line
+            
+            output_key = outputs.pop(docs_key.rsplit('/', 1)[-1], None)
+            for record_id, embedding in iter_batch_output(bucket, output_key) if output_key else []:
+                # Popped either way, so a failed record isn't also counted as missing
+                line = docs.pop(record_id, None)
+                if line is None:
+                    stats.increment('unmatched')
+                    continue
+                if not embedding:
+                    stats.increment('failed')
+                    continue
+                
+                doc = json.loads(line)['doc']
+                doc['embedding'] = embedding
+                stats.increment('embedded')
+                index_queue.put(doc)
+            
+            stats.increment('missing_output', len(docs))
+    finally:
+        index_queue.put(None)
+        indexer.join()
+    
+    for output_key in outputs.values():
+        print(f"Batch output {output_key} has no docs part - skipped")
+    refresh_snapshots(os_client, bucket)
+    stats = stats.summary()
+    print(f"Batch job {job['job_name']} complete: {json.dumps(stats)}")
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'processed': stats.get('indexed', 0),
+            'failed': stats.get('failed', 0) + stats.get('missing_output', 0),
+            'total': job['records'],
+            'job_name': job['job_name'],
+            'stats': stats
+        })
+    }
+
+def find_row_starts(chunks, shard_size):
+    """Byte offsets of CSV row starts roughly shard_size apart.
+    
+    The first offset is the end of the header. Newlines inside quoted
+    fields are not row boundaries, so quote parity is tracked across the
+    whole stream (an escaped "" toggles it twice).
+    """
+    starts = []
+    in_quotes = False
+    offset = 0
+    next_target = 1
+    
+    for chunk in chunks:
+        pos = 0
+        while offset + len(chunk) > next_target:
+            search_from = max(next_target - offset, pos)
+            in_quotes ^= chunk.count(b'"', pos, search_from) % 2 == 1
+            pos = search_from
+            
+            newline = chunk.find(b'\n', pos)
+            while newline != -1:
+                in_quotes ^= chunk.count(b'"', pos, newline) % 2 == 1
+                pos = newline + 1
+                if not in_quotes:
+                    break
+                newline = chunk.find(b'\n', pos)
+            
+            if newline == -1:
+                break
+            
+            starts.append(offset + pos)
+            next_target = offset + pos + shard_size
+        
+        in_quotes ^= chunk.count(b'"', pos) % 2 == 1
+        offset += len(chunk)
+    
+    return starts
+
+def plan_shards(bucket, key, size):
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    try:
+        starts = find_row_starts(body.iter_chunks(STREAM_CHUNK_SIZE), SHARD_SIZE_BYTES)
+    finally:
+        body.close()
+    
+    if not starts or starts[0] >= size:
+        return None, []
+    
+    header = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{starts[0] - 1}")['Body'].read()
+    fieldnames = next(csv.reader([header.decode('utf-8-sig')]))
+    
+    bounds = starts + [size]
+    shards = [
+        {'shard_id': i, 'start': bounds[i], 'end': bounds[i + 1] - 1}
+        for i in range(len(starts))
+        if bounds[i + 1] > bounds[i]
+    ]
+    return fieldnames, shards
+
+def load_json(bucket, key, default=None):
+    try:
+        return json.loads(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+    except Exception as e:
+        if 'NoSuchKey' not in str(e):
+            raise
+        return default
+
+def save_json(bucket, key, value):
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(value, indent=2),
+        ContentType='application/json'
+    )
+
+def checkpoint_key(shard):
+    return f"{shard['run_prefix']}shard-{shard['shard_id']:05d}.json"
+
+def process_shard(shard, context=None):
+    """Ingest one byte range, checkpointing every SHARD_CHECKPOINT_ROWS rows"""
+    state_bucket = shard['state_bucket']
+    checkpoint = load_json(state_bucket, checkpoint_key(shard), {
+        'shard_id': shard['shard_id'],
+        'rows_done': 0,
+        'indexed': 0,
+        'failed': 0,
+        'complete': False
+    })
+    
+    if checkpoint['complete']:
+        return checkpoint
+    
+    if checkpoint['rows_done']:
+        print(f"Shard {shard['shard_id']}: resuming after {checkpoint['rows_done']} rows")
+    
+    response = s3_client.get_object(
+        Bucket=shard['bucket'],
+        Key=shard['key'],
+        Range=f"bytes={shard['start']}-{shard['end']}"
+    )
+    body = response['Body']
+    os_client = get_opensearch_client()
+    
+    try:
+        rows = iter_csv_rows(iter_text_lines(body), shard['fieldnames'])
+        rows = itertools.islice(rows, checkpoint['rows_done'], None)
+        
+        while True:
+            chunk = list(itertools.islice(rows, SHARD_CHECKPOINT_ROWS))
+            if not chunk:
+                checkpoint['complete'] = True
+                break
+            
+            stats = PipelineStats()
+            docs = iter_parsed_docs(chunk, stats)
+            run_ingestion_pipeline(docs, os_client, stats=stats, tps=shard.get('embedding_tps'))
+            checkpoint['rows_done'] += len(chunk)
+            checkpoint['indexed'] += stats.get('indexed')
+            checkpoint['failed'] += stats.get('failed')
+            checkpoint['updated'] = datetime.utcnow().isoformat()
+            save_json(state_bucket, checkpoint_key(shard), checkpoint)
+            
+            # Hand the rest of the shard to a fresh invocation before timing out
+            if context and context.get_remaining_time_in_millis() < SHARD_TIME_MARGIN_MS:
+                print(f"Shard {shard['shard_id']}: continuing in a new invocation")
+                lambda_client.invoke(
+                    FunctionName=context.function_name,
+                    InvocationType='Event',
+                    Payload=json.dumps(shard)
+                )
+                break
+    finally:
+        body.close()
+    
+    checkpoint['updated'] = datetime.utcnow().isoformat()
+    save_json(state_bucket, checkpoint_key(shard), checkpoint)
+    print(f"Shard {shard['shard_id']}: {json.dumps(checkpoint)}")
+    return checkpoint
+
+def coordinate_fanout(bucket, key, state_bucket, context):
+    """Split an object into shards and dispatch the ones not yet complete"""
+    head = s3_client.head_object(Bucket=bucket, Key=key)
+    size = head['ContentLength']
+    
+    # Keyed by object version so a retry of the same upload resumes it
+    version = head.get('ETag', '').strip('"') or str(size)
+    run_prefix = f"{STATE_PREFIX}shards/{key.replace('/', '_')}-{version}/"
+    
+    plan = load_json(state_bucket, f"{run_prefix}plan.json")
+    if not plan:
+        fieldnames, shards = plan_shards(bucket, key, size)
+        plan = {'bucket': bucket, 'key': key, 'size': size, 'fieldnames': fieldnames, 'shards': shards}
+        save_json(state_bucket, f"{run_prefix}plan.json", plan)
+    
+    checkpoints = [
+        load_json(state_bucket, f"{run_prefix}shard-{shard['shard_id']:05d}.json", {})
+        for shard in plan['shards']
+    ]
+    pending = [shard for shard, cp in zip(plan['shards'], checkpoints) if not cp.get('complete')]
+    print(f"Fan-out: {len(plan['shards'])} shards over {size} bytes, {len(pending)} pending")
+    
+    parallel = SHARD_WORKERS if SHARD_DISPATCH == 'local' else len(pending)
+    # EMBEDDING_TPS is the account quota - split it between concurrent workers
+    worker_tps = EMBEDDING_TPS / max(1, min(parallel, len(pending)))
+    
+    events = [{
+        **shard,
+        'mode': 'shard',
+        'bucket': bucket,
+        'key': key,
+        'state_bucket': state_bucket,
+        'run_prefix': run_prefix,
+        'fieldnames': plan['fieldnames'],
+        'embedding_tps': worker_tps
+    } for shard in pending]
+    
+    if SHARD_DISPATCH == 'local':
+        with ProcessPoolExecutor(max_workers=SHARD_WORKERS) as pool:
+            results = list(pool.map(process_shard, events))
+        
+        done = {cp['shard_id']: cp for cp in checkpoints if cp.get('complete')}
+        done.update({cp['shard_id']: cp for cp in results})
+        refresh_snapshots(get_opensearch_client(), state_bucket)
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'processed': sum(cp['indexed'] for cp in done.values()),
+                'failed': sum(cp['failed'] for cp in done.values()),
+                'total': sum(cp['rows_done'] for cp in done.values()),
+                'shards': len(plan['shards']),
+                'shards_complete': sum(1 for cp in done.values() if cp['complete'])
+            })
+        }
+    
+    for shard_event in events:
+        lambda_client.invoke(
+            FunctionName=context.function_name,
+            InvocationType='Event',
+            Payload=json.dumps(shard_event)
+        )
+    
+    return {
+        'statusCode': 202,
+        'body': json.dumps({
+            'run_prefix': run_prefix,
+            'shards': len(plan['shards']),
+            'dispatched': len(events)
+        })
+    }
+
+def save_location_table(os_client, bucket):
+    """Centroid of every community and area, from a geo_centroid aggregation"""
+    response = os_client.search(
+        index=all_partitions(),
+        body={
+            "size": 0,
+            "aggs": {
+                field: {
+                    "terms": {"field": field, "size": LOCATION_TABLE_SIZE},
+                    "aggs": {"centroid": {"geo_centroid": {"field": "location"}}}
+                }
+                for field in LOCATION_FIELDS
+            }
+        }
+    )
+    
+    locations = []
+    for field in LOCATION_FIELDS:
+        for bucket_entry in response['aggregations'][field]['buckets']:
+            centroid = bucket_entry['centroid']
+            if not bucket_entry['key'] or not centroid.get('count'):
+                continue
+            locations.append({
+                'name': bucket_entry['key'],
+                'field': field,
+                'lat': round(centroid['location']['lat'], 6),
+                'lon': round(centroid['location']['lon'], 6),
+                'count': centroid['count']
+            })
+    
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=LOCATIONS_KEY,
+        Body=json.dumps({'generated': datetime.utcnow().isoformat(), 'locations': locations}),
+        ContentType='application/json'
+    )
+    print(f"Saved {len(locations)} location centroids to s3://{bucket}/{LOCATIONS_KEY}")
+    return len(locations)
+
+def save_typeahead_snapshot(os_client, bucket):
+    """Distinct place names with listing counts, for the in-memory typeahead"""
+    response = os_client.search(
+        index=all_partitions(),
+        body={
+            "size": 0,
+            "aggs": {
+                field: {"terms": {"field": field, "size": TYPEAHEAD_TERMS_SIZE}}
+                for field in TYPEAHEAD_FIELDS
+            }
+        }
+    )
+    
+    entries = [
+        {'name': bucket_entry['key'], 'field': field, 'count': bucket_entry['doc_count']}
+        for field in TYPEAHEAD_FIELDS
+        for bucket_entry in response['aggregations'][field]['buckets']
+        if str(bucket_entry['key']).strip()
+    ]
+    
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=TYPEAHEAD_KEY,
+        Body=json.dumps({'generated': datetime.utcnow().isoformat(), 'entries': entries}),
+        ContentType='application/json'
+    )
+    print(f"Saved {len(entries)} typeahead names to s3://{bucket}/{TYPEAHEAD_KEY}")
+    return len(entries)
+
+def prewarm_query_function():
+    lambda_client.invoke(
+        FunctionName=PREWARM_FUNCTION,
+        InvocationType='Event',
+        Payload=json.dumps({'resource': '/prewarm'})
+    )
+    print(f"Requested suggestion prewarm from {PREWARM_FUNCTION}")
+    return 1
+
+def refresh_snapshots(os_client, bucket):
+    """Rebuild the query Lambda's location table and typeahead snapshot, then prewarm it"""
+    counts = {}
+    # Stale snapshots only degrade proximity search and typeahead, so never
+    # fail the load for them
+    for name, save in [('locations', save_location_table), ('typeahead', save_typeahead_snapshot)]:
+        try:
+            counts[name] = save(os_client, bucket)
+        except Exception as e:
+            print(f"Snapshot error ({name}): {e}")
+            counts[name] = 0
+    
+    if PREWARM_FUNCTION:
+        try:
+            counts['prewarm'] = prewarm_query_function()
+        except Exception as e:
+            print(f"Prewarm error: {e}")
+            counts['prewarm'] = 0
+    return counts
+
+def lambda_handler(event, context):
+    try:
+        mode = event.get('mode', INGESTION_MODE)
+        
+        # Invoked once the Bedrock batch job has finished
+        if mode == 'batch_complete':
+            return complete_batch_ingestion(event.get('bucket', STATE_BUCKET), event['job_prefix'])
+        
+        # Rebuild the query-side snapshots on their own, e.g. after a Lambda fan-out run
+        if mode in ['snapshots', 'locations']:
+            counts = refresh_snapshots(get_opensearch_client(), event.get('bucket', STATE_BUCKET))
+            return {'statusCode': 200, 'body': json.dumps(counts)}
+        
+        # Worker invocation dispatched by the fan-out coordinator
+        if mode == 'shard':
+            checkpoint = process_shard(event, context)
+            return {'statusCode': 200, 'body': json.dumps(checkpoint)}
+        
+        bucket = event['Records'][0]['s3']['bucket']['name']
+        key = event['Records'][0]['s3']['object']['key']
+        
+        state_bucket = STATE_BUCKET or bucket
+        
+        # Sync state may live in the source bucket - never ingest it
+        if state_bucket == bucket and key.startswith(STATE_PREFIX):
+            print(f"Skipping ingestion state object: {key}")
+            return {'statusCode': 200, 'body': json.dumps({'skipped': key})}
+        
+        print(f"Processing ({mode}): s3://{bucket}/{key}")
+        
+        if mode == 'batch':
+            return submit_batch_ingestion(bucket, key, state_bucket)
+        
+        # Byte-range shards only make sense for CSV. Shards only see their own
+        # rows, so fan-out runs don't collapse near-duplicates
+        if mode == 'fanout' and source_format(key) == 'csv':
+            return coordinate_fanout(bucket, key, state_bucket, context)
+        
+        os_client = get_opensearch_client()
+        sync = SyncState(state_bucket, STATE_PREFIX) if mode == 'sync' else None
+        pipeline_stats = PipelineStats()
+        
+        try:
+            docs = source_docs(bucket, key, pipeline_stats, sync.cache if sync else None)
+            run_ingestion_pipeline(docs, os_client, sync, pipeline_stats)
+            
+            if sync and SYNC_DELETE_MISSING:
+                sync.remove_missing(os_client, pipeline_stats)
+        finally:
+            if sync:
+                sync.save()
+        
+        refresh_snapshots(os_client, state_bucket)
+        
+        stats = pipeline_stats.summary()
+        processed = stats.get('indexed', 0)
+        failed = stats.get('failed', 0)
         
         print(f"Complete: {processed} processed, {failed} failed")
+        print(f"Pipeline stats: {json.dumps(stats)}")
         
         return {
             'statusCode': 200,
             'body': json.dumps({
                 'processed': processed,
                 'failed': failed,
-                'total': len(rows)
+                'total': stats.get('rows', 0),
+                'stats': stats
             })
         }
         
@@ -1,14 +1,43 @@
+import base64
+import gzip
 import json
 import boto3
+import hashlib
+import hmac
+import math
 import os
 import re
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from botocore.config import Config
 from opensearchpy import OpenSearch, RequestsHttpConnection
 from requests_aws4auth import AWS4Auth
 
+# Reranking is optional - numpy ships as a Lambda layer when it's wanted;
+# without it hits keep their kNN order
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Batch endpoint - queries per request, concurrent Bedrock calls and
+# searches per msearch request (bounded by the request size limit)
+BATCH_MAX_QUERIES = int(os.environ.get('BATCH_MAX_QUERIES', '1000'))
+BATCH_EMBED_CONCURRENCY = int(os.environ.get('BATCH_EMBED_CONCURRENCY', '16'))
+BATCH_GENERATE_CONCURRENCY = int(os.environ.get('BATCH_GENERATE_CONCURRENCY', '4'))
+BATCH_MSEARCH_SIZE = 100
+BATCH_MAX_TOP_K = 50
+
 # Initialize clients
-bedrock_runtime = boto3.client('bedrock-runtime')
+bedrock_runtime = boto3.client(
+    'bedrock-runtime',
+    config=Config(max_pool_connections=max(BATCH_EMBED_CONCURRENCY, BATCH_GENERATE_CONCURRENCY))
+)
 s3_client = boto3.client('s3')
+lambda_client = boto3.client('lambda')
 
 # Configuration
 OPENSEARCH_ENDPOINT = os.environ.get('OPENSEARCH_ENDPOINT')
@@ -18,6 +47,209 @@ INTENTS_BUCKET = os.environ.get('INTENTS_BUCKET')
 EMBEDDING_MODEL = 'amazon.titan-embed-text-v2:0'
 CHAT_MODEL = 'anthropic.claude-3-5-sonnet-20240620-v1:0'
 TOP_K = 5
+GENERATION_FALLBACK = "I apologize, but I'm having trouble generating a response right now. Please try again."
+
+# _source projections - each consumer fetches only the fields it reads.
+# 'cards' feeds the frontend property cards, 'prompt' feeds generate_response
+# and 'full' is every stored field except the embedding
+PROJECTIONS = {
+    'cards': [
+        'listing_id', 'property_name', 'property_type', 'community_name', 'city_name',
+        'number_of_bedrooms', 'bathrooms_total', 'total_area_sqm', 'asking_price',
+        'asking_price_currency', 'for_sale', 'for_rent', 'listing_url', 'location',
+        'alternate_listings'
+    ],
+    # summary is the listing line precomputed at ingestion
+    'prompt': ['listing_id', 'summary', 'listing_url', 'alternate_listings'],
+    'full': None
+}
+DEFAULT_PROFILE = 'cards'
+# Added to every hit after the fetch, so kept by every projection
+COMPUTED_FIELDS = ['relevance_score', 'distance_km', 'rerank_score']
+
+# Reranking - over-fetch RERANK_CANDIDATES kNN hits, rescore them locally and
+# keep the best; only PROMPT_TOP_K of those go into the prompt
+RERANK_CANDIDATES = int(os.environ.get('RERANK_CANDIDATES', '40'))
+PROMPT_TOP_K = int(os.environ.get('PROMPT_TOP_K', '3'))
+RERANK_WEIGHTS = {
+    'vector': 0.45,
+    'lexical': 0.2,
+    'price': 0.1,
+    'bedrooms': 0.1,
+    'distance': 0.1,
+    'freshness': 0.05
+}
+RERANK_FIELDS = [
+    'property_name', 'property_type', 'community_name', 'area_name_en', 'building_name',
+    'asking_price', 'number_of_bedrooms', 'date_listed', 'location'
+]
+# Log-price distance at which price closeness falls to 1/e (~28% off target)
+PRICE_TOLERANCE = 0.25
+FRESHNESS_HALF_LIFE_DAYS = 30
+ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}$')
+QUERY_STOPWORDS = {
+    'the', 'and', 'for', 'with', 'near', 'under', 'over', 'below', 'above', 'between',
+    'show', 'find', 'want', 'looking', 'need', 'please', 'some', 'any', 'from', 'that',
+    'bed', 'beds', 'bedroom', 'bedrooms', 'aed', 'sale', 'rent', 'buy', 'close', 'next',
+    'around', 'within', 'properties', 'property', 'listings', 'listing'
+}
+
+# Responses at least this large are gzipped for clients that accept it
+GZIP_MIN_BYTES = 1024
+
+# Must match the ingestion Lambda - 'none', 'listing' (sale/rent) or
+# 'listing_type' (sale/rent per property type)
+INDEX_PARTITIONING = os.environ.get('INDEX_PARTITIONING', 'none')
+
+# Proximity search - community/area centroids written by the ingestion Lambda
+# (s3://<state bucket>/ingestion-state/locations.json)
+LOCATIONS_URI = os.environ.get('LOCATIONS_URI')
+LOCATIONS_TTL_SECONDS = 900
+NEAR_RADIUS_KM = float(os.environ.get('NEAR_RADIUS_KM', '2'))
+
+# Places people search near that aren't community or area names in the feed
+LANDMARKS = {
+    'burj khalifa': (25.1972, 55.2744),
+    'dubai mall': (25.1985, 55.2796),
+    'downtown dubai': (25.1944, 55.2744),
+    'dubai marina': (25.0805, 55.1403),
+    'jbr': (25.0780, 55.1340),
+    'palm jumeirah': (25.1124, 55.1390),
+    'mall of the emirates': (25.1181, 55.2006),
+    'business bay': (25.1850, 55.2650),
+    'dubai airport': (25.2532, 55.3657),
+    'difc': (25.2125, 55.2810),
+}
+
+location_cache = {'loaded_at': 0, 'places': dict(LANDMARKS)}
+
+# Facets endpoint - aggregation results cached per filter set in the warm container
+FACETS_TTL_SECONDS = int(os.environ.get('FACETS_TTL_SECONDS', '300'))
+FACETS_CACHE_SIZE = 256
+COMMUNITY_FACET_SIZE = 20
+
+# Price bucket edges - rents are annual, so they need their own scale
+PRICE_BUCKETS = {
+    'sale': [500000, 1000000, 2000000, 5000000, 10000000],
+    'rent': [50000, 100000, 150000, 250000, 500000]
+}
+
+facets_cache = {}
+
+# Typeahead - place names snapshot written by the ingestion Lambda
+# (s3://<state bucket>/ingestion-state/typeahead.json), indexed in memory
+TYPEAHEAD_URI = os.environ.get('TYPEAHEAD_URI')
+TYPEAHEAD_TTL_SECONDS = 900
+TYPEAHEAD_LIMIT = 8
+TYPEAHEAD_MAX_SCAN = 500
+FUZZY_MIN_LENGTH = 3
+
+typeahead_cache = {'loaded_at': 0, 'index': None}
+
+# Rate limiting - a token bucket per user_id and per source IP on the routes
+# that call Bedrock. RATE_LIMIT_BACKEND 'memory' keeps buckets in the warm
+# container (each container enforces its own share), 'dynamodb' shares them
+# through RATE_LIMIT_TABLE, 'none' turns limiting off
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_TABLE = os.environ.get('RATE_LIMIT_TABLE', 'property-rag-rate-limits')
+USER_RATE = float(os.environ.get('USER_RATE', '0.5'))
+USER_BURST = float(os.environ.get('USER_BURST', '10'))
+# Anonymous callers only have their IP, so they get a smaller bucket; the IP
+# limit for known users is higher to leave room for shared office NATs
+ANONYMOUS_RATE = float(os.environ.get('ANONYMOUS_RATE', '0.2'))
+ANONYMOUS_BURST = float(os.environ.get('ANONYMOUS_BURST', '5'))
+IP_RATE = float(os.environ.get('IP_RATE', '2'))
+IP_BURST = float(os.environ.get('IP_BURST', '30'))
+# /batch requests also pay one token per query from a separate per-caller
+# bucket that holds a full batch, so large batches are paced, not refused
+BATCH_RATE = float(os.environ.get('BATCH_RATE', '5'))
+BATCH_BURST = float(os.environ.get('BATCH_BURST', str(BATCH_MAX_QUERIES)))
+# Only API Gateway traffic (events with a requestContext) is limited -
+# direct invocations (replay, batch jobs, tests) are already IAM-authenticated
+RATE_LIMITED_ROUTES = {'/chat', '/batch', '/narrative'}
+RATE_LIMIT_MEMORY_BUCKETS = 10000
+# Load shedding - this many Bedrock throttles inside SATURATION_WINDOW_SECONDS
+# mark Bedrock saturated, and anonymous requests get a 503 until it clears
+SATURATION_THROTTLES = int(os.environ.get('SATURATION_THROTTLES', '3'))
+SATURATION_WINDOW_SECONDS = 10
+SATURATION_HOLD_SECONDS = int(os.environ.get('SATURATION_HOLD_SECONDS', '15'))
+SATURATION_CHECK_SECONDS = 2
+ANONYMOUS_USERS = {'', 'anonymous'}
+
+bedrock_throttles = []
+saturation_cache = {'checked_at': 0, 'until': 0}
+
+# Request coalescing - identical chat requests (normalized query, filters,
+# profile and history) share one computation. Only COALESCE_BACKEND
+# 'dynamodb' (COALESCE_TABLE) coalesces requests in flight; Lambda runs one
+# request per container, so 'memory' is just a per-container result cache.
+# Off ('none') unless configured. Results are reused for COALESCE_TTL_SECONDS
+COALESCE_BACKEND = os.environ.get('COALESCE_BACKEND', 'none')
+COALESCE_TABLE = os.environ.get('COALESCE_TABLE', 'property-rag-query-cache')
+COALESCE_TTL_SECONDS = int(os.environ.get('COALESCE_TTL_SECONDS', '30'))
+COALESCE_WAIT_SECONDS = 25
+COALESCE_POLL_SECONDS = 0.1
+COALESCE_MEMORY_ENTRIES = 256
+# Suggestion chips in frontend/index.html - computed after every ingestion
+# (PREWARM_FUNCTION on the ingestion Lambda) and kept until the next one.
+# Only with COALESCE_BACKEND 'dynamodb': the prewarm invocation lands in one
+# container, and a 'memory' cache there would warm nobody else
+PREWARM_QUERIES = [
+    'Find properties under 100,000 AED',
+    'Find properties Over 1,000,000 AED',
+    'Properties for rent in Dubai',
+    'Properties for sale in Dubai'
+]
+PREWARM_TTL_SECONDS = int(os.environ.get('PREWARM_TTL_SECONDS', str(24 * 3600)))
+
+# Cards-only responses - /chat with "response_mode": "cards" answers straight
+# after retrieval with a signed token that /narrative exchanges for the LLM
+# prose. Tokens must verify in any container, so without NARRATIVE_SECRET
+# cards carry no token and /narrative answers 503. Cards still apply the regex filters, and the intent is
+# extracted in an async self-invocation ("resource": "/intent") so it is
+# logged for every query without holding up the response
+RESPONSE_MODES = ['full', 'cards']
+NARRATIVE_SECRET = os.environ.get('NARRATIVE_SECRET')
+NARRATIVE_TOKEN_TTL_SECONDS = int(os.environ.get('NARRATIVE_TOKEN_TTL_SECONDS', '900'))
+INTENT_FUNCTION = os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+
+# Follow-up references - the listings last shown to a conversation
+# (session_id, else user_id) are kept so "the second one" or "is property 2
+# furnished?" is answered from those listings, fetched by ID, instead of a
+# new search. CONVERSATION_BACKEND takes the COALESCE_BACKEND values
+CONVERSATION_BACKEND = os.environ.get('CONVERSATION_BACKEND', 'memory')
+CONVERSATION_TTL_SECONDS = int(os.environ.get('CONVERSATION_TTL_SECONDS', '1800'))
+CONVERSATION_MEMORY_ENTRIES = 1000
+SHOWN_LISTINGS = 3
+ORDINALS = {
+    'first': 1, '1st': 1, 'second': 2, '2nd': 2, 'third': 3, '3rd': 3,
+    'fourth': 4, '4th': 4, 'fifth': 5, '5th': 5, 'last': -1
+}
+# "the second one", "2nd property", or a bare "the second" ending a clause -
+# not "the first district"
+ORDINAL_REFERENCE = re.compile(
+    rf"\b(?:({'|'.join(ORDINALS)}) (?:one|property|listing|option|apartment|villa|unit)s?\b"
+    rf"|the ({'|'.join(ORDINALS)})(?= and | or |\s*[?.!,]|\s*$))"
+)
+# A digit followed by one of these is a search term ("property 2 bedrooms",
+# "#1 area"), not a reference
+NOT_A_REFERENCE = r'(?!\s*(?:bed|br\b|bath|sq|aed|k\b|m\b|mil|rated|area|communit|place|propert|listing|villa|apartment|flat|studio))'
+# "property 2", "listing 3", "#2"
+NUMBER_REFERENCE = re.compile(rf'(?:\b(?:property|listing|option) ?|#)(\d)\b{NOT_A_REFERENCE}')
+# "compare 1 and 3" - bare digits only count after compare
+COMPARE_CUE = re.compile(r'\bcompare\b')
+BARE_NUMBER = re.compile(rf'(?<![\d,.])\b(\d)\b(?![\d,.]){NOT_A_REFERENCE}')
+# Filters extract_filters_from_query reads from a question about a shown
+# listing ("is property 2 furnished?") - any other filter makes it a new search
+FOLLOW_UP_QUESTION_FILTERS = {'furnished'}
+# A shown listing's name only counts as a reference next to one of these
+NAME_REFERENCE_CUE = re.compile(r"\b(?:the one|that one|this one|more about|details (?:on|about|for)|is it|does it|it's)\b")
+# Shown in the prompt for a referenced listing, after its summary
+FOLLOW_UP_DETAILS = [
+    ('Building', 'building_name'), ('Bathrooms', 'bathrooms_total'),
+    ('Listed', 'date_listed'), ('Description', 'description')
+]
+FOLLOW_UP_DESCRIPTION_CHARS = 1500
 
 def get_opensearch_client():
     credentials = boto3.Session().get_credentials()
@@ -38,6 +270,9 @@ def get_opensearch_client():
         timeout=30
     )
 
+def elapsed_ms(since):
+    return round((time.perf_counter() - since) * 1000, 1)
+
 def get_embedding(text):
     try:
         payload = {
@@ -56,97 +291,325 @@ def get_embedding(text):
         
     except Exception as e:
         print(f"Embedding error: {e}")
+        record_bedrock_error(e)
         return None
 
-def search_properties(query_text, filters=None):
+def load_locations():
+    """Lowercase place name -> (lat, lon), refreshed from S3 every LOCATIONS_TTL_SECONDS"""
+    if not LOCATIONS_URI or time.time() - location_cache['loaded_at'] < LOCATIONS_TTL_SECONDS:
+        return location_cache['places']
+    
+    location_cache['loaded_at'] = time.time()
     try:
-        os_client = get_opensearch_client()
+        bucket, _, key = LOCATIONS_URI[5:].partition('/')
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        table = json.loads(response['Body'].read())
         
-        query_embedding = get_embedding(query_text)
-        if not query_embedding:
-            return []
+        places = dict(LANDMARKS)
+        # Communities win over areas of the same name - they are more specific
+        for entry in sorted(table['locations'], key=lambda e: e['field'] == 'community_name'):
+            places[entry['name'].lower()] = (entry['lat'], entry['lon'])
+        location_cache['places'] = places
+    except Exception as e:
+        print(f"Location table error: {e}")
+    
+    return location_cache['places']
+
+def resolve_place(text):
+    """Longest known place name that text starts with"""
+    text = re.sub(r'^the\s+', '', text.strip())
+    places = load_locations()
+    matches = [name for name in places if text.startswith(name)]
+    if not matches:
+        return None
+    name = max(matches, key=len)
+    return name, places[name]
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Haversine distance"""
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371 * 2 * math.asin(math.sqrt(a))
+
+def partition_slug(value):
+    return re.sub(r'[^a-z0-9]+', '-', str(value or '').lower()).strip('-') or 'other'
+
+def target_indices(filters=None):
+    """Index expressions for the partitions the filters can match"""
+    if INDEX_PARTITIONING == 'none':
+        return [INDEX_NAME]
+    
+    filters = filters or {}
+    listings = []
+    # The rent partition only holds for_rent listings that aren't also for sale
+    if not (filters.get('for_rent') is True and filters.get('for_sale') is False):
+        listings.append('sale')
+    if not (filters.get('for_sale') is True or filters.get('for_rent') is False):
+        listings.append('rent')
+    
+    if INDEX_PARTITIONING != 'listing_type':
+        return [f"{INDEX_NAME}-{listing}" for listing in listings]
+    
+    suffix = partition_slug(filters['property_type']) if filters.get('property_type') else '*'
+    return [f"{INDEX_NAME}-{listing}-{suffix}" for listing in listings]
+
+def run_search(os_client, indices, search_query):
+    """Search one partition directly, or fan out with msearch and merge by score"""
+    if len(indices) == 1:
+        return os_client.search(index=indices[0], body=search_query)['hits']['hits']
+    
+    lines = []
+    for index in indices:
+        lines.append({"index": index, "ignore_unavailable": True})
+        lines.append(search_query)
+    
+    response = os_client.msearch(body=lines)
+    
+    hits = []
+    for index, item in zip(indices, response['responses']):
+        if item.get('error'):
+            print(f"Partition search error for {index}: {item['error']}")
+            continue
+        hits.extend(item['hits']['hits'])
+    
+    hits.sort(key=lambda hit: hit['_score'], reverse=True)
+    return hits[:search_query['size']]
+
+def build_filter_clauses(filters):
+    """OpenSearch filter clauses for a filter set"""
+    must_clauses = []
+    
+    if filters:
+        # Price filters
+        if filters.get('min_price'):
+            must_clauses.append({"range": {"asking_price": {"gte": filters['min_price']}}})
         
-        # Build filter clauses
-        must_clauses = []
+        if filters.get('max_price'):
+            must_clauses.append({"range": {"asking_price": {"lte": filters['max_price']}}})
         
-        if filters:
-            # Price filters
-            if filters.get('min_price'):
-                must_clauses.append({"range": {"asking_price": {"gte": filters['min_price']}}})
-            
-            if filters.get('max_price'):
-                must_clauses.append({"range": {"asking_price": {"lte": filters['max_price']}}})
-            
-            # Bedroom filter
-            if filters.get('bedrooms'):
-                must_clauses.append({"term": {"number_of_bedrooms": filters['bedrooms']}})
-            
-            # Location filter
-            if filters.get('city_name'):
-                must_clauses.append({"term": {"city_name": filters['city_name']}})
-            
-            # Sale/Rent filters
-            if filters.get('for_sale') is not None:
-                must_clauses.append({"term": {"for_sale": filters['for_sale']}})
-            
-            if filters.get('for_rent') is not None:
-                must_clauses.append({"term": {"for_rent": filters['for_rent']}})
-            
-            # Property type filter
-            if filters.get('property_type'):
-                must_clauses.append({"term": {"property_type.keyword": filters['property_type']}})
-            
-            # Furnished filter
-            if filters.get('furnished') is not None:
-                must_clauses.append({"term": {"furnished_yn": filters['furnished']}})
-        
-        # Build search query
-        if must_clauses:
-            search_query = {
-                "size": TOP_K,
-                "_source": {"excludes": ["embedding"]},
-                "query": {
-                    "bool": {
-                        "must": [
-                            {
-                                "knn": {
-                                    "embedding": {
-                                        "vector": query_embedding,
-                                        "k": TOP_K * 3
-                                    }
-                                }
-                            }
-                        ],
-                        "filter": must_clauses
-                    }
-                }
-            }
-        else:
-            search_query = {
-                "size": TOP_K,
-                "_source": {"excludes": ["embedding"]},
-                "query": {
-                    "knn": {
-                        "embedding": {
-                            "vector": query_embedding,
-                            "k": TOP_K
-                        }
-                    }
+        # Bedroom filter
+        if filters.get('bedrooms'):
+            must_clauses.append({"term": {"number_of_bedrooms": filters['bedrooms']}})
+        
+        # Location filter
+        if filters.get('city_name'):
+            must_clauses.append({"term": {"city_name": filters['city_name']}})
+        
+        # Sale/Rent filters
+        if filters.get('for_sale') is not None:
+            must_clauses.append({"term": {"for_sale": filters['for_sale']}})
+        
+        if filters.get('for_rent') is not None:
+            must_clauses.append({"term": {"for_rent": filters['for_rent']}})
+        
+        # Property type filter (property_type is mapped as a keyword)
+        if filters.get('property_type'):
+            must_clauses.append({"term": {"property_type": filters['property_type']}})
+        
+        # Furnished filter
+        if filters.get('furnished') is not None:
+            must_clauses.append({"term": {"furnished_yn": filters['furnished']}})
+        
+        # Proximity filter
+        near = filters.get('near')
+        if near:
+            must_clauses.append({
+                "geo_distance": {
+                    "distance": f"{near.get('distance_km', NEAR_RADIUS_KM)}km",
+                    "location": {"lat": near['lat'], "lon": near['lon']}
                 }
+            })
+    
+    return must_clauses
+
+def reranking():
+    return np is not None and RERANK_CANDIDATES > 0
+
+def source_fields(profiles):
+    """_source for a search whose hits feed the named profiles"""
+    if any(PROJECTIONS[profile] is None for profile in profiles):
+        return {"excludes": ["embedding"]}
+    fields = set().union(*(PROJECTIONS[profile] for profile in profiles))
+    if reranking():
+        fields.update(RERANK_FIELDS)
+    return sorted(fields)
+
+def candidate_count(k):
+    """kNN hits to fetch for k results - over-fetched when reranking"""
+    return max(k, RERANK_CANDIDATES) if reranking() else k
+
+def project(result, profile):
+    fields = PROJECTIONS[profile]
+    if fields is None:
+        return result
+    return {name: value for name, value in result.items() if name in fields or name in COMPUTED_FIELDS}
+
+def build_search_query(query_embedding, filters, k=TOP_K, profiles=('full',)):
+    must_clauses = build_filter_clauses(filters)
+    
+    # Filters run inside the kNN search (faiss efficient filtering), so the
+    # geo and attribute filters narrow the candidate set before vector
+    # scoring and all k hits match them
+    knn_query = {
+        "vector": query_embedding,
+        "k": k
+    }
+    if must_clauses:
+        knn_query["filter"] = {"bool": {"filter": must_clauses}}
+    
+    return {
+        "size": k,
+        "_source": source_fields(profiles),
+        "query": {
+            "knn": {
+                "embedding": knn_query
             }
+        }
+    }
+
+def hits_to_results(hits, filters):
+    results = []
+    for hit in hits:
+        result = hit['_source']
+        result['relevance_score'] = hit['_score']
+        # Where to mget the listing from if a follow-up refers back to it
+        result['doc_ref'] = [hit['_index'], hit['_id']]
         
-        response = os_client.search(
-            index=INDEX_NAME,
-            body=search_query
-        )
+        near = (filters or {}).get('near')
+        if near and result.get('location'):
+            result['distance_km'] = round(distance_km(
+                near['lat'], near['lon'], result['location']['lat'], result['location']['lon']
+            ), 2)
+        results.append(result)
+    
+    return results
+
+def stem(word):
+    """Drop a plural 's' so 'villas' matches 'Villa'"""
+    return word[:-1] if word.endswith('s') and len(word) > 3 else word
+
+def query_terms(text):
+    """Distinctive words of a query - numbers and filler are handled elsewhere"""
+    return sorted({
+        stem(word) for word in re.findall(r'[a-z]+', text.lower())
+        if len(word) > 2 and word not in QUERY_STOPWORDS
+    })
+
+def listing_terms(result):
+    text = ' '.join(str(result.get(name) or '') for name in (
+        'property_name', 'property_type', 'community_name', 'area_name_en', 'building_name'
+    ))
+    return {stem(word) for word in re.findall(r'[a-z]+', text.lower())}
+
+def column(results, name):
+    """Numeric field across candidates, NaN where missing"""
+    values = [result.get(name) for result in results]
+    return np.array([value if isinstance(value, (int, float)) else np.nan for value in values], dtype=float)
+
+def rerank(query_text, results, filters, limit):
+    """Rescore over-fetched candidates in one vectorized pass and keep the best `limit`.
+    
+    Each feature is scaled to 0-1 per candidate; features the query gives no
+    signal for (no price asked, no place) drop out and the remaining weights
+    are renormalized.
+    """
+    if not reranking() or len(results) < 2:
+        return results[:limit]
+    
+    filters = filters or {}
+    features = {}
+    
+    # Vector similarity - kNN score, min-max scaled within the candidate set
+    scores = column(results, 'relevance_score')
+    spread = np.nanmax(scores) - np.nanmin(scores)
+    features['vector'] = (scores - np.nanmin(scores)) / spread if spread > 0 else np.ones(len(results))
+    
+    # Lexical overlap - share of the query's distinctive words in the listing
+    terms = query_terms(query_text)
+    if terms:
+        matches = np.array([[term in words for term in terms] for words in map(listing_terms, results)])
+        features['lexical'] = matches.mean(axis=1)
+    
+    # Price closeness - to the middle of a range, otherwise to the one bound given
+    bounds = [filters[name] for name in ('min_price', 'max_price') if filters.get(name)]
+    if bounds:
+        target = sum(bounds) / len(bounds)
+        prices = column(results, 'asking_price')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            features['price'] = np.exp(-np.abs(np.log(prices / target)) / PRICE_TOLERANCE)
+    
+    if filters.get('bedrooms') is not None:
+        bedrooms = column(results, 'number_of_bedrooms')
+        features['bedrooms'] = 1.0 / (1.0 + np.abs(bedrooms - float(filters['bedrooms'])))
+    
+    if filters.get('near'):
+        radius = filters['near'].get('distance_km', NEAR_RADIUS_KM)
+        features['distance'] = np.exp(-column(results, 'distance_km') / radius)
+    
+    # Freshness - halves every FRESHNESS_HALF_LIFE_DAYS since date_listed
+    dates = [str(result.get('date_listed') or '')[:10] for result in results]
+    listed = np.array([
+        date if ISO_DATE.match(date) else 'NaT' for date in dates
+    ], dtype='datetime64[D]')
+    age_days = (np.datetime64(datetime.utcnow().date()) - listed).astype(float)
+    age_days[np.isnat(listed)] = np.nan
+    features['freshness'] = 0.5 ** (np.clip(age_days, 0, None) / FRESHNESS_HALF_LIFE_DAYS)
+    
+    weights = np.array([RERANK_WEIGHTS[name] for name in features])
+    matrix = np.nan_to_num(np.vstack(list(features.values())), nan=0.0)
+    combined = weights @ matrix / weights.sum()
+    
+    order = np.argsort(-combined, kind='stable')[:limit]
+    for position in order:
+        results[position]['rerank_score'] = round(float(combined[position]), 4)
+    return [results[position] for position in order]
+
+def run_batch_search(os_client, searches):
+    """Run (indices, body) searches through msearch - hits or an error per search"""
+    lines = []
+    owners = []
+    for n, (indices, body) in enumerate(searches):
+        for index in indices:
+            lines.append({"index": index, "ignore_unavailable": True})
+            lines.append(body)
+            owners.append(n)
+    
+    hits = [[] for _ in searches]
+    errors = [None] * len(searches)
+    
+    for start in range(0, len(owners), BATCH_MSEARCH_SIZE):
+        chunk_owners = owners[start:start + BATCH_MSEARCH_SIZE]
+        try:
+            response = os_client.msearch(body=lines[start * 2:(start + BATCH_MSEARCH_SIZE) * 2])
+            items = response['responses']
+        except Exception as e:
+            print(f"Batch msearch error: {e}")
+            items = [{'error': str(e)}] * len(chunk_owners)
         
-        results = []
-        for hit in response['hits']['hits']:
-            result = hit['_source']
-            result['relevance_score'] = hit['_score']
-            results.append(result)
+        for owner, item in zip(chunk_owners, items):
+            if item.get('error'):
+                errors[owner] = str(item['error'])
+                continue
+            hits[owner].extend(item['hits']['hits'])
+    
+    # Partitioned searches come back per partition - merge them by score
+    for n, (_, body) in enumerate(searches):
+        hits[n].sort(key=lambda hit: hit['_score'], reverse=True)
+        hits[n] = hits[n][:body['size']]
+    
+    return hits, errors
+
+def search_properties(query_text, filters=None, profiles=('full',), limit=TOP_K):
+    try:
+        os_client = get_opensearch_client()
+        
+        query_embedding = get_embedding(query_text)
+        if not query_embedding:
+            return []
         
-        return results
+        search_query = build_search_query(query_embedding, filters, candidate_count(limit), profiles)
+        hits = run_search(os_client, target_indices(filters), search_query)
+        return rerank(query_text, hits_to_results(hits, filters), filters, limit)
         
     except Exception as e:
         print(f"Search error: {e}")
@@ -191,31 +654,41 @@ Respond ONLY with valid JSON."""
         
     except Exception as e:
         print(f"Intent extraction error: {e}")
+        record_bedrock_error(e)
         return None
 
+# Prices as people type them - "100k", "1.5m", "2 million", "aed 90,000"
+AMOUNT = r'(?:aed\s*)?(\d[\d,]*(?:\.\d+)?)\s*(k|m|mn|million|thousand)?\b'
+AMOUNT_MULTIPLIERS = {'k': 1000, 'thousand': 1000, 'm': 1000000, 'mn': 1000000, 'million': 1000000}
+NUMBER_WORDS = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7}
+
+def parse_amount(number, suffix):
+    return int(float(number.replace(',', '')) * AMOUNT_MULTIPLIERS.get(suffix or '', 1))
+
 def extract_filters_from_query(query, intent_data):
     """Extract ALL filters from query - price, bedrooms, sale/rent, etc."""
     filters = {}
     query_lower = query.lower()
     
     # Price filters
-    under_match = re.search(r'(?:under|below|less than|max|maximum)\s*(\d[\d,]*)', query_lower)
+    under_match = re.search(rf'(?:under|below|less than|max|maximum)\s*{AMOUNT}', query_lower)
     if under_match:
-        filters['max_price'] = int(under_match.group(1).replace(',', ''))
+        filters['max_price'] = parse_amount(*under_match.groups())
     
-    over_match = re.search(r'(?:above|over|more than|min|minimum)\s*(\d[\d,]*)', query_lower)
+    over_match = re.search(rf'(?:above|over|more than|min|minimum)\s*{AMOUNT}', query_lower)
     if over_match:
-        filters['min_price'] = int(over_match.group(1).replace(',', ''))
+        filters['min_price'] = parse_amount(*over_match.groups())
     
-    between_match = re.search(r'between\s*(\d[\d,]*)\s*and\s*(\d[\d,]*)', query_lower)
+    between_match = re.search(rf'between\s*{AMOUNT}\s*and\s*{AMOUNT}', query_lower)
     if between_match:
-        filters['min_price'] = int(between_match.group(1).replace(',', ''))
-        filters['max_price'] = int(between_match.group(2).replace(',', ''))
+        filters['min_price'] = parse_amount(*between_match.groups()[:2])
+        filters['max_price'] = parse_amount(*between_match.groups()[2:])
     
-    # Bedroom count
-    bed_match = re.search(r'(\d+)\s*(?:bed|bedroom)', query_lower)
+    # Bedroom count - "2 bed", "2br", "two-bedroom"
+    bed_match = re.search(rf"\b(\d+|{'|'.join(NUMBER_WORDS)})\s*-?\s*(?:bed|br\b|bhk)", query_lower)
     if bed_match:
-        filters['bedrooms'] = int(bed_match.group(1))
+        count = bed_match.group(1)
+        filters['bedrooms'] = NUMBER_WORDS[count] if count in NUMBER_WORDS else int(count)
     
     # For rent vs for sale
     if any(word in query_lower for word in ['for rent', 'to rent', 'rental', 'renting', 'lease']):
@@ -245,6 +718,22 @@ def extract_filters_from_query(query, intent_data):
     if 'dubai' in query_lower:
         filters['city_name'] = 'Dubai'
     
+    # Proximity - "within 2 km of X", "near X", "close to X"
+    within_match = re.search(
+        r'within\s+(\d+(?:\.\d+)?)\s*(km|kilomet(?:er|re)s?|m|met(?:er|re)s?)\s+(?:of|from)\s+(.+)', query_lower
+    )
+    near_match = within_match or re.search(r'(?:near|close to|next to|around)\s+(.+)', query_lower)
+    if near_match:
+        place = resolve_place(near_match.group(near_match.lastindex))
+        if place:
+            name, (lat, lon) = place
+            radius = NEAR_RADIUS_KM
+            if within_match:
+                radius = float(within_match.group(1))
+                if not within_match.group(2).startswith('k'):
+                    radius /= 1000
+            filters['near'] = {'place': name, 'lat': lat, 'lon': lon, 'distance_km': radius}
+    
     # Try to get from intent if not found in query
     if intent_data:
         if not filters.get('bedrooms') and intent_data.get('bedrooms'):
@@ -300,20 +789,60 @@ def save_intent_to_s3(user_id, query, intent_data):
         print(f"Error saving intent: {e}")
         return False
 
-def generate_response(query, search_results, conversation_history):
+def log_intent_async(user_id, query):
+    """Extract and save the intent without waiting for it.
+    
+    A frozen container may never finish a background thread, so inside
+    Lambda this is an async invocation of the function itself; local runs
+    use a thread.
+    """
+    if not INTENT_FUNCTION:
+        threading.Thread(target=intent_handler, args=({'user_id': user_id, 'query': query}, None), daemon=True).start()
+        return
+    
+    try:
+        lambda_client.invoke(
+            FunctionName=INTENT_FUNCTION,
+            InvocationType='Event',
+            Payload=json.dumps({'resource': '/intent', 'user_id': user_id, 'query': query})
+        )
+    except Exception as e:
+        print(f"Error queueing intent: {e}")
+
+def intent_handler(event, context):
+    """Direct invocation from log_intent_async - the intent of a cards or follow-up query"""
+    intent_data = extract_intent(event['query'])
+    saved = save_intent_to_s3(event.get('user_id', 'anonymous'), event['query'], intent_data)
+    return {'statusCode': 200, 'body': json.dumps({'saved': saved})}
+
+def generate_response(query, search_results, conversation_history, positions=None, details=False):
+    """positions numbers the listings as the user saw them; details adds the
+    FOLLOW_UP_DETAILS fields"""
     try:
         context_parts = []
-        for idx, result in enumerate(search_results[:5], 1):
-            property_info = f"""Property {idx}:
+        for idx, result in zip(positions or range(1, 6), search_results[:5]):
+            if result.get('summary'):
+                property_info = f"Property {idx}: {result['summary']}\n- URL: {result.get('listing_url', 'N/A')}\n"
+            else:
+                # Listings indexed before summaries existed
+                property_info = f"""Property {idx}:
 - Name: {result.get('property_name', 'N/A')}
 - Type: {result.get('property_type', 'N/A')}
 - Location: {result.get('community_name', 'N/A')}, {result.get('city_name', 'N/A')}
 - Bedrooms: {result.get('number_of_bedrooms', 'N/A')}
 - Area: {result.get('total_area_sqm', 'N/A')} sqm
-- Price: {result.get('asking_price_currency', '')} {result.get('asking_price', 'N/A'):,}
+- Price: {result.get('asking_price_currency', '')} {format(result['asking_price'], ',') if result.get('asking_price') is not None else 'N/A'}
 - Status: {'For Sale' if result.get('for_sale') else ''} {'For Rent' if result.get('for_rent') else ''}
 - URL: {result.get('listing_url', 'N/A')}
 """
+            if 'distance_km' in result:
+                property_info += f"- Distance: {result['distance_km']} km from the requested location\n"
+            if result.get('alternate_listings'):
+                property_info += f"- Also listed by {len(result['alternate_listings'])} other agencies\n"
+            if details:
+                for label, field in FOLLOW_UP_DETAILS:
+                    if result.get(field) not in (None, ''):
+                        property_info += f"- {label}: {str(result[field])[:FOLLOW_UP_DESCRIPTION_CHARS]}\n"
             context_parts.append(property_info)
         
         context = "\n\n".join(context_parts)
@@ -366,74 +895,988 @@ Please provide a helpful response about these properties."""
         
     except Exception as e:
         print(f"Response generation error: {e}")
-        return "I apologize, but I'm having trouble generating a response right now. Please try again."
+        record_bedrock_error(e)
+        return GENERATION_FALLBACK
 
-def lambda_handler(event, context):
+def filters_hash(filters):
+    return hashlib.sha256(json.dumps(filters, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def price_ranges(filters):
+    listing = 'rent' if filters.get('for_rent') and not filters.get('for_sale') else 'sale'
+    edges = PRICE_BUCKETS[listing]
+    
+    ranges = [{"to": edges[0]}]
+    ranges.extend({"from": low, "to": high} for low, high in zip(edges, edges[1:]))
+    ranges.append({"from": edges[-1]})
+    return ranges
+
+def compute_facets(filters):
+    """Facet counts for a filter set from a single size-0 aggregation request"""
+    os_client = get_opensearch_client()
+    must_clauses = build_filter_clauses(filters)
+    
+    response = os_client.search(
+        index=','.join(target_indices(filters)),
+        body={
+            "size": 0,
+            "track_total_hits": True,
+            "query": {"bool": {"filter": must_clauses}} if must_clauses else {"match_all": {}},
+            "aggs": {
+                "property_type": {"terms": {"field": "property_type", "size": 20}},
+                "bedrooms": {"terms": {"field": "number_of_bedrooms", "size": 20, "order": {"_key": "asc"}}},
+                "community": {"terms": {"field": "community_name", "size": COMMUNITY_FACET_SIZE}},
+                "furnished": {"terms": {"field": "furnished_yn"}},
+                "listing_type": {
+                    "filters": {
+                        "filters": {
+                            "sale": {"term": {"for_sale": True}},
+                            "rent": {"term": {"for_rent": True}}
+                        }
+                    }
+                },
+                "price": {"range": {"field": "asking_price", "ranges": price_ranges(filters)}}
+            }
+        }
+    )
+    
+    aggs = response['aggregations']
+    
+    def terms(name):
+        return [{'value': b['key'], 'count': b['doc_count']} for b in aggs[name]['buckets']]
+    
+    return {
+        'total': response['hits']['total']['value'],
+        'property_type': terms('property_type'),
+        'bedrooms': terms('bedrooms'),
+        'community': terms('community'),
+        # Boolean terms come back keyed 1/0 with key_as_string 'true'/'false'
+        'furnished': [
+            {'value': b['key_as_string'] == 'true', 'count': b['doc_count']}
+            for b in aggs['furnished']['buckets']
+        ],
+        'listing_type': [
+            {'value': name, 'count': b['doc_count']}
+            for name, b in aggs['listing_type']['buckets'].items()
+        ],
+        'price': [
+            {'from': b.get('from'), 'to': b.get('to'), 'count': b['doc_count']}
+            for b in aggs['price']['buckets']
+        ]
+    }
+
+def cached_facets(filters):
+    """Facets for a filter set, reused for FACETS_TTL_SECONDS"""
+    key = filters_hash(filters)
+    entry = facets_cache.get(key)
+    if entry and time.time() - entry['at'] < FACETS_TTL_SECONDS:
+        return entry['facets'], True
+    
+    facets = compute_facets(filters)
+    
+    if key not in facets_cache and len(facets_cache) >= FACETS_CACHE_SIZE:
+        oldest = min(facets_cache, key=lambda k: facets_cache[k]['at'])
+        del facets_cache[oldest]
+    facets_cache[key] = {'at': time.time(), 'facets': facets}
+    return facets, False
+
+def facets_handler(event, context):
+    """POST /facets - facet counts for structured refinement, no LLM calls"""
+    try:
+        body = json.loads(event.get('body') or '{}')
+        filters = dict(body.get('filters') or {})
+        
+        # Free-text refinements go through the regex extractor only
+        if body.get('query'):
+            filters = {**extract_filters_from_query(body['query'], None), **filters}
+        
+        facets, cached = cached_facets(filters)
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS'
+            },
+            'body': json.dumps({
+                'facets': facets,
+                'filters_applied': filters,
+                'cached': cached
+            })
+        }
+        
+    except Exception as e:
+        print(f"Facets error: {e}")
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)})
+        }
+
+def normalize_name(value):
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', str(value).lower()).split())
+
+def single_deletes(word):
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+class TypeaheadIndex:
+    """Sorted arrays for prefix lookups plus a deletion index for typos"""
+    def __init__(self, entries):
+        merged = {}
+        for entry in entries:
+            key = normalize_name(entry['name'])
+            if not key:
+                continue
+            current = merged.setdefault(key, {'name': entry['name'], 'fields': [], 'count': 0})
+            if entry['field'] not in current['fields']:
+                current['fields'].append(entry['field'])
+            # The same place appears under several fields - rank it by the biggest
+            if entry['count'] > current['count']:
+                current['name'] = entry['name']
+                current['count'] = entry['count']
+        
+        # Names sorted by normalized key, so a prefix is one contiguous range
+        self.keys = sorted(merged)
+        self.names = [merged[key]['name'] for key in self.keys]
+        self.fields = [merged[key]['fields'] for key in self.keys]
+        self.counts = [merged[key]['count'] for key in self.keys]
+        
+        # Word -> name ids, for matches that start mid-name ("marina" -> "Dubai Marina")
+        self.postings = {}
+        for name_id, key in enumerate(self.keys):
+            for word in set(key.split()):
+                self.postings.setdefault(word, []).append(name_id)
+        self.words = sorted(self.postings)
+        
+        # Word prefixes and their single-character deletions -> words. Two
+        # strings within one edit share a deletion, so a misspelled token
+        # finds its word with a handful of dict lookups.
+        self.fuzzy = {}
+        for word in self.words:
+            for length in range(FUZZY_MIN_LENGTH, len(word) + 1):
+                prefix = word[:length]
+                for variant in single_deletes(prefix) | {prefix}:
+                    self.fuzzy.setdefault(variant, set()).add(word)
+    
+    def prefix_range(self, array, prefix):
+        start = bisect_left(array, prefix)
+        end = start
+        while end < len(array) and end - start < TYPEAHEAD_MAX_SCAN and array[end].startswith(prefix):
+            end += 1
+        return range(start, end)
+    
+    def token_ids(self, token, complete):
+        """Name ids containing token - as a word prefix for the token being typed"""
+        if complete:
+            words = [token] if token in self.postings else []
+        else:
+            words = [self.words[i] for i in self.prefix_range(self.words, token)]
+        
+        fuzzy = False
+        if not words and len(token) >= FUZZY_MIN_LENGTH:
+            candidates = set(self.fuzzy.get(token, ()))
+            for variant in single_deletes(token):
+                candidates |= self.fuzzy.get(variant, set())
+            words = sorted(candidates)
+            fuzzy = True
+        
+        ids = set()
+        for word in words:
+            ids.update(self.postings[word])
+        return ids, fuzzy
+    
+    def lookup(self, query, limit=TYPEAHEAD_LIMIT):
+        key = normalize_name(query)
+        if not key:
+            return []
+        
+        # Tier 0: the name starts with the query
+        tiers = {name_id: 0 for name_id in self.prefix_range(self.keys, key)}
+        
+        if len(tiers) < limit:
+            # Tier 1: every token matches a word, tier 2: some only fuzzily.
+            # A trailing space means the last token is complete.
+            tokens = key.split()
+            matched = None
+            any_fuzzy = False
+            for i, token in enumerate(tokens):
+                complete = i < len(tokens) - 1 or query.endswith(' ')
+                ids, fuzzy = self.token_ids(token, complete)
+                any_fuzzy = any_fuzzy or fuzzy
+                matched = ids if matched is None else matched & ids
+                if not matched:
+                    break
+            
+            for name_id in matched or ():
+                tiers.setdefault(name_id, 2 if any_fuzzy else 1)
+        
+        ranked = sorted(tiers, key=lambda name_id: (tiers[name_id], -self.counts[name_id], self.keys[name_id]))
+        return [
+            {
+                'name': self.names[name_id],
+                'fields': self.fields[name_id],
+                'count': self.counts[name_id],
+                'match': ['prefix', 'word', 'fuzzy'][tiers[name_id]]
+            }
+            for name_id in ranked[:limit]
+        ]
+
+def load_typeahead():
+    """TypeaheadIndex for the current snapshot, rebuilt every TYPEAHEAD_TTL_SECONDS"""
+    if typeahead_cache['index'] and time.time() - typeahead_cache['loaded_at'] < TYPEAHEAD_TTL_SECONDS:
+        return typeahead_cache['index']
+    
+    typeahead_cache['loaded_at'] = time.time()
+    try:
+        bucket, _, key = TYPEAHEAD_URI[5:].partition('/')
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        typeahead_cache['index'] = TypeaheadIndex(json.loads(response['Body'].read())['entries'])
+    except Exception as e:
+        # Keep serving the previous snapshot
+        print(f"Typeahead snapshot error: {e}")
+    
+    return typeahead_cache['index']
+
+def typeahead_handler(event, context):
+    """GET /typeahead?q= - place name suggestions from memory, no OpenSearch calls"""
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Headers': 'Content-Type',
+        'Access-Control-Allow-Methods': 'GET, OPTIONS'
+    }
+    
+    try:
+        params = event.get('queryStringParameters') or {}
+        query = params.get('q', '')
+        limit = min(int(params.get('limit', TYPEAHEAD_LIMIT)), 25)
+        
+        index = load_typeahead() if TYPEAHEAD_URI else None
+        if index is None:
+            return {'statusCode': 503, 'headers': headers, 'body': json.dumps({'error': 'Typeahead snapshot unavailable'})}
+        
+        started = time.perf_counter()
+        suggestions = index.lookup(query, limit)
+        took_ms = (time.perf_counter() - started) * 1000
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({
+                'query': query,
+                'suggestions': suggestions,
+                'took_ms': round(took_ms, 3)
+            })
+        }
+        
+    except Exception as e:
+        print(f"Typeahead error: {e}")
+        return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+
+def batch_handler(event, context):
+    """POST /batch - many queries per call for evaluation and analytics jobs.
+    
+    Body: {"queries": [{"query": ..., "filters": {...}, "id": ...}],
+           "generate": false, "top_k": 5, "profile": "cards"}
+    
+    Filters come from the regex extractor plus the per-item filters (no
+    intent extraction), embeddings run concurrently, all searches go out
+    through msearch and generation is skipped unless requested. Results
+    keep the input order, with an error per failed item. Jobs past the API
+    Gateway timeout invoke the function directly with
+    {"resource": "/batch", "body": "<json>"}.
+    """
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Headers': 'Content-Type',
+        'Access-Control-Allow-Methods': 'POST, OPTIONS'
+    }
+    
+    try:
+        body = json.loads(event.get('body') or '{}')
+        items = body.get('queries') or []
+        generate = bool(body.get('generate', False))
+        top_k = max(1, min(int(body.get('top_k', TOP_K)), BATCH_MAX_TOP_K))
+        profile = body.get('profile', DEFAULT_PROFILE)
+        
+        if profile not in PROJECTIONS:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': f"Unknown profile '{profile}' - use one of {', '.join(PROJECTIONS)}"})
+            }
+        
+        if not items or len(items) > BATCH_MAX_QUERIES:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': f"Send between 1 and {BATCH_MAX_QUERIES} queries"})
+            }
+        
+        timings = {}
+        started = time.perf_counter()
+        
+        results = []
+        for n, item in enumerate(items):
+            if isinstance(item, str):
+                item = {'query': item}
+            if not isinstance(item, dict):
+                results.append({'index': n, 'id': None, 'query': '', 'filters_applied': {},
+                                'error': 'Each query must be a string or an object'})
+                continue
+            query = item.get('query')
+            query = query.strip() if isinstance(query, str) else ''
+            item_filters = item.get('filters') or {}
+            error = None if query else 'Query is required'
+            if not isinstance(item_filters, dict):
+                item_filters, error = {}, 'Filters must be an object'
+            results.append({
+                'index': n,
+                'id': item.get('id'),
+                'query': query,
+                'filters_applied': {**extract_filters_from_query(query, None), **item_filters},
+                'error': error
+            })
+        
+        # Embeddings - concurrent Titan calls
+        pending = [r for r in results if not r['error']]
+        with ThreadPoolExecutor(max_workers=BATCH_EMBED_CONCURRENCY) as pool:
+            embeddings = list(pool.map(get_embedding, [r['query'] for r in pending]))
+        timings['embedding_ms'] = elapsed_ms(started)
+        
+        searchable = []
+        for result, embedding in zip(pending, embeddings):
+            if embedding:
+                searchable.append((result, embedding))
+            else:
+                result['error'] = 'Embedding failed'
+        
+        # Searches - one msearch round trip per BATCH_MSEARCH_SIZE searches
+        stage_started = time.perf_counter()
+        if searchable:
+            hits, errors = run_batch_search(get_opensearch_client(), [
+                (target_indices(result['filters_applied']),
+                 build_search_query(embedding, result['filters_applied'], candidate_count(top_k),
+                                    (profile, 'prompt') if generate else (profile,)))
+                for result, embedding in searchable
+            ])
+            for (result, _), item_hits, error in zip(searchable, hits, errors):
+                if error:
+                    result['error'] = error
+                    continue
+                result['properties'] = rerank(
+                    result['query'], hits_to_results(item_hits, result['filters_applied']),
+                    result['filters_applied'], top_k
+                )
+                result['properties_found'] = len(result['properties'])
+        timings['search_ms'] = elapsed_ms(stage_started)
+        
+        # Generation - optional, one Claude call per item that found properties
+        if generate:
+            stage_started = time.perf_counter()
+            answerable = [r for r in results if not r['error'] and r['properties']]
+            with ThreadPoolExecutor(max_workers=BATCH_GENERATE_CONCURRENCY) as pool:
+                responses = list(pool.map(
+                    lambda r: generate_response(r['query'], r['properties'][:PROMPT_TOP_K], []), answerable
+                ))
+            for result, response_text in zip(answerable, responses):
+                result['response'] = response_text
+            timings['generation_ms'] = elapsed_ms(stage_started)
+        
+        # Fields fetched only for the prompt are not returned
+        for result in results:
+            if 'properties' in result:
+                result['properties'] = [project(p, profile) for p in result['properties']]
+        
+        timings['total_ms'] = elapsed_ms(started)
+        failed = sum(1 for r in results if r['error'])
+        print(f"Batch: {len(results)} queries, {failed} failed, {json.dumps(timings)}")
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({
+                'results': results,
+                'succeeded': len(results) - failed,
+                'failed': failed,
+                'timings': timings
+            })
+        }
+        
+    except Exception as e:
+        print(f"Batch error: {e}")
+        return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+
+class MemoryCoalesceBackend:
+    """Results and in-flight locks in the warm container.
+    
+    Lambda serves one request per container at a time, so across requests
+    this is a short-lived result cache; threads in one request still share
+    in-flight work.
+    """
+    def __init__(self, entries=COALESCE_MEMORY_ENTRIES):
+        self.entries = entries
+        self.results = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.results.get(key)
+            return entry[1] if entry and entry[0] > time.time() else None
+    
+    def put(self, key, value, ttl):
+        with self.lock:
+            self.results.pop(key, None)
+            if len(self.results) >= self.entries:
+                del self.results[next(iter(self.results))]
+            self.results[key] = (time.time() + ttl, value)
+    
+    def acquire(self, key, seconds):
+        with self.lock:
+            if self.locks.get(key, 0) > time.time():
+                return False
+            self.locks[key] = time.time() + seconds
+            return True
+    
+    def locked(self, key):
+        with self.lock:
+            return self.locks.get(key, 0) > time.time()
+    
+    def release(self, key):
+        with self.lock:
+            self.locks.pop(key, None)
+
+class DynamoCoalesceBackend:
+    """Results and in-flight locks shared by every container.
+    
+    A lock is an item written only if it doesn't exist or has expired, so
+    one container computes while the others poll for its result. Items
+    carry expires_at for the table's TTL and are checked against it on
+    read, since TTL deletion lags.
+    """
+    def __init__(self, table):
+        self.table = table
+        self.client = boto3.client('dynamodb')
+    
+    def item(self, key):
+        item = self.client.get_item(
+            TableName=self.table, Key={'cache_key': {'S': key}}, ConsistentRead=True
+        ).get('Item')
+        return item if item and float(item['expires_at']['N']) > time.time() else None
+    
+    def get(self, key):
+        item = self.item(key)
+        return json.loads(item['value']['S']) if item else None
+    
+    def put(self, key, value, ttl):
+        self.client.put_item(
+            TableName=self.table,
+            Item={
+                'cache_key': {'S': key},
+                'value': {'S': json.dumps(value)},
+                'expires_at': {'N': repr(time.time() + ttl)}
+            }
+        )
+    
+    def acquire(self, key, seconds):
+        now = time.time()
+        try:
+            self.client.put_item(
+                TableName=self.table,
+                Item={'cache_key': {'S': f"lock:{key}"}, 'expires_at': {'N': repr(now + seconds)}},
+                ConditionExpression='attribute_not_exists(cache_key) OR expires_at < :now',
+                ExpressionAttributeValues={':now': {'N': repr(now)}}
+            )
+            return True
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+    
+    def locked(self, key):
+        return self.item(f"lock:{key}") is not None
+    
+    def release(self, key):
+        self.client.delete_item(TableName=self.table, Key={'cache_key': {'S': f"lock:{key}"}})
+
+COALESCE_BACKENDS = {
+    'memory': MemoryCoalesceBackend,
+    'dynamodb': lambda: DynamoCoalesceBackend(COALESCE_TABLE)
+}
+
+coalesce_backend = COALESCE_BACKENDS[COALESCE_BACKEND]() if COALESCE_BACKEND != 'none' else None
+
+CONVERSATION_BACKENDS = {
+    'memory': lambda: MemoryCoalesceBackend(CONVERSATION_MEMORY_ENTRIES),
+    'dynamodb': lambda: DynamoCoalesceBackend(COALESCE_TABLE)
+}
+
+conversation_backend = CONVERSATION_BACKENDS[CONVERSATION_BACKEND]() if CONVERSATION_BACKEND != 'none' else None
+
+def coalesced(key, compute, ttl=COALESCE_TTL_SECONDS, keep=None):
+    """compute() once per key across concurrent callers; returns (value, source).
+    
+    source is 'computed' when this caller ran it, 'coalesced' when it waited
+    for another caller's run and 'cached' for a stored result. Values that
+    fail keep(value) are returned but not shared. Backend errors fall back
+    to computing locally.
+    """
+    if coalesce_backend is None:
+        return compute(), 'computed'
+    
+    try:
+        value = coalesce_backend.get(key)
+        if value is not None:
+            return value, 'cached'
+        leader = coalesce_backend.acquire(key, COALESCE_WAIT_SECONDS)
+    except Exception as e:
+        print(f"Coalesce backend error: {e}")
+        return compute(), 'computed'
+    
+    if leader:
+        try:
+            value = compute()
+            try:
+                if keep is None or keep(value):
+                    coalesce_backend.put(key, value, ttl)
+            except Exception as e:
+                print(f"Coalesce backend error: {e}")
+            return value, 'computed'
+        finally:
+            try:
+                coalesce_backend.release(key)
+            except Exception as e:
+                print(f"Coalesce backend error: {e}")
+    
+    deadline = time.time() + COALESCE_WAIT_SECONDS
+    try:
+        while time.time() < deadline:
+            time.sleep(COALESCE_POLL_SECONDS)
+            value = coalesce_backend.get(key)
+            if value is not None:
+                return value, 'coalesced'
+            # Released without a result - the leader failed
+            if not coalesce_backend.locked(key):
+                break
+    except Exception as e:
+        print(f"Coalesce backend error: {e}")
+    return compute(), 'computed'
+
+def chat_cache_key(query, filters, profile, conversation_history, mode='full'):
+    history = [
+        (message.get('role'), ' '.join(str(message.get('content', '')).lower().split()))
+        for message in conversation_history[-5:]
+    ]
+    normalized = {
+        'query': ' '.join(query.lower().split()),
+        'filters': filters,
+        'profile': profile,
+        'history': history
+    }
+    return f"{mode}:{filters_hash(normalized)}"
+
+def count_answer():
+    os_client = get_opensearch_client()
+    count_result = os_client.count(index=','.join(target_indices()))
+    total_count = count_result['count']
+    
+    response_text = f"We have a total of {total_count} properties in our Dubai real estate database. Would you like to search for specific properties based on your preferences?"
+    
+    return {
+        'response': response_text,
+        'properties_found': total_count,
+        'filters_applied': {},
+        'properties': [],
+        'is_count_query': True
+    }
+
+def run_chat(query, user_filters, profile, conversation_history):
+    """Intent, search and generation for one chat request; returns the response body"""
+    # Per-stage server time, returned so load tests can break latency down
+    timings = {}
+    started = time.perf_counter()
+    
+    # Extract intent
+    intent_data = extract_intent(query)
+    timings['intent_ms'] = elapsed_ms(started)
+    
+    # Check if this is a count/total query
+    if is_count_query(query):
+        body = count_answer()
+        timings['total_ms'] = elapsed_ms(started)
+        return dict(body, intent=intent_data, timings=timings)
+    
+    # Extract filters from query (for regular searches)
+    auto_filters = extract_filters_from_query(query, intent_data)
+    
+    # Merge auto-detected filters with user-provided filters
+    combined_filters = {**auto_filters, **user_filters}
+    
+    print(f"Applied filters: {combined_filters}")
+    
+    # Search properties with filters
+    stage_started = time.perf_counter()
+    search_results = search_properties(query, combined_filters, (profile, 'prompt'))
+    timings['search_ms'] = elapsed_ms(stage_started)
+    
+    # Generate response
+    stage_started = time.perf_counter()
+    response_text = generate_response(query, search_results[:PROMPT_TOP_K], conversation_history)
+    timings['generation_ms'] = elapsed_ms(stage_started)
+    timings['total_ms'] = elapsed_ms(started)
+    
+    return {
+        'response': response_text,
+        'properties_found': len(search_results),
+        'intent': intent_data,
+        'filters_applied': combined_filters,
+        'properties': [project(result, profile) for result in search_results[:SHOWN_LISTINGS]],
+        'shown_listings': [shown_listing(result) for result in search_results[:SHOWN_LISTINGS]],
+        'timings': timings
+    }
+
+def run_cards(query, user_filters, profile):
+    """Retrieval only - regex filters and search, no LLM call.
+    
+    The prompt projection of the top results rides along for the narrative
+    token and, like shown_listings, is removed before the response is
+    returned.
+    """
+    timings = {}
+    started = time.perf_counter()
+    
+    if is_count_query(query):
+        body = count_answer()
+        timings['total_ms'] = elapsed_ms(started)
+        return dict(body, timings=timings)
+    
+    combined_filters = {**extract_filters_from_query(query, None), **user_filters}
+    
+    search_results = search_properties(query, combined_filters, (profile, 'prompt'))
+    timings['search_ms'] = elapsed_ms(started)
+    timings['total_ms'] = elapsed_ms(started)
+    
+    return {
+        'properties_found': len(search_results),
+        'filters_applied': combined_filters,
+        'properties': [project(result, profile) for result in search_results[:SHOWN_LISTINGS]],
+        'shown_listings': [shown_listing(result) for result in search_results[:SHOWN_LISTINGS]],
+        'prompt_results': [project(result, 'prompt') for result in search_results[:PROMPT_TOP_K]],
+        'timings': timings
+    }
+
+def sign(data):
+    return hmac.new(NARRATIVE_SECRET.encode('utf-8'), data.encode('ascii'), hashlib.sha256).hexdigest()[:32]
+
+def encode_narrative_token(payload):
+    """Self-contained token - any container holding the secret can serve /narrative"""
+    data = base64.urlsafe_b64encode(
+        gzip.compress(json.dumps(payload, separators=(',', ':'), default=str).encode('utf-8'))
+    ).decode('ascii')
+    return f"{data}.{sign(data)}"
+
+def decode_narrative_token(token):
+    data, _, signature = str(token or '').rpartition('.')
+    if not data or not hmac.compare_digest(signature, sign(data)):
+        raise ValueError('Invalid narrative token')
+    
+    payload = json.loads(gzip.decompress(base64.urlsafe_b64decode(data)))
+    if time.time() - payload['issued_at'] > NARRATIVE_TOKEN_TTL_SECONDS:
+        raise ValueError('Narrative token expired - send the query again')
+    return payload
+
+def complete_answer(body):
+    """Only answers that got through generation are shared with other requests"""
+    return body.get('response') != GENERATION_FALLBACK
+
+def prewarm_handler(event, context):
+    """Direct invocation after ingestion - store results for the suggestion chips"""
+    queries = event.get('queries') or PREWARM_QUERIES
+    if coalesce_backend is None:
+        return {'statusCode': 200, 'body': json.dumps({'prewarmed': 0, 'reason': 'coalescing disabled'})}
+    if COALESCE_BACKEND != 'dynamodb':
+        # Skipped rather than paying for generations only this container sees
+        reason = f"COALESCE_BACKEND '{COALESCE_BACKEND}' is per container - prewarming needs 'dynamodb'"
+        print(f"Prewarm skipped: {reason}")
+        return {'statusCode': 200, 'body': json.dumps({'prewarmed': 0, 'reason': reason})}
+    
+    prewarmed = []
+    for query in queries:
+        # The frontend sends the chip text as the first user message
+        history = [{'role': 'user', 'content': query}]
+        try:
+            body = run_chat(query, {}, DEFAULT_PROFILE, history)
+            if not complete_answer(body):
+                raise RuntimeError('generation failed')
+            coalesce_backend.put(chat_cache_key(query, {}, DEFAULT_PROFILE, history), body, PREWARM_TTL_SECONDS)
+            
+            # The frontend asks for cards, then for the narrative of the same results
+            cards = run_cards(query, {}, DEFAULT_PROFILE)
+            coalesce_backend.put(chat_cache_key(query, {}, DEFAULT_PROFILE, [], 'cards'), cards, PREWARM_TTL_SECONDS)
+            results = cards.get('prompt_results')
+            if results is not None:
+                narrative = run_narrative(query, results, history)
+                if complete_answer(narrative):
+                    key = chat_cache_key(query, results, '', history, 'narrative')
+                    coalesce_backend.put(key, narrative, PREWARM_TTL_SECONDS)
+            prewarmed.append(query)
+        except Exception as e:
+            print(f"Prewarm error for '{query}': {e}")
+    
+    print(f"Prewarmed {len(prewarmed)} of {len(queries)} suggestion queries")
+    return {'statusCode': 200, 'body': json.dumps({'prewarmed': len(prewarmed), 'queries': prewarmed})}
+
+def run_narrative(query, results, conversation_history, positions=None, details=False):
+    """Generation only - the intent was already logged with the query"""
+    stage_started = time.perf_counter()
+    response_text = generate_response(query, results, conversation_history, positions, details)
+    return {'response': response_text, 'timings': {'generation_ms': elapsed_ms(stage_started)}}
+
+def shown_listing(result):
+    """What a later follow-up needs of a listing shown in a response"""
+    names = [
+        str(result.get(field) or '').strip().lower()
+        for field in ('property_name', 'building_name', 'community_name')
+    ]
+    return {'doc_ref': result.get('doc_ref'), 'names': [name for name in names if len(name) >= 3]}
+
+def last_shown(conversation):
+    try:
+        return conversation_backend.get(f"conversation:{conversation}") or []
+    except Exception as e:
+        print(f"Conversation backend error: {e}")
+        return []
+
+def save_shown(conversation, listings):
+    try:
+        conversation_backend.put(f"conversation:{conversation}", listings, CONVERSATION_TTL_SECONDS)
+    except Exception as e:
+        print(f"Conversation backend error: {e}")
+
+def resolve_references(query, listings):
+    """1-based positions in listings the query refers to, in mention order.
+    
+    Empty unless every reference lands on a shown listing and the query
+    carries no search criteria of its own, so anything unclear goes through
+    a normal search.
+    """
+    if set(extract_filters_from_query(query, None)) - FOLLOW_UP_QUESTION_FILTERS:
+        return []
+    
+    text = query.lower()
+    mentions = [
+        (match.start(), ORDINALS[match.group(1) or match.group(2)])
+        for match in ORDINAL_REFERENCE.finditer(text)
+    ]
+    numbers = BARE_NUMBER if COMPARE_CUE.search(text) else NUMBER_REFERENCE
+    mentions.extend((match.start(), int(match.group(1))) for match in numbers.finditer(text))
+    positions = [len(listings) if position == -1 else position for _, position in sorted(mentions)]
+    
+    if not positions and NAME_REFERENCE_CUE.search(text):
+        named = [
+            position for position, listing in enumerate(listings, 1)
+            if any(name in text for name in listing['names'])
+        ]
+        # A name shared by several shown listings doesn't say which one
+        if len(named) == 1:
+            positions = named
+    
+    positions = list(dict.fromkeys(positions))
+    if not positions or not all(1 <= position <= len(listings) for position in positions):
+        return []
+    return positions
+
+def fetch_listings(doc_refs, profile):
+    """mget the referenced listings; None if any of them is gone"""
+    if not all(doc_refs):
+        return None
+    
+    fields = source_fields((profile, 'prompt'))
+    if isinstance(fields, list):
+        fields = sorted(set(fields).union(field for _, field in FOLLOW_UP_DETAILS))
+    
+    os_client = get_opensearch_client()
+    response = os_client.mget(body={
+        'docs': [{'_index': index, '_id': doc_id, '_source': fields} for index, doc_id in doc_refs]
+    })
+    
+    docs = response['docs']
+    if not all(doc.get('found') for doc in docs):
+        return None
+    return [dict(doc['_source'], doc_ref=[doc['_index'], doc['_id']]) for doc in docs]
+
+def run_follow_up(query, listings, positions, profile, conversation_history):
+    """Answer a follow-up from the listings it refers to - no embedding or kNN.
+    
+    Returns None when the listings can't be fetched any more (e.g. the
+    alias moved to a new generation), and the caller searches instead.
+    """
+    started = time.perf_counter()
+    
+    try:
+        results = fetch_listings([listing['doc_ref'] for listing in listings], profile)
+    except Exception as e:
+        print(f"Follow-up fetch error: {e}")
+        return None
+    if results is None:
+        return None
+    fetch_ms = elapsed_ms(started)
+    
+    body = run_narrative(query, results, conversation_history, positions, details=True)
+    timings = dict(body['timings'], fetch_ms=fetch_ms, total_ms=elapsed_ms(started))
+    
+    return {
+        'response': body['response'],
+        'properties_found': len(results),
+        'filters_applied': {},
+        'properties': [project(result, profile) for result in results],
+        'follow_up': positions,
+        'timings': timings
+    }
+
+def narrative_handler(event, context):
+    """POST /narrative - the LLM prose for a cards-only /chat response"""
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Headers': 'Content-Type',
+        'Access-Control-Allow-Methods': 'POST, OPTIONS'
+    }
+    
+    if not NARRATIVE_SECRET:
+        return {'statusCode': 503, 'headers': headers, 'body': json.dumps({'error': 'Narratives are not configured (NARRATIVE_SECRET)'})}
+    
+    try:
+        body = json.loads(event.get('body') or '{}')
+        try:
+            token = decode_narrative_token(body.get('narrative_token'))
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+        
+        query = token['query']
+        conversation_history = body.get('conversation_history', [])
+        started = time.perf_counter()
+        
+        # Keyed on the results themselves - the same query can return other listings later
+        key = chat_cache_key(query, token['results'], '', conversation_history, 'narrative')
+        result, source = coalesced(
+            key, lambda: run_narrative(query, token['results'], conversation_history), keep=complete_answer
+        )
+        
+        timings = dict(result['timings'], total_ms=elapsed_ms(started))
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps(dict(result, timings=timings, cached=source != 'computed'))
+        }
+        
+    except Exception as e:
+        print(f"Narrative error: {e}")
+        return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+
+# Lightweight endpoints served by this function next to /chat, keyed by
+# the API Gateway resource path. /prewarm and /intent have no API resource -
+# only the ingestion Lambda and this function invoke them
+ROUTES = {
+    '/facets': facets_handler,
+    '/typeahead': typeahead_handler,
+    '/batch': batch_handler,
+    '/narrative': narrative_handler,
+    '/prewarm': prewarm_handler,
+    '/intent': intent_handler
+}
+
+def chat_handler(event, context):
     try:
         body = json.loads(event.get('body', '{}'))
         user_id = body.get('user_id', 'anonymous')
         query = body.get('query', '')
         conversation_history = body.get('conversation_history', [])
         user_filters = body.get('filters', {})
+        profile = body.get('profile', DEFAULT_PROFILE)
+        response_mode = body.get('response_mode', 'full')
         
-        if not query:
+        if response_mode not in RESPONSE_MODES:
             return {
                 'statusCode': 400,
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({'error': 'Query is required'})
+                'body': json.dumps({'error': f"Unknown response_mode '{response_mode}' - use one of {', '.join(RESPONSE_MODES)}"})
             }
         
-        print(f"Processing query from user {user_id}: {query}")
-        
-        # Extract intent
-        intent_data = extract_intent(query)
-        
-        # Save intent to S3
-        if intent_data:
-            save_intent_to_s3(user_id, query, intent_data)
+        if profile not in PROJECTIONS:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': f"Unknown profile '{profile}' - use one of {', '.join(PROJECTIONS)}"})
+            }
         
-        # Check if this is a count/total query
-        if is_count_query(query):
-            os_client = get_opensearch_client()
-            count_result = os_client.count(index=INDEX_NAME)
-            total_count = count_result['count']
-            
-            response_text = f"We have a total of {total_count} properties in our Dubai real estate database. Would you like to search for specific properties based on your preferences?"
-            
+        if not query:
             return {
-                'statusCode': 200,
+                'statusCode': 400,
                 'headers': {
                     'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type',
-                    'Access-Control-Allow-Methods': 'POST, OPTIONS'
+                    'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({
-                    'response': response_text,
-                    'properties_found': total_count,
-                    'intent': intent_data,
-                    'filters_applied': {},
-                    'properties': [],
-                    'is_count_query': True
-                })
+                'body': json.dumps({'error': 'Query is required'})
             }
         
-        # Extract filters from query (for regular searches)
-        auto_filters = extract_filters_from_query(query, intent_data)
+        print(f"Processing query from user {user_id}: {query}")
+        started = time.perf_counter()
         
-        # Merge auto-detected filters with user-provided filters
-        combined_filters = {**auto_filters, **user_filters}
+        # Follow-ups that point at listings from the previous response
+        # skip search entirely
+        conversation = body.get('session_id') or (user_id if user_id != 'anonymous' else None)
+        result, source = None, 'computed'
+        # Cards and follow-ups skip intent extraction, so theirs is logged later
+        defer_intent = response_mode == 'cards'
+        if conversation and conversation_backend is not None:
+            shown = last_shown(conversation)
+            positions = resolve_references(query, shown) if shown else []
+            if positions:
+                listings = [shown[position - 1] for position in positions]
+                result = run_follow_up(query, listings, positions, profile, conversation_history)
+                defer_intent = defer_intent or result is not None
         
-        print(f"Applied filters: {combined_filters}")
+        if result is None and response_mode == 'cards':
+            # Cards don't depend on the conversation, so every history shares them
+            key = chat_cache_key(query, user_filters, profile, [], 'cards')
+            result, source = coalesced(key, lambda: run_cards(query, user_filters, profile))
+            result = dict(result)
+            prompt_results = result.pop('prompt_results', None)
+            if prompt_results is not None and NARRATIVE_SECRET:
+                result['narrative_token'] = encode_narrative_token({
+                    'query': query,
+                    'results': prompt_results,
+                    'issued_at': int(time.time())
+                })
+        elif result is None:
+            key = chat_cache_key(query, user_filters, profile, conversation_history)
+            result, source = coalesced(
+                key, lambda: run_chat(query, user_filters, profile, conversation_history), keep=complete_answer
+            )
+            result = dict(result)
+        
+        # A search replaces the conversation's shown listings; follow-ups
+        # carry none, so "and the third one?" still resolves against them
+        shown = result.pop('shown_listings', None)
+        if shown and conversation and conversation_backend is not None:
+            save_shown(conversation, shown)
         
-        # Search properties with filters
-        search_results = search_properties(query, combined_filters)
+        # Every request is logged under its own user, shared result or not
+        if defer_intent:
+            log_intent_async(user_id, query)
+        elif result.get('intent'):
+            save_intent_to_s3(user_id, query, result['intent'])
         
-        # Generate response
-        response_text = generate_response(query, search_results, conversation_history)
+        if source != 'computed':
+            result = dict(result, timings={'total_ms': elapsed_ms(started)})
         
         return {
             'statusCode': 200,
@@ -443,13 +1886,7 @@ def lambda_handler(event, context):
                 'Access-Control-Allow-Headers': 'Content-Type',
                 'Access-Control-Allow-Methods': 'POST, OPTIONS'
             },
-            'body': json.dumps({
-                'response': response_text,
-                'properties_found': len(search_results),
-                'intent': intent_data,
-                'filters_applied': combined_filters,
-                'properties': search_results[:3]
-            })
+            'body': json.dumps(dict(result, cached=source != 'computed', coalesced=source))
         }
         
     except Exception as e:
@@ -460,4 +1897,237 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json'},
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
+
+def decode_request(event):
+    """API Gateway base64-encodes request bodies when binary media types are enabled"""
+    if event.get('isBase64Encoded') and event.get('body'):
+        return dict(event, body=base64.b64decode(event['body']).decode('utf-8'), isBase64Encoded=False)
+    return event
+
+def compress_response(event, response):
+    """Gzip the body when the client sent Accept-Encoding: gzip"""
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    body = response.get('body')
+    if 'gzip' not in headers.get('accept-encoding', '') or not body or len(body) < GZIP_MIN_BYTES:
+        return response
+    
+    compressed = gzip.compress(body.encode('utf-8'), compresslevel=6)
+    return dict(
+        response,
+        body=base64.b64encode(compressed).decode('ascii'),
+        isBase64Encoded=True,
+        headers={**response.get('headers', {}), 'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'}
+    )
+
+class MemoryRateLimitBackend:
+    """Token buckets in the warm container - one container's view only"""
+    def __init__(self):
+        self.buckets = {}
+        self.saturated = 0
+    
+    def take(self, key, rate, burst, cost=1):
+        """Take cost tokens; returns seconds until they'd be available, 0 when taken"""
+        now = time.time()
+        tokens, updated = self.buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        
+        wait = 0 if tokens >= cost else (cost - tokens) / rate
+        if not wait:
+            tokens -= cost
+        
+        # Re-inserted at the end, so the first key is the least recently used
+        if len(self.buckets) >= RATE_LIMIT_MEMORY_BUCKETS:
+            del self.buckets[next(iter(self.buckets))]
+        self.buckets[key] = (tokens, now)
+        return wait
+    
+    def saturated_until(self):
+        return self.saturated
+    
+    def mark_saturated(self, until):
+        self.saturated = max(self.saturated, until)
+
+class DynamoRateLimitBackend:
+    """Token buckets shared by every container, one item per bucket.
+    
+    Each take is a read plus a write conditioned on the bucket not having
+    changed since the read. Items expire through the table's TTL on
+    expires_at once a bucket would be full again.
+    """
+    def __init__(self, table):
+        self.table = table
+        self.client = boto3.client('dynamodb')
+    
+    def take(self, key, rate, burst, cost=1):
+        for attempt in range(3):
+            now = time.time()
+            item = self.client.get_item(
+                TableName=self.table, Key={'bucket_key': {'S': key}}, ConsistentRead=True
+            ).get('Item')
+            previous = item['updated']['N'] if item else None
+            tokens = float(item['tokens']['N']) if item else burst
+            tokens = min(burst, tokens + (now - float(previous or now)) * rate)
+            
+            if tokens < cost:
+                return (cost - tokens) / rate
+            
+            condition = {'ConditionExpression': 'attribute_not_exists(bucket_key)'}
+            if previous:
+                condition = {
+                    'ConditionExpression': 'updated = :previous',
+                    'ExpressionAttributeValues': {':previous': {'N': previous}}
+                }
+            try:
+                self.client.put_item(
+                    TableName=self.table,
+                    Item={
+                        'bucket_key': {'S': key},
+                        'tokens': {'N': repr(tokens - cost)},
+                        'updated': {'N': repr(now)},
+                        'expires_at': {'N': str(int(now + burst / rate) + 60)}
+                    },
+                    **condition
+                )
+                return 0
+            except self.client.exceptions.ConditionalCheckFailedException:
+                continue
+        
+        # Heavy contention on one bucket - let the request through
+        return 0
+    
+    def saturated_until(self):
+        item = self.client.get_item(TableName=self.table, Key={'bucket_key': {'S': 'bedrock-saturated'}}).get('Item')
+        return float(item['until']['N']) if item else 0
+    
+    def mark_saturated(self, until):
+        self.client.put_item(
+            TableName=self.table,
+            Item={
+                'bucket_key': {'S': 'bedrock-saturated'},
+                'until': {'N': repr(until)},
+                'expires_at': {'N': str(int(until) + 60)}
+            }
+        )
+
+RATE_LIMIT_BACKENDS = {
+    'memory': MemoryRateLimitBackend,
+    'dynamodb': lambda: DynamoRateLimitBackend(RATE_LIMIT_TABLE)
+}
+
+rate_limit_backend = RATE_LIMIT_BACKENDS[RATE_LIMIT_BACKEND]() if RATE_LIMIT_BACKEND != 'none' else None
+
+def record_bedrock_error(error):
+    """Count Bedrock throttles and mark Bedrock saturated when they cluster"""
+    if rate_limit_backend is None or 'ThrottlingException' not in str(error):
+        return
+    
+    now = time.time()
+    bedrock_throttles.append(now)
+    del bedrock_throttles[:-SATURATION_THROTTLES]
+    
+    if len(bedrock_throttles) >= SATURATION_THROTTLES and now - bedrock_throttles[0] <= SATURATION_WINDOW_SECONDS:
+        until = now + SATURATION_HOLD_SECONDS
+        saturation_cache.update(checked_at=now, until=until)
+        try:
+            rate_limit_backend.mark_saturated(until)
+        except Exception as e:
+            print(f"Rate limit backend error: {e}")
+        print(f"Bedrock saturated - shedding anonymous traffic for {SATURATION_HOLD_SECONDS}s")
+
+def saturation_remaining():
+    now = time.time()
+    if now - saturation_cache['checked_at'] >= SATURATION_CHECK_SECONDS:
+        try:
+            saturation_cache['until'] = max(saturation_cache['until'], rate_limit_backend.saturated_until())
+        except Exception as e:
+            print(f"Rate limit backend error: {e}")
+        saturation_cache['checked_at'] = now
+    return max(0, saturation_cache['until'] - now)
+
+def source_ip(event):
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    if identity.get('sourceIp'):
+        return identity['sourceIp']
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    return headers.get('x-forwarded-for', '').split(',')[0].strip() or 'unknown'
+
+def request_user(event):
+    try:
+        user_id = json.loads(event.get('body') or '{}').get('user_id')
+    except (ValueError, AttributeError):
+        user_id = None
+    return str(user_id or '').strip()
+
+def rejection(status, error, retry_after):
+    retry_after = max(1, math.ceil(retry_after))
+    return {
+        'statusCode': status,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'Retry-After',
+            'Retry-After': str(retry_after)
+        },
+        'body': json.dumps({'error': error, 'retry_after': retry_after})
+    }
+
+def batch_size(event):
+    """Queries in a /batch request body"""
+    try:
+        queries = json.loads(event.get('body') or '{}').get('queries')
+    except (ValueError, AttributeError):
+        return 1
+    return max(1, len(queries)) if isinstance(queries, list) else 1
+
+def admit(event):
+    """None when the request may run, otherwise the 429/503 response to return"""
+    if rate_limit_backend is None or event.get('resource') not in RATE_LIMITED_ROUTES:
+        return None
+    if 'requestContext' not in event:
+        return None
+    if event.get('httpMethod') == 'OPTIONS':
+        return None
+    
+    user_id = request_user(event)
+    anonymous = user_id.lower() in ANONYMOUS_USERS
+    
+    if anonymous:
+        remaining = saturation_remaining()
+        if remaining:
+            return rejection(503, 'Service busy - please retry shortly', remaining)
+    
+    # Known users are held to both buckets, so rotating user_ids from one
+    # address still runs into the IP limit
+    ip = source_ip(event)
+    if anonymous:
+        buckets = [(f"anon:{ip}", ANONYMOUS_RATE, ANONYMOUS_BURST, 1)]
+    else:
+        buckets = [(f"ip:{ip}", IP_RATE, IP_BURST, 1), (f"user:{user_id}", USER_RATE, USER_BURST, 1)]
+    
+    if event.get('resource') == '/batch':
+        # A bucket never holds more than burst tokens - batches past
+        # BATCH_MAX_QUERIES are refused by the handler anyway
+        cost = min(batch_size(event), BATCH_BURST)
+        caller = f"anon:{ip}" if anonymous else f"user:{user_id}"
+        buckets.append((f"batch:{caller}", BATCH_RATE, BATCH_BURST, cost))
+    
+    for key, rate, burst, cost in buckets:
+        try:
+            wait = rate_limit_backend.take(key, rate, burst, cost)
+        except Exception as e:
+            # A limiter outage must not take the API down with it
+            print(f"Rate limit backend error: {e}")
+            return None
+        if wait:
+            print(f"Rate limited {key} for {wait:.1f}s")
+            return rejection(429, 'Rate limit exceeded', wait)
+    return None
+
+def lambda_handler(event, context):
+    event = decode_request(event)
+    handler = ROUTES.get(event.get('resource'), chat_handler)
+    rejected = admit(event)
+    if rejected:
+        return rejected
+    return compress_response(event, handler(event, context))
\ No newline at end of file
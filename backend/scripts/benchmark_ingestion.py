@@ -0,0 +1,377 @@
+"""
+Ingestion throughput benchmark.
+
+Drives ingestion_lambda.lambda_handler end to end against local stand-ins
+for S3 (file backed), Titan (fixed latency, optional throttling) and the
+OpenSearch bulk endpoint, over synthetic feeds from generate_listings.py.
+Each scenario runs in a fresh process so peak RSS is per run.
+
+    python benchmark_ingestion.py --rows 10k 100k --output bench.json
+    python benchmark_ingestion.py --rows 10k 100k --baseline bench.json
+
+With --baseline the run is compared against an earlier result file and
+exits non-zero when throughput or memory regressed past the thresholds.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).parent
+LAMBDA_DIR = SCRIPTS_DIR.parent / 'lamda'
+BENCH_BUCKET = 'bench-source'
+
+# Allowed slowdown / growth before a scenario is reported as a regression
+THROUGHPUT_TOLERANCE = 0.10
+MEMORY_TOLERANCE = 0.20
+
+class StageTimer:
+    def __init__(self):
+        self.totals = {}
+        self.lock = threading.Lock()
+    
+    def add(self, stage, seconds):
+        with self.lock:
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+
+class LocalBody:
+    """File-backed stand-in for botocore's StreamingBody"""
+    def __init__(self, path, start=0, length=None):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = length if length is not None else os.path.getsize(path) - start
+    
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+    
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    
+    def close(self):
+        self.file.close()
+
+class LocalS3:
+    """Directory-backed stand-in for the S3 calls ingestion makes"""
+    def __init__(self, root):
+        self.root = Path(root)
+    
+    def path(self, bucket, key):
+        return self.root / bucket / key
+    
+    def get_object(self, Bucket, Key, Range=None):
+        path = self.path(Bucket, Key)
+        if not path.exists():
+            raise Exception(f"An error occurred (NoSuchKey): {Key}")
+        
+        size = path.stat().st_size
+        if Range:
+            start, end = Range.split('=')[1].split('-')
+            start, end = int(start), min(int(end), size - 1)
+            return {'Body': LocalBody(path, start, end - start + 1), 'ContentLength': end - start + 1}
+        return {'Body': LocalBody(path), 'ContentLength': size}
+    
+    def head_object(self, Bucket, Key):
+        path = self.path(Bucket, Key)
+        stat = path.stat()
+        return {'ContentLength': stat.st_size, 'ETag': f'"{int(stat.st_mtime)}"'}
+    
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        path = self.path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(Body.encode('utf-8') if isinstance(Body, str) else Body)
+    
+    def upload_file(self, Filename, Bucket, Key):
+        self.put_object(Bucket, Key, Path(Filename).read_bytes())
+    
+    def get_paginator(self, name):
+        s3 = self
+        
+        class Paginator:
+            def paginate(self, Bucket, Prefix=''):
+                base = s3.root / Bucket
+                keys = sorted(
+                    str(p.relative_to(base)) for p in base.rglob('*')
+                    if p.is_file() and str(p.relative_to(base)).startswith(Prefix)
+                )
+                yield {'Contents': [{'Key': key, 'Size': (base / key).stat().st_size} for key in keys]}
+        
+        return Paginator()
+
+class LocalTitan:
+    """Titan embedding stand-in with a fixed round-trip latency"""
+    def __init__(self, latency, throttle_rate=0.0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.calls = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+    
+    def invoke_model(self, modelId, body):
+        with self.lock:
+            self.calls += 1
+            throttle = self.throttle_rate and (self.calls % round(1 / self.throttle_rate) == 0)
+            if throttle:
+                self.throttled += 1
+        
+        time.sleep(self.latency)
+        if throttle:
+            raise Exception("An error occurred (ThrottlingException) when calling the InvokeModel operation")
+        
+        text = json.loads(body)['inputText']
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        embedding = [(digest[i % 32] - 128) / 128 for i in range(1024)]
+        
+        class Body:
+            def read(self):
+                return json.dumps({'embedding': embedding}).encode('utf-8')
+        
+        return {'body': Body()}
+
+class LocalOpenSearch:
+    """Bulk endpoint stand-in - counts documents and discards them"""
+    def __init__(self, timer, request_latency, doc_latency):
+        self.timer = timer
+        self.request_latency = request_latency
+        self.doc_latency = doc_latency
+        self.docs = 0
+        self.requests = 0
+        self.next_id = 0
+        self.lock = threading.Lock()
+    
+    def bulk(self, body, **kwargs):
+        start = time.perf_counter()
+        items = []
+        i = 0
+        while i < len(body):
+            op = next(iter(body[i]))
+            if op == 'delete':
+                items.append({'delete': {'status': 404}})
+                i += 1
+            else:
+                with self.lock:
+                    self.next_id += 1
+                    doc_id = f"doc{self.next_id}"
+                items.append({op: {'_id': doc_id, 'status': 201}})
+                i += 2
+        
+        indexed = sum(1 for item in items if 'index' in item)
+        time.sleep(self.request_latency + self.doc_latency * indexed)
+        with self.lock:
+            self.docs += indexed
+            self.requests += 1
+        self.timer.add('index', time.perf_counter() - start)
+        return {'errors': False, 'items': items}
+    
+    def search(self, index, body, **kwargs):
+        return {'hits': {'hits': [], 'total': {'value': 0}}}
+
+def instrument(il, timer):
+    """Wrap the parse and embed stages so their time is accumulated"""
+    source_docs = il.iter_source_docs
+    invoke_embedding = il.invoke_embedding
+    
+    def timed_source_docs(bucket, key, stats):
+        docs = source_docs(bucket, key, stats)
+        while True:
+            start = time.perf_counter()
+            try:
+                doc = next(docs)
+            except StopIteration:
+                break
+            finally:
+                timer.add('parse', time.perf_counter() - start)
+            yield doc
+    
+    def timed_invoke_embedding(text):
+        start = time.perf_counter()
+        try:
+            return invoke_embedding(text)
+        finally:
+            timer.add('embed', time.perf_counter() - start)
+    
+    il.iter_source_docs = timed_source_docs
+    il.invoke_embedding = timed_invoke_embedding
+
+def open_local_parquet(path):
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(str(path))
+
+def run_scenario(config):
+    """Run one ingestion in this (fresh) process and return its measurements"""
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ['INDEX_NAME'] = 'bench-listings'
+    sys.path.insert(0, str(LAMBDA_DIR))
+    import ingestion_lambda as il
+    
+    timer = StageTimer()
+    s3 = LocalS3(config['s3_root'])
+    titan = LocalTitan(config['embed_latency'], config['throttle_rate'])
+    opensearch = LocalOpenSearch(timer, config['bulk_latency'], config['bulk_doc_latency'])
+    
+    il.s3_client = s3
+    il.bedrock_runtime = titan
+    il.get_opensearch_client = lambda: opensearch
+    il.open_parquet_file = lambda bucket, key: open_local_parquet(s3.path(bucket, key))
+    il.EMBEDDING_TPS = config['tps']
+    il.EMBEDDING_CONCURRENCY = config['concurrency']
+    il.BATCH_JOB_BACKEND = 'local'
+    il.STATE_BUCKET = 'bench-state'
+    instrument(il, timer)
+    
+    event = {
+        'mode': config['mode'],
+        'Records': [{'s3': {'bucket': {'name': BENCH_BUCKET}, 'object': {'key': config['key']}}}]
+    }
+    
+    start = time.perf_counter()
+    response = il.lambda_handler(event, None)
+    wall = time.perf_counter() - start
+    
+    body = json.loads(response['body'])
+    rows = body.get('total', 0)
+    return {
+        'scenario': config['scenario'],
+        'rows': config['rows'],
+        'format': config['format'],
+        'mode': config['mode'],
+        'status': response['statusCode'],
+        'processed': body.get('processed'),
+        'failed': body.get('failed'),
+        'wall_seconds': round(wall, 2),
+        'rows_per_sec': round(rows / wall, 1) if wall else 0,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'stage_seconds': {stage: round(total, 2) for stage, total in timer.totals.items()},
+        'embedding_calls': titan.calls,
+        'embedding_throttled': titan.throttled,
+        'bulk_requests': opensearch.requests,
+        'pipeline': body.get('stats', {})
+    }
+
+def prepare_feed(data_dir, rows, fmt, seed):
+    from generate_listings import generate
+    
+    source = Path(data_dir) / f"listings_{rows}.{fmt}"
+    if not source.exists():
+        print(f"Generating {rows} {fmt} rows -> {source}")
+        generate(rows, source, fmt, seed)
+    return source
+
+def compare(results, baseline):
+    previous = {result['scenario']: result for result in baseline['results']}
+    regressions = []
+    
+    print("\n=== Comparison with baseline ===")
+    for result in results:
+        before = previous.get(result['scenario'])
+        if not before:
+            print(f"  {result['scenario']}: no baseline")
+            continue
+        
+        throughput = (result['rows_per_sec'] - before['rows_per_sec']) / before['rows_per_sec'] if before['rows_per_sec'] else 0
+        memory = (result['peak_rss_mb'] - before['peak_rss_mb']) / before['peak_rss_mb'] if before['peak_rss_mb'] else 0
+        flag = ''
+        if throughput < -THROUGHPUT_TOLERANCE or memory > MEMORY_TOLERANCE:
+            flag = '  ✗ REGRESSION'
+            regressions.append(result['scenario'])
+        
+        print(f"  {result['scenario']}: rows/sec {throughput:+.1%}, peak RSS {memory:+.1%}{flag}")
+    
+    return regressions
+
+def print_result(result):
+    stages = ', '.join(f"{stage} {seconds}s" for stage, seconds in sorted(result['stage_seconds'].items()))
+    print(f"  {result['scenario']}: {result['rows_per_sec']} rows/sec, "
+          f"{result['wall_seconds']}s wall, peak RSS {result['peak_rss_mb']} MB")
+    print(f"    stages: {stages}")
+    print(f"    embedding calls: {result['embedding_calls']} ({result['embedding_throttled']} throttled), "
+          f"bulk requests: {result['bulk_requests']}, processed: {result['processed']}, failed: {result['failed']}")
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(SCRIPTS_DIR))
+    from generate_listings import parse_count
+    
+    parser = argparse.ArgumentParser(description='Benchmark ingestion_lambda against local stand-ins')
+    parser.add_argument('--rows', nargs='+', default=['10k'], help='row counts or presets (10k, 100k, 1m)')
+    parser.add_argument('--format', nargs='+', default=['csv'], choices=['csv', 'jsonl', 'parquet'])
+    parser.add_argument('--mode', nargs='+', default=['full'], choices=['full', 'sync', 'batch'])
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'property-bench'))
+    parser.add_argument('--embed-latency-ms', type=float, default=40.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of Titan calls throttled')
+    parser.add_argument('--bulk-latency-ms', type=float, default=30.0)
+    parser.add_argument('--bulk-doc-latency-ms', type=float, default=0.2)
+    parser.add_argument('--tps', type=float, default=1000.0)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--baseline', help='results JSON from an earlier run to compare against')
+    args = parser.parse_args()
+    
+    os.makedirs(args.data_dir, exist_ok=True)
+    print("=== Ingestion Benchmark ===\n")
+    
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for rows in [parse_count(value) for value in args.rows]:
+        for fmt in args.format:
+            source = prepare_feed(args.data_dir, rows, fmt, args.seed)
+            key = source.name
+            for mode in args.mode:
+                with tempfile.TemporaryDirectory() as s3_root:
+                    # Fresh bucket state per run - the feed itself is linked, not copied
+                    (Path(s3_root) / BENCH_BUCKET).mkdir()
+                    os.symlink(source.resolve(), Path(s3_root) / BENCH_BUCKET / key)
+                    
+                    config = {
+                        'scenario': f"{rows}-{fmt}-{mode}",
+                        'rows': rows,
+                        'format': fmt,
+                        'mode': mode,
+                        'key': key,
+                        's3_root': s3_root,
+                        'embed_latency': args.embed_latency_ms / 1000,
+                        'throttle_rate': args.throttle_rate,
+                        'bulk_latency': args.bulk_latency_ms / 1000,
+                        'bulk_doc_latency': args.bulk_doc_latency_ms / 1000,
+                        'tps': args.tps,
+                        'concurrency': args.concurrency,
+                    }
+                    print(f"Running {config['scenario']}...")
+                    with context.Pool(1) as pool:
+                        result = pool.apply(run_scenario, (config,))
+                    print_result(result)
+                    results.append(result)
+    
+    report = {
+        'generated': datetime.utcnow().isoformat(),
+        'settings': {k: v for k, v in vars(args).items() if k not in ['output', 'baseline']},
+        'results': results
+    }
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Results written to {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            print(f"\n✗ {len(regressions)} scenario(s) regressed")
+            sys.exit(1)
+        print("\n✓ No regressions")
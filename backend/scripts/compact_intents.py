@@ -0,0 +1,357 @@
+"""
+Compact per-query intent objects into date-partitioned Parquet.
+
+save_intent_to_s3 writes one small JSON object per query under intents/.
+The compact command groups those objects by day, flattens them into a
+fixed schema and writes one Parquet part per day and run under
+intents-compacted/date=YYYY-MM-DD/. Each part is read back and checked
+against the objects it was built from before it is recorded in
+intents-compacted/_manifest.json, and only then are the originals deleted.
+Days still being written (today, by default) are left alone.
+
+    python compact_intents.py compact --bucket my-intents-bucket
+    python compact_intents.py compact --bucket my-intents-bucket --before 2026-01-01 --dry-run
+
+The query command scans compacted intents - from S3 or a local copy made
+with `aws s3 sync` - pruning by date partition, so months of queries
+aggregate in seconds:
+
+    python compact_intents.py query --source ./intents-compacted --since 2026-01-01 --group-by locations
+    python compact_intents.py query --source s3://my-intents-bucket/intents-compacted --contains villa --limit 20
+
+From Python, load_intents(source, since, until) returns a pyarrow Table.
+"""
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import boto3
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+RAW_PREFIX = 'intents/'
+COMPACTED_PREFIX = 'intents-compacted/'
+MANIFEST_NAME = '_manifest.json'
+DELETE_BATCH_SIZE = 1000  # S3 DeleteObjects limit
+
+SCHEMA = pa.schema([
+    ('user_id', pa.string()),
+    ('timestamp', pa.timestamp('ms')),
+    ('query', pa.string()),
+    ('intent_type', pa.string()),
+    ('locations', pa.list_(pa.string())),
+    ('property_types', pa.list_(pa.string())),
+    ('min_price', pa.float64()),
+    ('max_price', pa.float64()),
+    ('bedrooms', pa.int32()),
+    ('buying_signals', pa.list_(pa.string())),
+    # Full intent as extracted - nothing is lost when the originals go
+    ('intent_json', pa.string()),
+    ('source_key', pa.string()),
+])
+
+PARTITIONING = ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive')
+
+# intents/user_<id>_2026-01-31T12-00-00.123456.json
+KEY_DATE = re.compile(r'_(\d{4}-\d{2}-\d{2})T[\d\-.]+\.json$')
+
+s3_client = boto3.client('s3')
+
+def key_date(key):
+    match = KEY_DATE.search(key)
+    return match.group(1) if match else None
+
+def to_float(value):
+    try:
+        return float(str(value).replace(',', '')) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+def to_int(value):
+    if isinstance(value, list):
+        value = value[0] if value else None
+    match = re.match(r'\s*(\d+)', str(value)) if value is not None else None
+    return int(match.group(1)) if match else None
+
+def to_strings(value):
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        value = [value]
+    return [str(item) for item in value if item not in (None, '')]
+
+def flatten(record, key):
+    """One raw intent object -> one row of SCHEMA"""
+    intent = record.get('intent') or {}
+    price_range = intent.get('price_range') or {}
+    if not isinstance(price_range, dict):
+        price_range = {}
+    
+    return {
+        'user_id': str(record.get('user_id', '')),
+        'timestamp': datetime.fromisoformat(record['timestamp']),
+        'query': record.get('query', ''),
+        'intent_type': intent.get('intent_type'),
+        'locations': to_strings(intent.get('location_interest')),
+        'property_types': to_strings(intent.get('property_type_interest')),
+        'min_price': to_float(price_range.get('min')),
+        'max_price': to_float(price_range.get('max')),
+        'bedrooms': to_int(intent.get('bedrooms')),
+        'buying_signals': to_strings(intent.get('buying_signals')),
+        'intent_json': json.dumps(intent, sort_keys=True),
+        'source_key': key,
+    }
+
+def list_raw_keys(bucket, before):
+    """Raw intent keys per day, for days before `before` (YYYY-MM-DD)"""
+    days = {}
+    unparsed = 0
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=RAW_PREFIX):
+        for obj in page.get('Contents', []):
+            day = key_date(obj['Key'])
+            if not day:
+                unparsed += 1
+                continue
+            if day < before:
+                days.setdefault(day, []).append(obj['Key'])
+    
+    if unparsed:
+        print(f"  {unparsed} objects under {RAW_PREFIX} have no date in their name - left in place")
+    return days
+
+def fetch_rows(bucket, keys, workers=32):
+    """Flattened rows plus the keys that could not be read or parsed"""
+    def fetch(key):
+        try:
+            record = json.loads(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+            return flatten(record, key), None
+        except Exception as e:
+            return None, f"{key}: {e}"
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(fetch, keys))
+    
+    rows = [row for row, _ in results if row]
+    failures = [error for _, error in results if error]
+    return rows, failures
+
+def load_manifest(bucket):
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=f"{COMPACTED_PREFIX}{MANIFEST_NAME}")
+        return json.loads(response['Body'].read())
+    except Exception as e:
+        if 'NoSuchKey' not in str(e) and 'Not Found' not in str(e):
+            raise
+        return {'schema': [field.name for field in SCHEMA], 'parts': []}
+
+def save_manifest(bucket, manifest):
+    manifest['updated'] = datetime.now(timezone.utc).isoformat()
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=f"{COMPACTED_PREFIX}{MANIFEST_NAME}",
+        Body=json.dumps(manifest, indent=2),
+        ContentType='application/json'
+    )
+
+def read_part(bucket, key, columns=None):
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+    return pq.read_table(io.BytesIO(body), columns=columns)
+
+def compacted_keys(bucket, manifest, day):
+    """Source keys already stored in this day's parts (from an interrupted run)"""
+    keys = set()
+    for part in manifest['parts']:
+        if part['date'] == day:
+            keys.update(read_part(bucket, part['key'], ['source_key']).column('source_key').to_pylist())
+    return keys
+
+def write_part(bucket, day, rows, run_id):
+    rows.sort(key=lambda row: row['timestamp'])
+    table = pa.Table.from_pylist(rows, schema=SCHEMA)
+    
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression='zstd')
+    key = f"{COMPACTED_PREFIX}date={day}/part-{run_id}.parquet"
+    s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+    return key, buffer.tell()
+
+def verify_part(bucket, key, rows):
+    """Read the part back and check it holds exactly the expected source objects"""
+    table = read_part(bucket, key)
+    if table.num_rows != len(rows):
+        raise RuntimeError(f"{key} has {table.num_rows} rows, expected {len(rows)}")
+    if not table.schema.equals(SCHEMA):
+        raise RuntimeError(f"{key} schema does not match")
+    if sorted(table.column('source_key').to_pylist()) != sorted(row['source_key'] for row in rows):
+        raise RuntimeError(f"{key} source keys do not match the compacted objects")
+
+def delete_originals(bucket, keys):
+    deleted = 0
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[start:start + DELETE_BATCH_SIZE]
+        response = s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+        )
+        errors = response.get('Errors', [])
+        for error in errors[:5]:
+            print(f"    Delete failed: {error.get('Key')}: {error.get('Message')}")
+        deleted += len(batch) - len(errors)
+    return deleted
+
+def compact(bucket, before, dry_run=False, keep_originals=False):
+    run_id = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    manifest = load_manifest(bucket)
+    days = list_raw_keys(bucket, before)
+    
+    totals = {'days': 0, 'rows': 0, 'bytes': 0, 'deleted': 0, 'failed': 0}
+    print(f"Found {sum(len(keys) for keys in days.values())} raw objects across {len(days)} days before {before}\n")
+    
+    for day in sorted(days):
+        started = time.time()
+        done = compacted_keys(bucket, manifest, day)
+        pending = [key for key in days[day] if key not in done]
+        rows, failures = fetch_rows(bucket, pending)
+        totals['failed'] += len(failures)
+        for failure in failures[:5]:
+            print(f"    Unreadable, left in place: {failure}")
+        
+        if dry_run:
+            print(f"  {day}: {len(rows)} rows from {len(days[day])} objects ({len(failures)} unreadable) - dry run")
+            continue
+        
+        verified = [key for key in days[day] if key in done]
+        if rows:
+            key, size = write_part(bucket, day, rows, run_id)
+            verify_part(bucket, key, rows)
+            manifest['parts'].append({
+                'key': key,
+                'date': day,
+                'rows': len(rows),
+                'bytes': size,
+                'run_id': run_id,
+                'first': min(row['timestamp'] for row in rows).isoformat(),
+                'last': max(row['timestamp'] for row in rows).isoformat(),
+            })
+            # The manifest lands before any original goes
+            save_manifest(bucket, manifest)
+            verified.extend(row['source_key'] for row in rows)
+            totals['rows'] += len(rows)
+            totals['bytes'] += size
+        
+        deleted = 0 if keep_originals else delete_originals(bucket, verified)
+        totals['days'] += 1
+        totals['deleted'] += deleted
+        print(f"  {day}: {len(rows)} rows, {len(verified) - len(rows)} already compacted, "
+              f"{deleted} originals deleted ({time.time() - started:.1f}s)")
+    
+    return totals
+
+def dataset_path(source):
+    """pyarrow filesystem path for s3://bucket/prefix or a local directory"""
+    if source.startswith('s3://'):
+        from pyarrow import fs
+        region = os.environ.get('REGION') or os.environ.get('AWS_REGION')
+        return fs.S3FileSystem(region=region), source[5:].rstrip('/')
+    return None, source
+
+def load_intents(source, since=None, until=None, columns=None, contains=None):
+    """Compacted intents between since and until (YYYY-MM-DD, until exclusive) as a pyarrow Table"""
+    filesystem, path = dataset_path(source)
+    dataset = ds.dataset(
+        path, filesystem=filesystem, format='parquet', partitioning=PARTITIONING,
+        exclude_invalid_files=True, ignore_prefixes=['_', '.']
+    )
+    
+    # Date bounds prune whole partitions before any file is opened
+    condition = None
+    if since:
+        condition = ds.field('date') >= since
+    if until:
+        bound = ds.field('date') < until
+        condition = bound if condition is None else condition & bound
+    if contains:
+        match = pc.match_substring(ds.field('query'), contains, ignore_case=True)
+        condition = match if condition is None else condition & match
+    
+    return dataset.to_table(columns=columns, filter=condition)
+
+def group_counts(table, field, top):
+    column = table.column(field)
+    if pa.types.is_list(column.type):
+        column = pc.list_flatten(column)
+    if pa.types.is_string(column.type):
+        column = pc.utf8_lower(column)
+    counts = pc.value_counts(column).to_pylist()
+    counts.sort(key=lambda item: -item['counts'])
+    return [(item['values'], item['counts']) for item in counts[:top]]
+
+def run_query(args):
+    started = time.time()
+    columns = [args.group_by] if args.group_by else None
+    table = load_intents(args.source, args.since, args.until, columns, args.contains)
+    print(f"{table.num_rows} intents matched in {time.time() - started:.2f}s\n")
+    
+    if args.group_by:
+        for value, count in group_counts(table, args.group_by, args.limit):
+            print(f"  {count:>8}  {value}")
+        return
+    
+    if args.output:
+        if args.output.endswith('.parquet'):
+            pq.write_table(table, args.output)
+        else:
+            # CSV has no list type - join list columns with '|'
+            for n, field in enumerate(table.schema):
+                if pa.types.is_list(field.type):
+                    table = table.set_column(n, field.name, pc.binary_join(table.column(n), '|'))
+            pa.csv.write_csv(table, args.output)
+        print(f"✓ Wrote {table.num_rows} rows to {args.output}")
+        return
+    
+    for row in table.slice(0, args.limit).to_pylist():
+        print(f"  {row['timestamp']}  {row['intent_type'] or '-':<12} {row['query'][:80]}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compact and query logged intent records')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    compact_parser = commands.add_parser('compact', help='roll raw intent objects into Parquet')
+    compact_parser.add_argument('--bucket', default=os.environ.get('INTENTS_BUCKET'))
+    compact_parser.add_argument('--before', default=datetime.now(timezone.utc).strftime('%Y-%m-%d'),
+                                help='compact days before this date (default: today, UTC)')
+    compact_parser.add_argument('--dry-run', action='store_true', help='read and report without writing')
+    compact_parser.add_argument('--keep-originals', action='store_true', help='write and verify, but delete nothing')
+    
+    query_parser = commands.add_parser('query', help='scan compacted intents')
+    query_parser.add_argument('--source', required=True, help='s3://bucket/intents-compacted or a local directory')
+    query_parser.add_argument('--since', help='first date, YYYY-MM-DD')
+    query_parser.add_argument('--until', help='end date (exclusive), YYYY-MM-DD')
+    query_parser.add_argument('--contains', help='case-insensitive substring of the query text')
+    query_parser.add_argument('--group-by', choices=['intent_type', 'locations', 'property_types', 'bedrooms',
+                                                     'buying_signals', 'user_id', 'date'])
+    query_parser.add_argument('--limit', type=int, default=20)
+    query_parser.add_argument('--output', help='write matching rows to a .csv or .parquet file')
+    args = parser.parse_args()
+    
+    if args.command == 'query':
+        run_query(args)
+        sys.exit(0)
+    
+    if not args.bucket:
+        parser.error('--bucket or INTENTS_BUCKET is required')
+    
+    print("=== Intent Compaction ===\n")
+    totals = compact(args.bucket, args.before, args.dry_run, args.keep_originals)
+    print(f"\n✓ {totals['rows']} intents compacted into {totals['days']} days "
+          f"({totals['bytes'] / (1024 * 1024):.1f} MB), {totals['deleted']} originals deleted, "
+          f"{totals['failed']} unreadable")
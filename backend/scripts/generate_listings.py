@@ -0,0 +1,153 @@
+"""
+Generate synthetic listing exports with the real column set.
+
+Column values are sampled from data/sample_listings.csv so the shape of
+each field (agent details, DLD columns, photo_url_list blobs) matches the
+production feed. Descriptions are rebuilt from sample vocabulary with
+lengths drawn from the sample distribution.
+
+    python generate_listings.py --rows 100000 --output listings_100k.csv
+    python generate_listings.py --rows 10000 --format parquet --output listings_10k.parquet
+"""
+import argparse
+import csv
+import json
+import random
+from pathlib import Path
+
+SAMPLE_PATH = Path(__file__).parent.parent.parent / 'data' / 'sample_listings.csv'
+PRESETS = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+PROPERTY_TYPES = ['Apartment', 'Villa', 'Penthouse', 'Townhouse']
+
+def load_sample(path=SAMPLE_PATH):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        return reader.fieldnames, list(reader)
+
+class ListingGenerator:
+    def __init__(self, seed=42, sample_path=SAMPLE_PATH):
+        self.random = random.Random(seed)
+        self.fieldnames, rows = load_sample(sample_path)
+        
+        # Observed values per column, used as-is for columns we don't model
+        self.pools = {
+            name: [row[name] for row in rows if row.get(name)] or ['']
+            for name in self.fieldnames
+        }
+        
+        descriptions = [row['description'] for row in rows if row.get('description')]
+        self.description_lengths = [len(d) for d in descriptions]
+        self.vocabulary = ' '.join(descriptions).split()
+        self.communities = sorted(set(self.pools['community_name']))
+        self.areas = sorted(set(self.pools['area_name_en']))
+    
+    def pick(self, name):
+        return self.random.choice(self.pools[name])
+    
+    def description(self):
+        target = int(self.random.choice(self.description_lengths) * self.random.uniform(0.6, 1.6))
+        words = []
+        length = 0
+        while length < target:
+            word = self.random.choice(self.vocabulary)
+            words.append(word)
+            length += len(word) + 1
+        return ' '.join(words)
+    
+    def photo_urls(self, listing_number):
+        count = self.random.randint(5, 40)
+        return json.dumps([
+            f"https://images.example.com/listings/{listing_number}/{i}.jpg"
+            for i in range(count)
+        ])
+    
+    def row(self, n):
+        row = {name: self.pick(name) for name in self.fieldnames}
+        
+        for_sale = self.random.random() < 0.7
+        bedrooms = self.random.choice([0, 1, 1, 2, 2, 2, 3, 3, 4, 5])
+        area_sqm = round(self.random.uniform(35, 120) * max(1, bedrooms), 2)
+        if for_sale:
+            price = int(round(area_sqm * self.random.lognormvariate(9.6, 0.35), -3))
+        else:
+            price = int(round(area_sqm * self.random.lognormvariate(6.6, 0.3), -2))
+        community = self.random.choice(self.communities)
+        property_type = self.random.choice(PROPERTY_TYPES)
+        
+        row.update({
+            'listing_id': f"syn-{n:08d}",
+            'listing_url': f"https://www.example.com/property/details-{n}.html",
+            'property_name': f"{bedrooms or 'Studio'} BR {property_type} in {community}",
+            'property_type': property_type,
+            'Property Type': property_type,
+            'asking_price': str(price),
+            'asking_price_currency': 'AED',
+            'Number of Bedrooms': str(bedrooms),
+            'bathrooms_total': str(max(1, bedrooms + self.random.choice([0, 1]))),
+            'total_area_sqm': str(area_sqm),
+            'total_area_sqft': str(round(area_sqm * 10.7639, 2)),
+            'Price per SQM': str(round(price / area_sqm, 2)),
+            'community_name': community,
+            'area_name_en': self.random.choice(self.areas),
+            'city_name': 'Dubai',
+            'for_sale': 'TRUE' if for_sale else 'FALSE',
+            'for_rent': 'FALSE' if for_sale else 'TRUE',
+            'description': self.description(),
+            'photo_url_list': self.photo_urls(n),
+        })
+        return row
+    
+    def rows(self, count):
+        for n in range(count):
+            yield self.row(n)
+
+def write_csv(generator, count, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=generator.fieldnames)
+        writer.writeheader()
+        for row in generator.rows(count):
+            writer.writerow(row)
+
+def write_jsonl(generator, count, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in generator.rows(count):
+            f.write(json.dumps(row) + '\n')
+
+def write_parquet(generator, count, path, batch_rows=10000):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    schema = pa.schema([(name, pa.string()) for name in generator.fieldnames])
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = []
+        for row in generator.rows(count):
+            batch.append(row)
+            if len(batch) >= batch_rows:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'parquet': write_parquet}
+
+def generate(count, path, fmt='csv', seed=42):
+    WRITERS[fmt](ListingGenerator(seed), count, path)
+    return path
+
+def parse_count(value):
+    return PRESETS.get(value.lower()) or int(value)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate synthetic property listing files')
+    parser.add_argument('--rows', default='10k', help='row count or preset (10k, 100k, 1m)')
+    parser.add_argument('--format', choices=sorted(WRITERS), default='csv')
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    
+    count = parse_count(args.rows)
+    print(f"Generating {count} {args.format} rows -> {args.output}")
+    generate(count, args.output, args.format, args.seed)
+    
+    size_mb = Path(args.output).stat().st_size / (1024 * 1024)
+    print(f"✓ Wrote {args.output} ({size_mb:.1f} MB)")
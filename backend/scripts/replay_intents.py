@@ -0,0 +1,407 @@
+"""
+Replay logged production queries against the query handler.
+
+save_intent_to_s3 writes one record per real /chat query under intents/.
+This tool reads those records (from S3 or a local copy), rebuilds the
+request stream in timestamp order and plays it back against the handler
+in-process, the deployed function or the API Gateway endpoint - either
+with the original inter-arrival gaps (optionally sped up) or at a fixed
+rate. The report covers end-to-end and per-stage latency distributions,
+error rates, cache hit rates and the slowest queries.
+
+    python replay_intents.py --source s3://intents-bucket/intents/ --target local --speed 10
+    python replay_intents.py --source ./intents --target api --rate 5 --concurrency 20
+    python replay_intents.py --source s3://intents-bucket/intents/ --target lambda --speed 0 --output replay.json
+    python replay_intents.py --source ./intents-compacted --compacted --since 2026-01-05 --until 2026-01-06
+
+Replayed requests are sent as user "replay-<original user>" so the intent
+records they produce on deployed targets are skipped by later replays.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import boto3
+
+SCRIPTS_DIR = Path(__file__).parent
+LAMBDA_DIR = SCRIPTS_DIR.parent / 'lamda'
+REPLAY_USER_PREFIX = 'replay-'
+PERCENTILES = [50, 90, 95, 99]
+SLOWEST_SHOWN = 10
+
+def parse_s3_uri(uri):
+    if not uri.startswith('s3://'):
+        raise ValueError(f"Expected s3://bucket/key, got {uri}")
+    bucket, _, key = uri[5:].partition('/')
+    return bucket, key
+
+def read_s3_records(uri, workers=16):
+    s3_client = boto3.client('s3')
+    bucket, prefix = parse_s3_uri(uri)
+    
+    keys = []
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []) if obj['Key'].endswith('.json'))
+    
+    def fetch(key):
+        return s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+    
+    # One small object per query - fetch them in parallel
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fetch, keys))
+
+def read_local_records(directory):
+    return [path.read_bytes() for path in sorted(Path(directory).rglob('*.json'))]
+
+def read_compacted_records(source, since=None, until=None):
+    """Records from compact_intents.py Parquet, pruned to the dates asked for"""
+    sys.path.insert(0, str(SCRIPTS_DIR))
+    from compact_intents import load_intents
+    
+    table = load_intents(
+        source,
+        since.strftime('%Y-%m-%d') if since else None,
+        (until + timedelta(days=1)).strftime('%Y-%m-%d') if until else None,
+        columns=['user_id', 'timestamp', 'query']
+    )
+    return [
+        dict(row, timestamp=row['timestamp'].isoformat())
+        for row in table.to_pylist()
+    ]
+
+def load_records(source, since=None, until=None, limit=None, compacted=False):
+    """Intent records in timestamp order, without earlier replays"""
+    if compacted:
+        raw = read_compacted_records(source, since, until)
+    elif source.startswith('s3://'):
+        raw = read_s3_records(source)
+    else:
+        raw = read_local_records(source)
+    
+    records = []
+    skipped = 0
+    for item in raw:
+        try:
+            # Raw objects arrive as bytes, compacted rows already parsed
+            record = json.loads(item) if isinstance(item, bytes) else item
+            record['at'] = datetime.fromisoformat(record['timestamp'])
+        except (ValueError, KeyError, TypeError):
+            skipped += 1
+            continue
+        
+        if not record.get('query') or str(record.get('user_id', '')).startswith(REPLAY_USER_PREFIX):
+            skipped += 1
+            continue
+        if (since and record['at'] < since) or (until and record['at'] >= until):
+            continue
+        records.append(record)
+    
+    records.sort(key=lambda record: record['at'])
+    if skipped:
+        print(f"  Skipped {skipped} unreadable or replayed records")
+    return records[:limit] if limit else records
+
+def schedule(records, speed=1.0, rate=None, max_gap=None):
+    """Send offset in seconds for each record"""
+    if rate:
+        return [n / rate for n in range(len(records))]
+    if not speed:
+        return [0.0] * len(records)
+    
+    offsets = [0.0]
+    for previous, record in zip(records, records[1:]):
+        gap = (record['at'] - previous['at']).total_seconds()
+        if max_gap is not None:
+            # Quiet periods (nights, deploys) would otherwise stall the replay
+            gap = min(gap, max_gap)
+        offsets.append(offsets[-1] + gap / speed)
+    return offsets
+
+def request_body(record):
+    return {
+        'user_id': f"{REPLAY_USER_PREFIX}{record.get('user_id', 'anonymous')}",
+        'query': record['query'],
+        'conversation_history': [],
+        'filters': {}
+    }
+
+class LocalTarget:
+    """query_lambda.lambda_handler in this process, with stage-level timing"""
+    STAGES = {
+        'extract_intent': 'intent',
+        'get_embedding': 'embedding',
+        'run_search': 'search',
+        'generate_response': 'generation'
+    }
+    
+    def __init__(self):
+        sys.path.insert(0, str(LAMBDA_DIR))
+        import query_lambda
+        
+        self.handler = query_lambda.lambda_handler
+        self.current = threading.local()
+        # Replayed queries must not be logged as new production intents
+        query_lambda.save_intent_to_s3 = lambda user_id, query, intent_data: False
+        
+        for name, stage in self.STAGES.items():
+            setattr(query_lambda, name, self.timed(getattr(query_lambda, name), stage))
+    
+    def timed(self, function, stage):
+        current = self.current
+        
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                current.failed.append(stage)
+                raise
+            finally:
+                current.stages[stage] = current.stages.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+            
+            if result is None and stage == 'embedding':
+                # get_embedding reports its errors as a missing vector
+                current.failed.append(stage)
+            return result
+        
+        return wrapper
+    
+    def send(self, record):
+        self.current.stages = {}
+        self.current.failed = []
+        response = self.handler({'body': json.dumps(request_body(record))}, None)
+        body = json.loads(response['body'])
+        if self.current.failed:
+            # The handler swallows search errors and answers with no results
+            body.setdefault('error', f"{', '.join(self.current.failed)} failed")
+        return response['statusCode'], body, dict(self.current.stages)
+
+class LambdaTarget:
+    """The deployed query function, invoked directly"""
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.client = boto3.client('lambda')
+    
+    def send(self, record):
+        response = self.client.invoke(
+            FunctionName=self.function_name,
+            InvocationType='RequestResponse',
+            Payload=json.dumps({'body': json.dumps(request_body(record))})
+        )
+        result = json.loads(response['Payload'].read())
+        if 'FunctionError' in response:
+            return 500, {'error': result.get('errorMessage', response['FunctionError'])}, {}
+        return result['statusCode'], json.loads(result['body']), {}
+
+class ApiTarget:
+    """The API Gateway /chat endpoint"""
+    def __init__(self, endpoint, timeout=30):
+        self.endpoint = endpoint
+        self.timeout = timeout
+    
+    def send(self, record):
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(request_body(record)).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, json.loads(response.read()), {}
+        except urllib.error.HTTPError as e:
+            try:
+                body = json.loads(e.read())
+            except ValueError:
+                body = {}
+            return e.code, body, {}
+
+def server_stages(body):
+    """Stage timings the handler reports in its response ('search_ms' -> 'server_search')"""
+    return {
+        f"server_{name[:-3]}": value
+        for name, value in (body.get('timings') or {}).items()
+        if name.endswith('_ms')
+    }
+
+def replay(records, offsets, target, concurrency):
+    results = [None] * len(records)
+    started = time.perf_counter()
+    
+    def run(n):
+        sent = time.perf_counter()
+        result = {
+            'query': records[n]['query'],
+            'lag_ms': (sent - started - offsets[n]) * 1000
+        }
+        try:
+            status, body, stages = target.send(records[n])
+            result.update({
+                'status': status,
+                'error': body.get('error') if status == 200 else body.get('error', f"HTTP {status}"),
+                'cached': body.get('cached'),
+                'properties_found': body.get('properties_found'),
+                'is_count_query': bool(body.get('is_count_query')),
+                'stages': {**stages, **server_stages(body)}
+            })
+        except Exception as e:
+            result.update({'status': None, 'error': f"{type(e).__name__}: {e}", 'stages': {}})
+        result['latency_ms'] = (time.perf_counter() - sent) * 1000
+        results[n] = result
+    
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for n, offset in enumerate(offsets):
+            delay = offset - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run, n)
+            
+            if (n + 1) % 100 == 0:
+                print(f"  Sent {n + 1}/{len(records)}")
+    
+    return results, time.perf_counter() - started
+
+def percentile(values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+def distribution(values):
+    values = sorted(values)
+    summary = {'count': len(values)}
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = round(percentile(values, p), 1) if values else None
+    summary['max_ms'] = round(values[-1], 1) if values else None
+    return summary
+
+def summarize(results, wall_seconds):
+    total = len(results)
+    failed = [r for r in results if r['error']]
+    succeeded = [r for r in results if not r['error']]
+    
+    errors = {}
+    for result in failed:
+        kind = f"HTTP {result['status']}" if result['status'] not in (None, 200) else result['error'][:80]
+        errors[kind] = errors.get(kind, 0) + 1
+    
+    stages = {}
+    for result in results:
+        for stage, value in result['stages'].items():
+            stages.setdefault(stage, []).append(value)
+    
+    # Only responses that carry a cache flag count towards the hit rate
+    cache_aware = [r for r in succeeded if r.get('cached') is not None]
+    cache_hits = sum(1 for r in cache_aware if r['cached'])
+    searches = [r for r in succeeded if not r['is_count_query']]
+    
+    return {
+        'requests': total,
+        'wall_seconds': round(wall_seconds, 2),
+        'achieved_rps': round(total / wall_seconds, 2) if wall_seconds else None,
+        'error_rate': round(len(failed) / total, 4) if total else 0,
+        'errors': dict(sorted(errors.items(), key=lambda item: -item[1])),
+        'cache_hit_rate': round(cache_hits / len(cache_aware), 4) if cache_aware else None,
+        'count_queries': total - len(failed) - len(searches),
+        'empty_result_rate': round(
+            sum(1 for r in searches if not r['properties_found']) / len(searches), 4
+        ) if searches else None,
+        'latency': distribution([r['latency_ms'] for r in results]),
+        'stages': {stage: distribution(values) for stage, values in sorted(stages.items())},
+        'schedule_lag': distribution([max(0.0, r['lag_ms']) for r in results]),
+        'slowest': [
+            {'query': r['query'], 'latency_ms': round(r['latency_ms'], 1), 'error': r['error']}
+            for r in sorted(results, key=lambda r: r['latency_ms'], reverse=True)[:SLOWEST_SHOWN]
+        ]
+    }
+
+def format_distribution(summary):
+    if not summary['count']:
+        return 'no samples'
+    parts = [f"p{p}={summary[f'p{p}_ms']}ms" for p in PERCENTILES]
+    return f"{' '.join(parts)} max={summary['max_ms']}ms (n={summary['count']})"
+
+def print_report(report):
+    print("\n=== Replay Report ===")
+    print(f"Requests: {report['requests']} in {report['wall_seconds']}s ({report['achieved_rps']} req/s)")
+    print(f"Error rate: {report['error_rate']:.2%}")
+    for kind, count in report['errors'].items():
+        print(f"  {count:>6}  {kind}")
+    
+    if report['cache_hit_rate'] is None:
+        print("Cache hit rate: n/a (responses carry no cache flag)")
+    else:
+        print(f"Cache hit rate: {report['cache_hit_rate']:.2%}")
+    if report['empty_result_rate'] is not None:
+        print(f"Empty results: {report['empty_result_rate']:.2%} of searches ({report['count_queries']} count queries)")
+    
+    print(f"\n{'End to end:':<20}{format_distribution(report['latency'])}")
+    for stage, summary in report['stages'].items():
+        print(f"{stage + ':':<20}{format_distribution(summary)}")
+    print(f"{'Schedule lag:':<20}{format_distribution(report['schedule_lag'])}")
+    
+    print("\nSlowest queries:")
+    for slow in report['slowest']:
+        marker = f"  ✗ {slow['error']}" if slow['error'] else ''
+        print(f"  {slow['latency_ms']:>9.1f}ms  {slow['query'][:70]}{marker}")
+
+def build_target(args):
+    if args.target == 'local':
+        return LocalTarget()
+    if args.target == 'lambda':
+        if not args.function:
+            raise SystemExit('--function or QUERY_LAMBDA_NAME is required for --target lambda')
+        return LambdaTarget(args.function)
+    if not args.endpoint:
+        raise SystemExit('--endpoint or API_ENDPOINT is required for --target api')
+    return ApiTarget(args.endpoint)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay logged intent records against the query handler')
+    parser.add_argument('--source', required=True, help='s3://bucket/intents/ or a local directory of intent records')
+    parser.add_argument('--compacted', action='store_true', help='--source holds compact_intents.py Parquet output')
+    parser.add_argument('--target', default='local', choices=['local', 'lambda', 'api'])
+    parser.add_argument('--function', default=os.environ.get('QUERY_LAMBDA_NAME'), help='query function name (--target lambda)')
+    parser.add_argument('--endpoint', default=os.environ.get('API_ENDPOINT'), help='/chat URL (--target api)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='time compression of the original gaps (10 = ten times faster, 0 = no waiting)')
+    parser.add_argument('--rate', type=float, help='fixed requests/sec instead of the original timing')
+    parser.add_argument('--max-gap', type=float, default=60.0, help='cap on a single original gap, in seconds')
+    parser.add_argument('--concurrency', type=int, default=10, help='maximum requests in flight')
+    parser.add_argument('--since', type=datetime.fromisoformat, help='only records at or after this ISO time')
+    parser.add_argument('--until', type=datetime.fromisoformat, help='only records before this ISO time')
+    parser.add_argument('--limit', type=int, help='replay at most this many records')
+    parser.add_argument('--output', help='write the report JSON here')
+    args = parser.parse_args()
+    
+    print("=== Intent Replay ===\n")
+    
+    records = load_records(args.source, args.since, args.until, args.limit, args.compacted)
+    if not records:
+        print("✗ No intent records to replay")
+        sys.exit(1)
+    
+    offsets = schedule(records, args.speed, args.rate, args.max_gap)
+    span = (records[-1]['at'] - records[0]['at']).total_seconds()
+    print(f"Loaded {len(records)} records spanning {span:.0f}s, replaying over ~{offsets[-1]:.0f}s "
+          f"against {args.target}\n")
+    
+    target = build_target(args)
+    results, wall_seconds = replay(records, offsets, target, args.concurrency)
+    report = summarize(results, wall_seconds)
+    print_report(report)
+    
+    if args.output:
+        report['settings'] = {k: v for k, v in vars(args).items() if k != 'output'}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"\n✓ Report written to {args.output}")
@@ -0,0 +1,354 @@
+"""
+HNSW parameter sweep for the listings embedding field.
+
+Builds candidate indexes over a grid of space_type, m and ef_construction,
+sweeps ef_search on each, and measures recall@k against exact cosine
+search, p50/p95 single-query latency, build time and index size. Runs
+against local faiss (same engine the OpenSearch mapping uses) or a local
+OpenSearch node, never the production collection.
+
+    python tune_hnsw.py --synthetic 20000
+    python tune_hnsw.py --vectors embeddings.npy --queries queries.npy --output sweep.json
+    python tune_hnsw.py --vectors embeddings.npy --query-text queries.txt --backend opensearch
+
+Query embeddings come from --queries (.npy), --query-text (one query per
+line, embedded with Titan) or a held-out slice of the corpus. The current
+create_index.py settings are always measured as the baseline, and the
+recommended configuration is printed as a mapping fragment.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+SCRIPTS_DIR = Path(__file__).parent
+LAMBDA_DIR = SCRIPTS_DIR.parent / 'lamda'
+DIMENSION = 1024
+
+# What create_index.py ships today
+CURRENT = {'space_type': 'l2', 'm': 16, 'ef_construction': 512, 'ef_search': 512}
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def synthetic_vectors(count, dimension=DIMENSION, clusters=200, seed=42):
+    """Normalized, clustered vectors - uniform noise would make every config look bad"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension), dtype=np.float32)
+    labels = rng.integers(0, clusters, count)
+    noise = rng.standard_normal((count, dimension), dtype=np.float32) * 2.0
+    return normalize(centers[labels] + noise).astype(np.float32)
+
+def embed_query_text(path):
+    sys.path.insert(0, str(LAMBDA_DIR))
+    from ingestion_lambda import get_embedding
+    
+    with open(path, encoding='utf-8') as f:
+        queries = [line.strip() for line in f if line.strip()]
+    
+    embeddings = [get_embedding(query) for query in queries]
+    kept = [e for e in embeddings if e is not None]
+    print(f"  Embedded {len(kept)}/{len(queries)} queries with Titan")
+    return np.asarray(kept, dtype=np.float32)
+
+def load_vectors(args):
+    if args.vectors:
+        corpus = np.load(args.vectors).astype(np.float32)
+    else:
+        corpus = synthetic_vectors(args.synthetic + args.holdout, seed=args.seed)
+    
+    if args.queries:
+        queries = np.load(args.queries).astype(np.float32)
+    elif args.query_text:
+        queries = embed_query_text(args.query_text)
+    else:
+        # Held-out slice of the corpus, removed so queries never match themselves
+        order = np.random.default_rng(args.seed).permutation(len(corpus))
+        queries = corpus[order[:args.holdout]]
+        corpus = corpus[order[args.holdout:]]
+    
+    return corpus, queries
+
+def exact_neighbors(corpus, queries, k, block=256):
+    """Ground truth top-k by cosine similarity"""
+    corpus = normalize(corpus)
+    queries = normalize(queries)
+    result = np.empty((len(queries), k), dtype=np.int64)
+    
+    for start in range(0, len(queries), block):
+        scores = queries[start:start + block] @ corpus.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        rows = np.arange(len(top))[:, None]
+        result[start:start + block] = top[rows, np.argsort(-scores[rows, top], axis=1)]
+    
+    return result
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+class FaissBackend:
+    """In-process faiss HNSW - the engine the OpenSearch mapping selects"""
+    def __init__(self, threads):
+        import faiss
+        self.faiss = faiss
+        self.threads = threads
+        self.index = None
+        self.space_type = None
+    
+    def prepare(self, vectors):
+        if self.space_type == 'cosinesimil':
+            return normalize(vectors).astype(np.float32)
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+    
+    def build(self, corpus, space_type, m, ef_construction):
+        metric = self.faiss.METRIC_L2 if space_type == 'l2' else self.faiss.METRIC_INNER_PRODUCT
+        self.space_type = space_type
+        self.index = self.faiss.IndexHNSWFlat(corpus.shape[1], m, metric)
+        self.index.hnsw.efConstruction = ef_construction
+        
+        self.faiss.omp_set_num_threads(self.threads)
+        started = time.perf_counter()
+        self.index.add(self.prepare(corpus))
+        return time.perf_counter() - started
+    
+    def size_bytes(self):
+        return int(self.faiss.serialize_index(self.index).size)
+    
+    def set_ef_search(self, ef_search):
+        self.index.hnsw.efSearch = ef_search
+        # Latency is measured per query, as the query Lambda issues them
+        self.faiss.omp_set_num_threads(1)
+    
+    def search(self, query, k):
+        _, ids = self.index.search(self.prepare(query[None, :]), k)
+        return ids[0]
+    
+    def close(self):
+        self.index = None
+
+class OpenSearchBackend:
+    """Scratch indexes on a local OpenSearch node with the k-NN plugin"""
+    def __init__(self, url, batch_size=500):
+        from opensearchpy import OpenSearch, helpers
+        self.client = OpenSearch(hosts=[url], timeout=300)
+        self.helpers = helpers
+        self.batch_size = batch_size
+        self.index_name = None
+    
+    def build(self, corpus, space_type, m, ef_construction):
+        self.index_name = f"hnsw-tune-{space_type}-m{m}-efc{ef_construction}"
+        if self.client.indices.exists(index=self.index_name):
+            self.client.indices.delete(index=self.index_name)
+        
+        self.client.indices.create(index=self.index_name, body={
+            "settings": {"index": {"knn": True, "number_of_shards": 1, "number_of_replicas": 0,
+                                   "refresh_interval": "-1"}},
+            "mappings": {"properties": {"embedding": embedding_mapping(space_type, m, ef_construction)}}
+        })
+        
+        actions = (
+            {"_index": self.index_name, "_id": str(i), "embedding": vector.tolist()}
+            for i, vector in enumerate(corpus)
+        )
+        started = time.perf_counter()
+        self.helpers.bulk(self.client, actions, chunk_size=self.batch_size, request_timeout=300)
+        self.client.indices.refresh(index=self.index_name)
+        # One segment, so the graph is comparable to a settled production index
+        self.client.indices.forcemerge(index=self.index_name, max_num_segments=1, request_timeout=1800)
+        build_seconds = time.perf_counter() - started
+        
+        self.client.transport.perform_request('GET', f"/_plugins/_knn/warmup/{self.index_name}")
+        return build_seconds
+    
+    def size_bytes(self):
+        stats = self.client.indices.stats(index=self.index_name, metric='store')
+        return stats['_all']['primaries']['store']['size_in_bytes']
+    
+    def set_ef_search(self, ef_search):
+        self.client.indices.put_settings(
+            index=self.index_name, body={"index": {"knn.algo_param.ef_search": ef_search}}
+        )
+    
+    def search(self, query, k):
+        response = self.client.search(index=self.index_name, body={
+            "size": k,
+            "_source": False,
+            "query": {"knn": {"embedding": {"vector": query.tolist(), "k": k}}}
+        })
+        return [int(hit['_id']) for hit in response['hits']['hits']]
+    
+    def close(self):
+        if self.index_name:
+            self.client.indices.delete(index=self.index_name)
+            self.index_name = None
+
+def embedding_mapping(space_type, m, ef_construction, dimension=DIMENSION):
+    return {
+        "type": "knn_vector",
+        "dimension": dimension,
+        "method": {
+            "name": "hnsw",
+            "space_type": space_type,
+            "engine": "faiss",
+            "parameters": {
+                "ef_construction": ef_construction,
+                "m": m
+            }
+        }
+    }
+
+def measure_queries(backend, queries, k, warmup=20):
+    for query in queries[:warmup]:
+        backend.search(query, k)
+    
+    found = []
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        ids = backend.search(query, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        found.append(list(ids))
+    
+    return found, latencies
+
+def build_grid(args):
+    grid = {
+        (space_type, m, ef_construction)
+        for space_type in args.space
+        for m in args.m
+        for ef_construction in args.ef_construction
+    }
+    grid.add((CURRENT['space_type'], CURRENT['m'], CURRENT['ef_construction']))
+    return sorted(grid)
+
+def run_sweep(backend, corpus, queries, truth, args):
+    ef_values = sorted(set(args.ef_search) | {CURRENT['ef_search']})
+    results = []
+    
+    for space_type, m, ef_construction in build_grid(args):
+        print(f"Building space={space_type} m={m} ef_construction={ef_construction}...")
+        build_seconds = backend.build(corpus, space_type, m, ef_construction)
+        size = backend.size_bytes()
+        print(f"  built in {build_seconds:.1f}s, {size / (1024 * 1024):.1f} MB")
+        
+        try:
+            for ef_search in ef_values:
+                backend.set_ef_search(ef_search)
+                found, latencies = measure_queries(backend, queries, args.k)
+                result = {
+                    'space_type': space_type,
+                    'm': m,
+                    'ef_construction': ef_construction,
+                    'ef_search': ef_search,
+                    'recall': round(recall_at_k(found, truth), 4),
+                    'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+                    'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+                    'build_seconds': round(build_seconds, 2),
+                    'size_bytes': size,
+                }
+                result['current'] = all(result[name] == value for name, value in CURRENT.items())
+                results.append(result)
+                print_result(result)
+        finally:
+            backend.close()
+    
+    return results
+
+def recommend(results, target_recall):
+    """Fastest p95 among configs meeting the recall target, smaller/faster builds breaking ties"""
+    passing = [r for r in results if r['recall'] >= target_recall]
+    if not passing:
+        print(f"\n⚠️  No configuration reached recall {target_recall}; recommending the highest recall")
+        return max(results, key=lambda r: (r['recall'], -r['p95_ms']))
+    return min(passing, key=lambda r: (r['p95_ms'], r['size_bytes'], r['build_seconds']))
+
+def recommended_mapping(result):
+    return {
+        "settings": {
+            "index": {
+                "knn": True,
+                "knn.algo_param.ef_search": result['ef_search']
+            }
+        },
+        "mappings": {
+            "properties": {
+                "embedding": embedding_mapping(result['space_type'], result['m'], result['ef_construction'])
+            }
+        }
+    }
+
+def print_result(result):
+    marker = ' (current)' if result.get('current') else ''
+    print(f"  ef_search={result['ef_search']:<4} recall@k={result['recall']:.4f} "
+          f"p50={result['p50_ms']:.2f}ms p95={result['p95_ms']:.2f}ms{marker}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sweep HNSW parameters for the embedding field')
+    parser.add_argument('--vectors', help='.npy float32 matrix of corpus embeddings')
+    parser.add_argument('--synthetic', type=int, default=20000, help='synthetic corpus size without --vectors')
+    parser.add_argument('--queries', help='.npy float32 matrix of query embeddings')
+    parser.add_argument('--query-text', help='file with one query per line, embedded with Titan')
+    parser.add_argument('--holdout', type=int, default=500, help='corpus vectors held out as queries')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--space', nargs='+', default=['l2', 'innerproduct'],
+                        choices=['l2', 'innerproduct', 'cosinesimil'])
+    parser.add_argument('--m', nargs='+', type=int, default=[8, 16, 32])
+    parser.add_argument('--ef-construction', nargs='+', type=int, default=[128, 256, 512])
+    parser.add_argument('--ef-search', nargs='+', type=int, default=[32, 64, 128, 256, 512])
+    parser.add_argument('--target-recall', type=float, default=0.95)
+    parser.add_argument('--backend', choices=['faiss', 'opensearch'], default='faiss')
+    parser.add_argument('--opensearch-url', default='http://localhost:9200')
+    parser.add_argument('--threads', type=int, default=4, help='faiss build threads')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write all results and the recommendation as JSON')
+    args = parser.parse_args()
+    
+    print("=== HNSW Parameter Sweep ===\n")
+    
+    corpus, queries = load_vectors(args)
+    print(f"Corpus: {corpus.shape[0]} x {corpus.shape[1]}, queries: {len(queries)}, k={args.k}")
+    
+    started = time.perf_counter()
+    truth = exact_neighbors(corpus, queries, args.k)
+    print(f"✓ Exact neighbors in {time.perf_counter() - started:.1f}s\n")
+    
+    if args.backend == 'faiss':
+        backend = FaissBackend(args.threads)
+    else:
+        backend = OpenSearchBackend(args.opensearch_url)
+    
+    results = run_sweep(backend, corpus, queries, truth, args)
+    best = recommend(results, args.target_recall)
+    current = next(r for r in results if r['current'])
+    mapping = recommended_mapping(best)
+    
+    print("\n=== Recommendation ===")
+    print(f"Current:     space={current['space_type']} m={current['m']} "
+          f"ef_construction={current['ef_construction']} ef_search={current['ef_search']} "
+          f"recall={current['recall']:.4f} p95={current['p95_ms']:.2f}ms")
+    print(f"Recommended: space={best['space_type']} m={best['m']} "
+          f"ef_construction={best['ef_construction']} ef_search={best['ef_search']} "
+          f"recall={best['recall']:.4f} p95={best['p95_ms']:.2f}ms")
+    print("\nMapping for create_index.py:")
+    print(json.dumps(mapping, indent=2))
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'generated': datetime.utcnow().isoformat(),
+                'backend': args.backend,
+                'corpus_size': int(corpus.shape[0]),
+                'query_count': int(len(queries)),
+                'k': args.k,
+                'target_recall': args.target_recall,
+                'results': results,
+                'recommended': best,
+                'mapping': mapping,
+            }, f, indent=2)
+        print(f"\n✓ Results written to {args.output}")
@@ -13,10 +13,16 @@ lambda_client.update_function_configuration(
         'Variables': {
             'OPENSEARCH_ENDPOINT': os.getenv('OPENSEARCH_ENDPOINT'),
             'INDEX_NAME': os.getenv('OPENSEARCH_INDEX'),
+            'INDEX_PARTITIONING': os.getenv('INDEX_PARTITIONING', 'none'),
             'REGION': os.getenv('AWS_REGION'),
             'INTENTS_BUCKET': os.getenv('INTENTS_BUCKET'),
+            'LOCATIONS_URI': f"s3://{os.getenv('SOURCE_BUCKET')}/ingestion-state/locations.json",
+            'TYPEAHEAD_URI': f"s3://{os.getenv('SOURCE_BUCKET')}/ingestion-state/typeahead.json",
             'EMBEDDING_MODEL': os.getenv('EMBEDDING_MODEL'),
-            'CHAT_MODEL': os.getenv('CHAT_MODEL')
+            'CHAT_MODEL': os.getenv('CHAT_MODEL'),
+            'NARRATIVE_SECRET': os.getenv('NARRATIVE_SECRET', ''),
+            'COALESCE_BACKEND': os.getenv('COALESCE_BACKEND', 'none'),
+            'COALESCE_TABLE': os.getenv('COALESCE_TABLE', 'property-rag-query-cache')
         }
     }
 )
@@ -1,10 +1,14 @@
 const API_ENDPOINT = CONFIG.API_ENDPOINT;
+const NARRATIVE_ENDPOINT = API_ENDPOINT.replace(/\/chat$/, '/narrative');
 let userId = localStorage.getItem('propertyUserId');
 if (!userId) {
     userId = 'user_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
     localStorage.setItem('propertyUserId', userId);
 }
 
+// Scopes follow-up references ("the second one") to this page's conversation
+const sessionId = 'session_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
+
 let conversationHistory = [];
 let isProcessing = false;
 let queryCount = 0;
@@ -99,6 +103,7 @@ function formatPropertyCards(properties) {
                 <p class="price">${prop.asking_price_currency || 'AED'} ${price}</p>
                 <span class="status-badge ${statusClass}">${statusText}</span>
                 ${prop.listing_url ? `<br><a href="${prop.listing_url}" target="_blank">View Details →</a>` : ''}
+                ${prop.alternate_listings && prop.alternate_listings.length ? `<p><small>Also listed ${prop.alternate_listings.length} more time${prop.alternate_listings.length > 1 ? 's' : ''}</small></p>` : ''}
             </div>
         `;
     });
@@ -106,6 +111,55 @@ function formatPropertyCards(properties) {
     return html;
 }
 
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text || '';
+    return div.innerHTML;
+}
+
+function summarizeProperties(properties) {
+    if (!properties || properties.length === 0) return '';
+    return 'Showed: ' + properties.map(prop =>
+        `${prop.property_name || 'Property'} (${prop.asking_price_currency || 'AED'} ${(prop.asking_price || 0).toLocaleString()})`
+    ).join('; ');
+}
+
+async function loadNarrative(button, token, historyIndex) {
+    button.disabled = true;
+    button.textContent = 'Thinking...';
+
+    try {
+        const response = await fetch(NARRATIVE_ENDPOINT, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                narrative_token: token,
+                conversation_history: conversationHistory.slice(0, historyIndex)
+            })
+        });
+
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+
+        const data = await response.json();
+        const narrative = document.createElement('p');
+        narrative.textContent = data.response;
+        button.replaceWith(narrative);
+        conversationHistory[historyIndex] = {
+            role: 'assistant',
+            content: data.response
+        };
+        scrollToBottom();
+    } catch (error) {
+        console.error('Error:', error);
+        button.disabled = false;
+        button.textContent = '✨ Tell me more';
+    }
+}
+
 async function sendMessage() {
     const message = userInput.value.trim();
     
@@ -145,14 +199,24 @@ async function sendMessage() {
             },
             body: JSON.stringify({
                 user_id: userId,
+                session_id: sessionId,
                 query: message,
                 conversation_history: conversationHistory,
-                filters: {}
+                filters: {},
+                profile: 'cards',
+                response_mode: 'cards'
             })
         });
 
         removeTypingIndicator();
 
+        if (response.status === 429 || response.status === 503) {
+            const retryAfter = response.headers.get('Retry-After') || 'a few';
+            addMessage(`We're getting a lot of requests right now. Please try again in ${retryAfter} seconds.`);
+            conversationHistory.pop();
+            return;
+        }
+
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
@@ -164,17 +228,26 @@ async function sendMessage() {
         // Check if it's a count query
         if (data.is_count_query) {
             responseContent = data.response;
+        } else if (data.follow_up) {
+            // Answer about listings from an earlier response, shown again below it
+            responseContent = escapeHtml(data.response);
+            responseContent += formatPropertyCards(data.properties);
         } else if (data.properties && data.properties.length > 0) {
             responseContent = `Found <strong>${data.properties_found} properties</strong> matching your search!`;
             responseContent += formatPropertyCards(data.properties);
+            if (data.narrative_token) {
+                responseContent += `<button class="narrative-btn" onclick="loadNarrative(this, '${data.narrative_token}', ${conversationHistory.length})">✨ Tell me more</button>`;
+            }
         } else {
             responseContent = "Sorry, I couldn't find any properties matching your criteria. Try adjusting your search!";
         }
 
         addMessage(responseContent);
+        // Cards-only responses carry no prose - history gets a plain summary
+        // until the narrative is requested
         conversationHistory.push({
             role: 'assistant',
-            content: data.response || responseContent
+            content: data.response || summarizeProperties(data.properties) || responseContent
         });
 
         if (data.intent) {